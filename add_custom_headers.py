@@ -1,14 +1,14 @@
 """
 Script to add custom headers to an existing workspace.
 """
-from app import app, db
+from app import create_app, db
 from models import Workspace, WorkspaceHeader
 
 def add_custom_headers_to_workspace(workspace_id=1):
     """
     Add custom headers to an existing workspace.
     """
-    with app.app_context():
+    with create_app().app_context():
         # Check if workspace exists
         workspace = Workspace.query.get(workspace_id)
         if not workspace:
@@ -17,7 +17,7 @@ def add_custom_headers_to_workspace(workspace_id=1):
         
         # Get current highest order
         max_order = db.session.query(db.func.max(WorkspaceHeader.order))\
-            .filter_by(workspace_id=workspace_id).scalar() or 0
+            .filter_by(workspace_id=workspace_id, dropped_at=None).scalar() or 0
         
         # Add custom headers
         custom_headers = ["source", "notes", "priority"]
@@ -25,7 +25,8 @@ def add_custom_headers_to_workspace(workspace_id=1):
             # Check if header already exists
             existing = WorkspaceHeader.query.filter_by(
                 workspace_id=workspace_id, 
-                header_name=header
+                header_name=header,
+                dropped_at=None
             ).first()
             
             if existing:
@@ -1,12 +1,21 @@
+"""
+Application factory.
+
+Importing this module only defines the database handle; nothing connects to
+the database or loads the routes until create_app() is called. The schema is
+not created on startup either: run `flask --app main init-db` (safe to
+repeat) when deploying, before the web and import workers start.
+"""
 import os
 import logging
+
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+from config import config
 
 class Base(DeclarativeBase):
     pass
@@ -14,38 +23,62 @@ class Base(DeclarativeBase):
 # Initialize SQLAlchemy with Base class
 db = SQLAlchemy(model_class=Base)
 
-# Create Flask app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "dev_secret_key")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)  # needed for url_for to generate with https
-
-# Configure database
-database_url = os.environ.get("DATABASE_URL")
-# Modify the DATABASE_URL to use postgresql:// instead of postgres:// if needed
-if database_url and database_url.startswith("postgres://"):
-    database_url = database_url.replace("postgres://", "postgresql://", 1)
-app.config["SQLALCHEMY_DATABASE_URI"] = database_url
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
-# Initialize the app with SQLAlchemy
-db.init_app(app)
-
-# Create tables
-with app.app_context():
+
+def create_app(config_name=None, overrides=None):
+    """Create and configure the application
+
+    Args:
+        config_name: Key of config.config; defaults to APP_CONFIG, then 'production'
+        overrides: Optional dict of settings applied over the configuration
+
+    Returns:
+        Flask app
+    """
+    config_name = config_name or os.environ.get('APP_CONFIG', 'production')
+
+    app = Flask(__name__)
+    app.config.from_object(config[config_name])
+    app.config.update(overrides or {})
+    logging.basicConfig(level=app.config['LOG_LEVEL'])
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)  # needed for url_for to generate with https
+
+    # Initialize the app with SQLAlchemy
+    db.init_app(app)
+    import models  # Import models to register them
+
+    # Import and register blueprints
+    from routes.admin import admin_bp
+    from routes.user import user_bp
+    from routes.auth import auth_bp
+    from routes.setup import setup_bp
+    from routes.health import health_bp
+
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(user_bp)
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(setup_bp)
+    app.register_blueprint(health_bp)
+
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(rebuild_lead_stats_command)
+    return app
+
+
+def init_db():
+    """Create the tables (with their indexes, triggers and seed rows) that do not exist yet"""
     import models  # Import models to register them
     db.create_all()
 
-# Import and register blueprints
-from routes.admin import admin_bp
-from routes.user import user_bp
-from routes.auth import auth_bp
-from routes.setup import setup_bp
 
-app.register_blueprint(admin_bp)
-app.register_blueprint(user_bp)
-app.register_blueprint(auth_bp)
-app.register_blueprint(setup_bp)
+@click.command('init-db')
+def init_db_command():
+    """Create missing database tables."""
+    init_db()
+    click.echo('Database tables created')
+
+
+@click.command('rebuild-lead-stats')
+def rebuild_lead_stats_command():
+    """Recompute the lead statistics rollup from the leads."""
+    from lead_stats import rebuild
+    click.echo(f"Rebuilt lead_daily_stats: {rebuild()} rows")
@@ -0,0 +1,169 @@
+"""
+Automatic lead assignment.
+
+A workspace's assignment rule lists the users eligible for its leads and a
+strategy for sharing unassigned leads among them:
+
+- round_robin: in turn, continuing where the previous run stopped
+- weighted: so that each user's open leads stay proportional to their weight
+- least_loaded: always to the user with the fewest open leads
+
+A run reads every member's open lead count once, from the statistics rollup,
+decides the whole batch in memory (a heap keyed on load for the load-based
+strategies) and writes it with one UPDATE per user and chunk of ids. Runs
+follow every import into a workspace whose rule has auto_assign set, and can
+be started from the admin pages or the command line:
+
+    python assignment.py --workspace 3
+"""
+import heapq
+import logging
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import func
+
+from app import db
+from config import CLOSED_LEAD_STATUSES
+from lead_ops import assign_leads, select_lead_ids
+from lead_queue import claimable
+from models import AssignmentRule, Lead, LeadDailyStat
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ['round_robin', 'weighted', 'least_loaded']
+
+
+def open_lead_counts(user_ids):
+    """Number of open (not closed) leads assigned to each user, across workspaces
+
+    Returns:
+        dict: user id -> open lead count, for every given user
+    """
+    counts = dict.fromkeys(user_ids, 0)
+    if not counts:
+        return counts
+    rows = (
+        db.session.query(LeadDailyStat.assigned_to, func.sum(LeadDailyStat.lead_count))
+        .filter(LeadDailyStat.assigned_to.in_(list(counts)),
+                LeadDailyStat.status.notin_(CLOSED_LEAD_STATUSES))
+        .group_by(LeadDailyStat.assigned_to)
+    )
+    for user_id, count in rows:
+        counts[user_id] = int(count or 0)
+    return counts
+
+
+def plan_assignments(count, members, strategy, loads, start=0):
+    """Decide which user gets each of count leads
+
+    Args:
+        count: Number of leads to assign
+        members: List of (user id, weight); members with no weight get nothing
+            from the weighted strategy
+        strategy: One of STRATEGIES
+        loads: User id -> current open lead count
+        start: Round-robin position to continue from
+
+    Returns:
+        (list of user ids, one per lead, next round-robin position)
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown assignment strategy: {strategy}")
+    if strategy == 'weighted':
+        members = [(user_id, weight) for user_id, weight in members if weight > 0]
+    if not members or count <= 0:
+        return [], start
+
+    if strategy == 'round_robin':
+        size = len(members)
+        return [members[(start + i) % size][0] for i in range(count)], (start + count) % size
+
+    # Pop the user whose load after taking one more lead is lowest; ties go to list order
+    heap = []
+    for position, (user_id, weight) in enumerate(members):
+        load = loads.get(user_id, 0)
+        weight = weight if strategy == 'weighted' else 1
+        heap.append(((load + 1) / weight, position, user_id, load, weight))
+    heapq.heapify(heap)
+
+    assignees = []
+    for _ in range(count):
+        _, position, user_id, load, weight = heap[0]
+        assignees.append(user_id)
+        load += 1
+        heapq.heapreplace(heap, ((load + 1) / weight, position, user_id, load, weight))
+    return assignees, start
+
+
+def auto_assign(workspace_id, lead_ids=None):
+    """Distribute a workspace's unassigned leads according to its assignment rule
+
+    Args:
+        workspace_id: Workspace id
+        lead_ids: Only consider these leads; all unassigned leads of the workspace if None
+
+    Returns:
+        dict: user id -> number of leads assigned to them
+    """
+    rule = AssignmentRule.query.filter_by(workspace_id=workspace_id).first()
+    if rule is None or not rule.members:
+        return {}
+    members = [(member.user_id, member.weight) for member in rule.members]
+
+    # Leads an agent is working through the work queue are left to them
+    unassigned = db.session.query(Lead.id).filter(Lead.workspace_id == workspace_id, *claimable(datetime.utcnow()))
+    if lead_ids is None:
+        lead_ids = [lead_id for (lead_id,) in unassigned.order_by(Lead.created_at, Lead.id)]
+    else:
+        lead_ids = select_lead_ids(lead_ids, query=unassigned)
+    if not lead_ids:
+        return {}
+
+    loads = open_lead_counts([user_id for user_id, _ in members])
+    assignees, next_position = plan_assignments(len(lead_ids), members, rule.strategy, loads, rule.next_position)
+
+    by_user = defaultdict(list)
+    for lead_id, user_id in zip(lead_ids, assignees):
+        by_user[user_id].append(lead_id)
+
+    # Leads assigned, or claimed from the work queue, since they were read are left alone
+    assigned = {user_id: assign_leads(ids, user_id, only_unassigned=True) for user_id, ids in by_user.items()}
+
+    rule.next_position = next_position
+    db.session.commit()
+    logger.info("Auto-assigned %s leads in workspace %s (%s)", sum(assigned.values()), workspace_id, rule.strategy)
+    return assigned
+
+
+def assign_after_import(workspace_id):
+    """Run auto_assign for a workspace if its rule asks for it; never raises
+
+    Returns:
+        dict of assignments as from auto_assign, or None if not enabled
+    """
+    try:
+        rule = AssignmentRule.query.filter_by(workspace_id=workspace_id, auto_assign=True).first()
+        if rule is None:
+            return None
+        return auto_assign(workspace_id)
+    except Exception:
+        logger.exception("Automatic assignment after import failed for workspace %s", workspace_id)
+        db.session.rollback()
+        return None
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description='Assign unassigned leads by workspace assignment rules.')
+    parser.add_argument('--workspace', type=int, action='append',
+                        help='Workspace id (repeatable); every workspace with a rule if omitted')
+    args = parser.parse_args()
+
+    with create_app().app_context():
+        workspace_ids = args.workspace or [rule.workspace_id for rule in AssignmentRule.query.all()]
+        for workspace_id in workspace_ids:
+            assigned = auto_assign(workspace_id)
+            print(f"Workspace {workspace_id}: assigned {sum(assigned.values())} leads to {len(assigned)} users")
@@ -1,15 +1,23 @@
+import hashlib
 import os
+import time
 import jwt
 from datetime import datetime, timedelta
 from functools import wraps
 from flask import request, jsonify, session, redirect, url_for, g, flash
-from models import User
+import reference_data
+from result_cache import MemoryCache
 
 # JWT configuration
 JWT_SECRET = os.environ.get('SESSION_SECRET', 'dev_secret_key')
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_DELTA = timedelta(days=1)
 
+# Verified token payloads held per process, keyed by a digest of the token, each until the token expires
+TOKEN_CACHE_SIZE = 4096
+
+_token_payloads = MemoryCache(TOKEN_CACHE_SIZE)
+
 def generate_token(user_id, role):
     """Generate JWT token for a user"""
     payload = {
@@ -29,6 +37,54 @@ def decode_token(token):
     except jwt.InvalidTokenError:
         return {'error': 'Invalid token'}
 
+def verify_token(token):
+    """Decode a JWT token, reusing the payload of a token verified before
+
+    Returns:
+        The payload, or a dict with an 'error' key as from decode_token
+    """
+    key = hashlib.sha256(token.encode()).hexdigest()
+    payload = _token_payloads.get(key)
+    if payload is not None:
+        return payload
+    payload = decode_token(token)
+    if 'error' not in payload:
+        # MemoryCache expiry is on the monotonic clock; the token's is wall-clock
+        _token_payloads.set(key, payload, payload['exp'] - time.time())
+    return payload
+
+def user_identity(user_id):
+    """Username and current role of a user, from the reference data cache
+
+    Costs the request's one read of the reference data version. The cache is
+    reloaded in every process after any change to users, so an edited role
+    or a deleted user applies from the next request on.
+
+    Returns:
+        dict with user_id, username and role, or None if the user no longer exists
+    """
+    user = reference_data.user(user_id)
+    if user is None:
+        return None
+    return {'user_id': user.id, 'username': user.username, 'role': user.role}
+
+def authenticate(token):
+    """Resolve a session token to its user and set g.user_id, g.role and g.username
+
+    Returns:
+        True if the token is valid and its user still exists
+    """
+    payload = verify_token(token)
+    if 'error' in payload:
+        return False
+    identity = user_identity(payload['user_id'])
+    if identity is None:
+        return False
+    g.user_id = identity['user_id']
+    g.role = identity['role']
+    g.username = identity['username']
+    return True
+
 def login_required(f):
     """Decorator to check if user is logged in"""
     @wraps(f)
@@ -39,14 +95,10 @@ def login_required(f):
             flash('Please log in to access this page', 'warning')
             return redirect(url_for('auth.login'))
         
-        payload = decode_token(token)
-        if 'error' in payload:
+        if not authenticate(token):
             flash('Session expired. Please log in again', 'warning')
             return redirect(url_for('auth.login'))
         
-        g.user_id = payload['user_id']
-        g.role = payload['role']
-        
         return f(*args, **kwargs)
     return decorated_function
 
@@ -60,17 +112,13 @@ def admin_required(f):
             flash('Please log in to access this page', 'warning')
             return redirect(url_for('auth.login'))
         
-        payload = decode_token(token)
-        if 'error' in payload:
+        if not authenticate(token):
             flash('Session expired. Please log in again', 'warning')
             return redirect(url_for('auth.login'))
         
-        if payload['role'] != 'admin':
+        if g.role != 'admin':
             flash('You do not have permission to access this page', 'danger')
             return redirect(url_for('user.leads'))
         
-        g.user_id = payload['user_id']
-        g.role = payload['role']
-        
         return f(*args, **kwargs)
     return decorated_function
@@ -0,0 +1,1244 @@
+"""
+Performance benchmarks for the Lead Management System.
+
+Each benchmark is a subcommand, for example:
+
+    python benchmarks.py normalize --rows 20000
+
+Benchmarks that need a database use DATABASE_URL, falling back to an
+in-memory SQLite database.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import pandas as pd
+
+from app import create_app
+
+app = create_app()
+
+STATUSES = ['New', 'Contacted', 'Qualified', 'Proposal', 'Negotiation', 'Won', 'Lost']
+CUSTOM_HEADERS = ['source', 'notes', 'priority']
+
+
+def make_lead_frame(rows, seed=42):
+    """Build a DataFrame shaped like a vendor CSV, read as text"""
+    rng = random.Random(seed)
+    data = {
+        'first_name': [f' First{i} ' for i in range(rows)],
+        'last_name': [f'Last{i}' for i in range(rows)],
+        'email': [f'lead{i}@example.com' for i in range(rows)],
+        'phone': [f'555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}' for _ in range(rows)],
+        'city': [rng.choice(['New York', 'Chicago', 'Houston', None]) for _ in range(rows)],
+        'state': [rng.choice(['NY', 'IL', 'TX']) for _ in range(rows)],
+        'status': [rng.choice(STATUSES) for _ in range(rows)],
+        'bank': [rng.choice(['Chase', 'Wells Fargo', None]) for _ in range(rows)],
+        'date': [f'{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/2025' for _ in range(rows)],
+        'source': [rng.choice(['Website', 'Referral', None]) for _ in range(rows)],
+        'notes': [f'Note {i}' for i in range(rows)],
+        'priority': [rng.choice(['High', 'Medium', 'Low']) for _ in range(rows)],
+    }
+    return pd.DataFrame(data, dtype='string')
+
+
+def timed(func, *args, repeat=3):
+    """Return the best wall time of several runs"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def count_queries(func, *args):
+    """Run func and return (result, number of SQL statements it executed)"""
+    from sqlalchemy import event
+    from app import db
+
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', on_execute)
+    try:
+        result = func(*args)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', on_execute)
+    return result, len(statements)
+
+
+def seed_workspace(rows, users=5, seed=42):
+    """Create a workspace with custom headers and rows leads spread over users
+
+    Returns:
+        (workspace id, list of lead ids)
+    """
+    from sqlalchemy import update
+    from app import db
+    from config import DEFAULT_LEAD_FIELDS
+    from importer import BulkLeadImporter
+    from lead_stats import track_lead_stats
+    from models import Lead, User, Workspace, WorkspaceHeader
+
+    db.create_all()
+    owners = []
+    for i in range(users):
+        user = User(username=f'bench_user_{seed}_{i}', email=f'bench{seed}_{i}@example.com', role='user')
+        user.set_password('bench')
+        db.session.add(user)
+        owners.append(user)
+    db.session.flush()
+
+    workspace = Workspace(name=f'Bench {seed}', created_by=owners[0].id)
+    db.session.add(workspace)
+    db.session.flush()
+    header_names = DEFAULT_LEAD_FIELDS + ['assigned_to', 'workspace'] + CUSTOM_HEADERS
+    headers = {}
+    for order, name in enumerate(header_names):
+        headers[name] = WorkspaceHeader(workspace_id=workspace.id, header_name=name,
+                                        is_default=name not in CUSTOM_HEADERS, order=order)
+        db.session.add(headers[name])
+    db.session.commit()
+
+    df = make_lead_frame(rows, seed=seed)
+    mapping = {column: column for column in df.columns}
+    custom = {name: headers[name] for name in CUSTOM_HEADERS}
+    BulkLeadImporter(workspace.id, mapping, custom).import_dataframe(df)
+
+    lead_ids = [lead_id for (lead_id,) in db.session.query(Lead.id).filter_by(workspace_id=workspace.id).order_by(Lead.id)]
+    # Assign most leads, leaving some unassigned
+    rng = random.Random(seed)
+    assignees = [user.id for user in owners] + [None]
+    with track_lead_stats(lead_ids):
+        db.session.execute(update(Lead), [
+            {'id': lead_id, 'assigned_to': rng.choice(assignees)} for lead_id in lead_ids
+        ])
+    db.session.commit()
+    return workspace.id, lead_ids
+
+
+def bench_normalize(args):
+    """Compare chunk-level normalization with the old per-row cell handling"""
+    from importer import BulkLeadImporter
+    from models import Lead
+
+    df = make_lead_frame(args.rows)
+    mapping = {column: column for column in df.columns}
+    workspace_headers = {name: SimpleNamespace(id=i) for i, name in enumerate(CUSTOM_HEADERS, start=1)}
+    text_fields = ['first_name', 'last_name', 'email', 'phone', 'city', 'state', 'status', 'bank']
+
+    def per_row():
+        # The pre-bulk importer: pd.isna, setattr and pd.to_datetime for every cell
+        for _, row in df.iterrows():
+            lead = Lead(workspace_id=1)
+            custom = []
+            for csv_header, db_field in mapping.items():
+                value = row[csv_header]
+                if db_field in text_fields:
+                    setattr(lead, db_field, None if pd.isna(value) else value)
+                elif db_field == 'date':
+                    lead.date = None if pd.isna(value) else pd.to_datetime(value).date()
+                elif db_field in workspace_headers:
+                    custom.append((workspace_headers[db_field].id, None if pd.isna(value) else str(value)))
+
+    def vectorized():
+        importer = BulkLeadImporter(1, mapping, workspace_headers)
+        lead_columns, custom_columns = importer.normalize(df, importer._plan(list(df.columns)))
+        importer.build_rows(lead_columns, custom_columns, 0, len(df), None)
+
+    with app.app_context():
+        old = timed(per_row, repeat=1)
+        new = timed(vectorized)
+
+    print(f"rows:        {args.rows}")
+    print(f"per-row:     {old:.3f}s ({args.rows / old:,.0f} rows/sec)")
+    print(f"vectorized:  {new:.3f}s ({args.rows / new:,.0f} rows/sec)")
+    print(f"speedup:     {old / new:.1f}x")
+
+
+def row_by_row_import(path, workspace_id, header_mapping):
+    """The pre-bulk process_csv_upload: one savepoint, flush and set of ORM objects per row
+
+    Each savepoint is released after its row; the original left them all
+    open, which fails on large files before the final commit.
+
+    Returns:
+        Number of leads imported
+    """
+    from datetime import datetime
+    from app import db
+    from models import Lead, LeadCustomField, WorkspaceHeader
+
+    text_fields = ['first_name', 'last_name', 'email', 'phone', 'city', 'state', 'status', 'bank']
+    df = pd.read_csv(path)
+    workspace_headers = {h.header_name: h for h in WorkspaceHeader.query.filter_by(workspace_id=workspace_id)}
+    imported = 0
+    for _, row in df.iterrows():
+        with db.session.begin_nested():
+            lead = Lead(workspace_id=workspace_id, created_at=datetime.utcnow())
+            for csv_header, db_field in header_mapping.items():
+                if db_field in text_fields:
+                    setattr(lead, db_field, None if pd.isna(row[csv_header]) else row[csv_header])
+                elif db_field == 'date':
+                    lead.date = None if pd.isna(row[csv_header]) else pd.to_datetime(row[csv_header]).date()
+            db.session.add(lead)
+            db.session.flush()
+            for csv_header, header_name in header_mapping.items():
+                if header_name in workspace_headers and header_name not in text_fields + ['date']:
+                    db.session.add(LeadCustomField(lead_id=lead.id, header_id=workspace_headers[header_name].id,
+                                                   value=None if pd.isna(row[csv_header]) else str(row[csv_header])))
+        imported += 1
+    db.session.commit()
+    return imported
+
+
+def bench_import(args):
+    """Compare end-to-end CSV import throughput: the old row-by-row path vs the bulk importer
+
+    Both import the same generated file into their own workspace. The bulk
+    importer also maintains the search index, the statistics rollup and the
+    dedupe keys, which the old path did not.
+    """
+    import tempfile
+    from sqlalchemy import func, select
+    from app import db, init_db
+    from models import Lead
+    from utils import process_csv_upload
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'leads.csv')
+        make_lead_frame(args.rows).to_csv(path, index=False)
+        mapping = {column: column for column in make_lead_frame(1).columns}
+
+        with app.app_context():
+            init_db()
+            old_workspace, _ = seed_workspace(0, seed=1)
+            new_workspace, _ = seed_workspace(0, seed=2)
+
+            start = time.perf_counter()
+            row_by_row_import(path, old_workspace, mapping)
+            old = time.perf_counter() - start
+
+            start = time.perf_counter()
+            success_count, error_count, _ = process_csv_upload(path, new_workspace, mapping)
+            new = time.perf_counter() - start
+
+            counts = dict(db.session.execute(
+                select(Lead.workspace_id, func.count()).where(Lead.workspace_id.in_([old_workspace, new_workspace]))
+                .group_by(Lead.workspace_id)
+            ).all())
+
+    print(f"rows:         {args.rows}")
+    print(f"row-by-row:   {old:.2f}s ({args.rows / old:,.0f} rows/sec), {counts.get(old_workspace, 0)} leads")
+    print(f"bulk:         {new:.2f}s ({args.rows / new:,.0f} rows/sec), {counts.get(new_workspace, 0)} leads, "
+          f"{error_count} errors")
+    print(f"speedup:      {old / new:.1f}x")
+    if counts.get(old_workspace) != args.rows or success_count != args.rows:
+        print("FAIL: an import did not load every row")
+        return 1
+    return 0
+
+
+def bench_export(args):
+    """Compare the bulk-loading CSV export with the old per-row lookups, in time and queries"""
+    from app import db
+    from models import Lead, User, Workspace
+    from utils import export_leads_to_csv, get_workspace_headers
+
+    def per_row(leads, workspace_id):
+        # The pre-plan exporter: a User/Workspace lookup and a custom field scan per cell
+        headers = get_workspace_headers(workspace_id)
+        for lead in leads:
+            row = []
+            for header in headers:
+                name = header.header_name
+                if name == 'assigned_to':
+                    user = User.query.get(lead.assigned_to) if lead.assigned_to else None
+                    row.append(user.username if user else '')
+                elif name == 'workspace':
+                    workspace = Workspace.query.get(lead.workspace_id)
+                    row.append(workspace.name if workspace else '')
+                elif name == 'date':
+                    row.append(lead.date.strftime('%m/%d/%Y') if lead.date else '')
+                elif hasattr(Lead, name):
+                    row.append(getattr(lead, name) or '')
+                else:
+                    custom_field = next((cf for cf in lead.custom_fields if cf.header.header_name == name), None)
+                    row.append(custom_field.value if custom_field else '')
+
+    def run(func, workspace_id, lead_ids):
+        # Expire the session so every run starts without cached objects
+        db.session.expire_all()
+        leads = Lead.query.filter(Lead.id.in_(lead_ids)).order_by(Lead.id).all()
+        return count_queries(func, leads, workspace_id)
+
+    with app.app_context():
+        workspace_id, lead_ids = seed_workspace(args.rows)
+
+        print(f"{'rows':>8} {'old queries':>12} {'new queries':>12} {'old time':>10} {'new time':>10}")
+        counts = []
+        for rows in (args.rows // 4, args.rows // 2, args.rows):
+            ids = lead_ids[:rows]
+            start = time.perf_counter()
+            _, old_queries = run(per_row, workspace_id, ids)
+            old = time.perf_counter() - start
+            start = time.perf_counter()
+            _, new_queries = run(export_leads_to_csv, workspace_id, ids)
+            new = time.perf_counter() - start
+            counts.append((rows, new_queries))
+            print(f"{rows:>8} {old_queries:>12} {new_queries:>12} {old:>9.3f}s {new:>9.3f}s")
+
+    # The plan needs a fixed number of queries per chunk, never per row or per column
+    from utils import EXPORT_CHUNK_ROWS
+    worst = max(queries / -(-rows // EXPORT_CHUNK_ROWS) for rows, queries in counts)
+    print(f"queries per {EXPORT_CHUNK_ROWS}-row chunk: {worst:.1f}")
+    if worst > 4:
+        print("FAIL: export queries grow with the number of rows")
+        return 1
+    return 0
+
+
+def spread_created_at(lead_ids, days, seed=42):
+    """Spread leads' created_at over the last days days"""
+    from datetime import datetime, timedelta
+    from sqlalchemy import update
+    from app import db
+    from lead_stats import track_lead_stats
+    from models import Lead
+
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    with track_lead_stats(lead_ids):
+        db.session.execute(update(Lead), [
+            {'id': lead_id, 'created_at': now - timedelta(days=rng.randint(0, days), seconds=rng.randint(0, 86399))}
+            for lead_id in lead_ids
+        ])
+    db.session.commit()
+
+
+def dashboard_windows():
+    """The date windows shown on the admin dashboard"""
+    from datetime import datetime, timedelta
+
+    today = datetime.utcnow().date()
+    start_of_week = today - timedelta(days=today.weekday())
+    return [
+        (today, today + timedelta(days=1)),
+        (start_of_week, start_of_week + timedelta(days=7)),
+        (today.replace(day=1), today + timedelta(days=1)),
+        (None, None),
+    ]
+
+
+def bench_stats(args):
+    """Compare the dashboard's statistics from the rollup with scanning the leads table
+
+    The rollup is timed on its own (a result cache miss) and through the
+    result cache once warm (a hit).
+    """
+    from sqlalchemy import and_, case, func
+    from app import db
+    from config import LEAD_STATUSES
+    from models import Lead, User, Workspace
+    from utils import _compute_lead_stats_windows, get_lead_stats_windows
+
+    def per_count(windows):
+        # The pre-aggregation get_lead_stats, called once per window
+        for start_date, end_date in windows:
+            query = Lead.query
+            if start_date:
+                query = query.filter(Lead.created_at >= start_date)
+            if end_date:
+                query = query.filter(Lead.created_at <= end_date)
+            query.count()
+            query.filter(Lead.assigned_to.isnot(None)).count()
+            for status in LEAD_STATUSES:
+                query.filter(Lead.status == status).count()
+            for workspace in Workspace.query.all():
+                query.filter(Lead.workspace_id == workspace.id).count()
+            for user in User.query.all():
+                query.filter(Lead.assigned_to == user.id).count()
+
+    def grouped_scan(windows):
+        # One GROUP BY over the leads table with a conditional count per window
+        counts = []
+        for start_date, end_date in windows:
+            conditions = []
+            if start_date:
+                conditions.append(Lead.created_at >= start_date)
+            if end_date:
+                conditions.append(Lead.created_at <= end_date)
+            counts.append(func.count(case((and_(*conditions), 1))) if conditions else func.count())
+        db.session.query(Lead.workspace_id, Lead.assigned_to, Lead.status, *counts).group_by(
+            Lead.workspace_id, Lead.assigned_to, Lead.status).all()
+
+    with app.app_context():
+        for i in range(args.workspaces):
+            _, lead_ids = seed_workspace(args.rows // args.workspaces, users=args.users, seed=i)
+            spread_created_at(lead_ids, args.days, seed=i)
+
+        windows = dashboard_windows()
+        old_time = timed(lambda: count_queries(per_count, windows), repeat=1)
+        _, old_queries = count_queries(per_count, windows)
+        scan_time = timed(grouped_scan, windows)
+        miss_time = timed(_compute_lead_stats_windows, windows)
+        _, miss_queries = count_queries(_compute_lead_stats_windows, windows)
+        get_lead_stats_windows(windows)
+        hit_time = timed(get_lead_stats_windows, windows)
+        _, hit_queries = count_queries(get_lead_stats_windows, windows)
+
+    print(f"leads:         {args.rows} in {args.workspaces} workspaces, {args.workspaces * args.users} users")
+    print(f"per-count:     {old_time:.3f}s, {old_queries} queries")
+    print(f"grouped scan:  {scan_time:.3f}s, 1 query (counts only)")
+    print(f"rollup:        {miss_time:.3f}s, {miss_queries} queries (cache miss)")
+    print(f"cached:        {hit_time:.3f}s, {hit_queries} queries (cache hit)")
+
+
+# The per-row user/workspace lookups admin/leads.html used to do
+NESTED_LOOKUP_ROWS = """
+{% for lead in leads %}<tr>
+<td>{% for user in users %}{% if user.id == lead.assigned_to %}{{ user.username }}{% endif %}{% endfor %}</td>
+<td>{% for workspace in workspaces %}{% if workspace.id == lead.workspace_id %}{{ workspace.name }}{% endif %}{% endfor %}</td>
+</tr>{% endfor %}
+"""
+
+
+def bench_render(args):
+    """Time rendering the admin lead grid as rows and users grow
+
+    "old cells" renders only the assignee/workspace cells the way the template
+    used to, with a loop over all users and workspaces per row.
+    """
+    from datetime import datetime
+    from flask import g, render_template, render_template_string
+    from config import LEAD_STATUSES
+    from utils import KeysetPage
+
+    def fixtures(rows, users):
+        rng = random.Random(42)
+        user_list = [SimpleNamespace(id=i, username=f'user{i}') for i in range(1, users + 1)]
+        workspace_list = [SimpleNamespace(id=i, name=f'Workspace {i}') for i in range(1, args.workspaces + 1)]
+        leads = [
+            SimpleNamespace(
+                id=i, duplicate_of=None, first_name=f'First{i}', last_name=f'Last{i}',
+                email=f'lead{i}@example.com', phone='555-123-4567', status=rng.choice(STATUSES),
+                city='Chicago', state='IL', created_at=datetime(2025, 1, 1),
+                assigned_to=rng.choice([None] + [user.id for user in user_list]),
+                workspace_id=rng.choice(workspace_list).id,
+            )
+            for i in range(1, rows + 1)
+        ]
+        return leads, user_list, workspace_list
+
+    def render_grid(leads, users, workspaces):
+        return render_template(
+            'admin/leads.html', leads=leads, page=KeysetPage(leads, len(leads)), page_args={},
+            workspaces=workspaces, users=users,
+            workspace_names={workspace.id: workspace.name for workspace in workspaces},
+            user_names={user.id: user.username for user in users},
+            statuses=LEAD_STATUSES, selected_workspace=None, selected_status=None,
+            selected_start_date=None, selected_end_date=None, selected_assigned_to=None
+        )
+
+    def render_nested(leads, users, workspaces):
+        return render_template_string(NESTED_LOOKUP_ROWS, leads=leads, users=users, workspaces=workspaces)
+
+    print(f"{'rows':>6} {'users':>6} {'page':>10} {'per row':>10} {'old cells':>12}")
+    with app.test_request_context('/admin/leads'):
+        g.role, g.username, g.user_id = 'admin', 'admin', 1
+        for users in args.users:
+            for rows in args.rows:
+                leads, user_list, workspace_list = fixtures(rows, users)
+                new = timed(render_grid, leads, user_list, workspace_list)
+                old = timed(render_nested, leads, user_list, workspace_list, repeat=1)
+                print(f"{rows:>6} {users:>6} {new * 1000:>8.1f}ms {new / rows * 1e6:>8.1f}us {old * 1000:>10.1f}ms")
+
+
+def capture_statements(func, *args):
+    """Run func and return the (statement, parameters) pairs it executed"""
+    from sqlalchemy import event
+    from app import db
+
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', on_execute)
+    try:
+        func(*args)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', on_execute)
+    return statements
+
+
+# Tables a hot query must never read in full
+INDEXED_TABLES = ('leads', 'lead_custom_fields', 'workspace_headers', 'lead_search_documents')
+
+
+def hot_queries(workspace_id, user_id):
+    """The lead queries the web pages run most
+
+    Each function runs the real code path, so the plans checked are those of
+    the statements the routes actually send.
+
+    Returns:
+        List of (name, function, whether walking a whole index in order is expected)
+    """
+    from datetime import datetime, timedelta
+    from werkzeug.datastructures import MultiDict
+    from app import db
+    from exporter import LeadExportPlan
+    from lead_query import apply_lead_filters, query_leads, search_leads
+    from lead_queue import claim_leads
+    from models import Lead
+    from utils import get_workspace_headers, keyset_paginate
+
+    today = datetime.utcnow().strftime('%Y-%m-%d')
+    week_ago = (datetime.utcnow() - timedelta(days=7)).strftime('%Y-%m-%d')
+
+    def lead_list(query, **args):
+        return lambda: keyset_paginate(apply_lead_filters(query, MultiDict(args)), per_page=100)
+
+    def next_page(query, **args):
+        cursor = keyset_paginate(apply_lead_filters(query, MultiDict(args)), per_page=2).next_cursor
+        return lambda: keyset_paginate(apply_lead_filters(query, MultiDict(args)), after=cursor, per_page=100)
+
+    def lead_api(**args):
+        return lambda: query_leads(apply_lead_filters(Lead.query, MultiDict(args)), ['id', 'first_name'])
+
+    def custom_values():
+        leads = Lead.query.filter_by(workspace_id=workspace_id).limit(500).all()
+        LeadExportPlan(CUSTOM_HEADERS).rows(leads)
+
+    # The reference data cache reads its tables in full once; what stays hot is its version lookup
+    get_workspace_headers(workspace_id)
+
+    user_leads = Lead.query.filter_by(assigned_to=user_id)
+    return [
+        # Unfiltered, the first page reads the newest rows of the (created_at, id) index and stops
+        ('admin leads', lead_list(Lead.query), True),
+        ('admin leads, next page', next_page(Lead.query), False),
+        ('admin leads by workspace', lead_list(Lead.query, workspace_id=workspace_id), False),
+        ('admin leads by workspace, next page', next_page(Lead.query, workspace_id=workspace_id), False),
+        ('admin leads by workspace and status', lead_list(Lead.query, workspace_id=workspace_id, status='Won'), False),
+        ('admin leads by assignee', lead_list(Lead.query, assigned_to=user_id), False),
+        ('admin leads by date range', lead_list(Lead.query, start_date=week_ago, end_date=today), False),
+        ('user leads', lead_list(user_leads), False),
+        ('user leads, next page', next_page(user_leads), False),
+        ('user leads by day', lead_list(user_leads, date=today), False),
+        ('lead API by workspace', lead_api(workspace_id=workspace_id), False),
+        ('workspace lead count', lambda: Lead.query.filter_by(workspace_id=workspace_id).count(), False),
+        ('leads of a user', lambda: db.session.query(Lead.id).filter_by(assigned_to=user_id).all(), False),
+        ('workspace headers', lambda: get_workspace_headers(workspace_id), False),
+        ('export custom values', custom_values, False),
+        ('work queue claim', lambda: claim_leads(workspace_id, user_id, 5), False),
+        ('admin leads by search', lead_list(Lead.query, q='last12'), False),
+        ('lead search', lambda: search_leads(Lead.query, 'referral last12', ['id', 'first_name']), False),
+    ]
+
+
+def full_scans(statement, parameters, index_walk_ok=False):
+    """Tables of INDEXED_TABLES the database would read in full for a statement
+
+    Walking a whole index without a search condition counts as a full read
+    unless index_walk_ok.
+    """
+    from app import db
+
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        # Judge whether an index can be used, not whether the planner prefers one on a small table
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        plan = connection.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + statement, parameters).scalar()
+        nodes, scanned = [plan[0]['Plan']], []
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.get('Plans', []))
+            if node.get('Relation Name') not in INDEXED_TABLES:
+                continue
+            if node['Node Type'] in ('Seq Scan', 'Bitmap Heap Scan') and 'Recheck Cond' not in node:
+                scanned.append(node['Relation Name'])
+            elif node['Node Type'] in ('Index Scan', 'Index Only Scan') and 'Index Cond' not in node \
+                    and not index_walk_ok:
+                scanned.append(node['Relation Name'])
+        return scanned
+    if connection.dialect.name == 'sqlite':
+        # "SCAN leads" reads the table; "SCAN leads USING INDEX ..." reads all of an index in order
+        scanned = []
+        for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters):
+            words = row[-1].split()
+            if words[0] == 'SCAN' and words[1] in INDEXED_TABLES and (len(words) == 2 or not index_walk_ok):
+                scanned.append(words[1])
+        return scanned
+    raise RuntimeError(f"No query plan check for {connection.dialect.name}")
+
+
+def bench_plans(args):
+    """Check that every hot lead query is answered through an index
+
+    Exits non-zero if any of them reads leads, lead_custom_fields or
+    workspace_headers in full.
+    """
+    from app import db
+    from models import User
+
+    with app.app_context():
+        # Several workspaces, so that filtering on one is selective
+        for seed in range(args.workspaces):
+            workspace_id, lead_ids = seed_workspace(args.rows // args.workspaces, seed=seed)
+            spread_created_at(lead_ids, 30, seed=seed)
+        user_id = User.query.filter(User.username.like(f'bench_user_{seed}_%')).first().id
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+
+        failures = 0
+        for name, func, index_walk_ok in hot_queries(workspace_id, user_id):
+            scanned = set()
+            for statement, parameters in capture_statements(func):
+                scanned.update(full_scans(statement, parameters, index_walk_ok))
+            db.session.rollback()
+            if scanned:
+                failures += 1
+                print(f"FAIL  {name}: full scan of {', '.join(sorted(scanned))}")
+            else:
+                print(f"ok    {name}")
+
+    if failures:
+        print(f"{failures} hot queries fall back to a full scan")
+        return 1
+    return 0
+
+
+def bench_search(args):
+    """Compare ranked index search with the LIKE scan it replaces"""
+    from sqlalchemy import or_
+    from app import db
+    from lead_query import search_leads
+    from models import Lead, LeadCustomField
+
+    def like_scan(text):
+        # Substring match on every text column and custom value: reads both tables in full
+        pattern = f'%{text}%'
+        custom = db.session.query(LeadCustomField.lead_id).filter(LeadCustomField.value.ilike(pattern))
+        criteria = [getattr(Lead, field).ilike(pattern) for field in ('first_name', 'last_name', 'email', 'phone')]
+        return Lead.query.filter(or_(*criteria, Lead.id.in_(custom))).limit(50).all()
+
+    with app.app_context():
+        for seed in range(args.workspaces):
+            seed_workspace(args.rows // args.workspaces, seed=seed)
+
+        print(f"{'search':>24} {'matches':>8} {'LIKE scan':>10} {'index':>10}")
+        for text in ('last1234', '555-12', 'note 77', 'referral first9'):
+            matches = len(search_leads(Lead.query, text, ['id'], limit=50)['rows'])
+            scan = timed(like_scan, text.split()[0])
+            indexed = timed(lambda: search_leads(Lead.query, text, ['id'], limit=50))
+            print(f"{text:>24} {matches:>8} {scan * 1000:>8.1f}ms {indexed * 1000:>8.1f}ms")
+    return 0
+
+
+def bench_auth(args):
+    """Compare per-request authentication: JWT decode plus User lookup vs the cached fast path
+
+    The cached path is not free: each request reads the reference data
+    version once, so that a user edited in another process is seen on the
+    next request. Exits non-zero if it makes any other query, or if a
+    changed role is not seen on the next request.
+    """
+    import auth
+    from sqlalchemy import update
+    from app import db
+    from models import User
+
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench_auth', email='bench_auth@example.com', role='admin')
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.commit()
+        token = auth.generate_token(user.id, user.role)
+
+        def uncached():
+            for _ in range(args.requests):
+                with app.test_request_context():
+                    payload = auth.decode_token(token)
+                    db.session.get(User, payload['user_id'])
+                    db.session.expire_all()  # A new request starts with an empty session
+
+        def cached():
+            for _ in range(args.requests):
+                with app.test_request_context():
+                    auth.authenticate(token)
+                    db.session.expire_all()
+
+        def role_seen():
+            with app.test_request_context():
+                auth.authenticate(token)
+                return g.role
+
+        from flask import g
+        role_seen()
+        _, queries = count_queries(cached)
+        old, new = timed(uncached), timed(cached)
+        print(f"{args.requests} requests: decode + lookup {old * 1000:.1f}ms, cached {new * 1000:.1f}ms, "
+              f"{queries} queries on the cached path ({queries / args.requests:g} per request, "
+              f"the reference data version read)")
+
+        # Demote the user the way another process would, without telling this one
+        db.session.execute(update(User).where(User.id == user.id).values(role='user'))
+        db.session.commit()
+        demoted = role_seen()
+        print(f"Role on the request after demotion: {demoted}")
+
+    failed = False
+    if queries > args.requests:
+        print("FAIL: authenticated requests query more than the reference data version once")
+        failed = True
+    if demoted != 'user':
+        print("FAIL: the demoted user kept their old role")
+        failed = True
+    return 1 if failed else 0
+
+
+def bench_reference(args):
+    """Check that hot views read users, workspaces and headers from the reference data cache
+
+    Exits non-zero if a view queries those tables once the cache is warm.
+    """
+    import re
+    from app import db
+    from models import User
+
+    reference_table = re.compile(r'\bFROM (users|workspaces|workspace_headers)\b')
+    with app.app_context():
+        workspace_id, lead_ids = seed_workspace(args.rows)
+        admin = User(username='bench_admin', email='bench_admin@example.com', role='admin')
+        admin.set_password('bench')
+        db.session.add(admin)
+        db.session.commit()
+        client = app.test_client()
+        client.post('/login', data={'username': 'bench_admin', 'password': 'bench'})
+
+        views = [
+            ('admin leads', lambda: client.get('/admin/leads')),
+            ('admin leads by workspace', lambda: client.get(f'/admin/leads?workspace_id={workspace_id}')),
+            ('lead API with names', lambda: client.get(
+                f'/admin/api/leads?workspace_id={workspace_id}&fields=id,assigned_to,workspace,source')),
+            ('reports', lambda: client.get('/admin/reports')),
+            ('workspaces', lambda: client.get('/admin/workspaces')),
+            ('users', lambda: client.get('/admin/users')),
+            ('upload form', lambda: client.get('/admin/leads/upload')),
+            ('export', lambda: client.post('/admin/leads/export', data={'lead_ids[]': lead_ids[:100]}).get_data()),
+        ]
+        failures = 0
+        for name, view in views:
+            view()  # Warm the cache
+            statements = [statement for statement, _ in capture_statements(view)]
+            reference = [statement for statement in statements if reference_table.search(statement)]
+            if reference:
+                failures += 1
+            print(f"{'FAIL' if reference else 'ok':<5} {name}: {len(statements)} queries, {len(reference)} reference")
+
+    if failures:
+        print(f"{failures} views still query reference data")
+        return 1
+    return 0
+
+
+def bench_headers(args):
+    """Workspace save cost vs workspace size, and the background purge of a dropped header
+
+    Each workspace gets one rename, one move, one drop and one add. Exits
+    non-zero if the save's query count grows with the number of leads or a
+    renamed header loses its values.
+    """
+    from sqlalchemy import func, select
+    from app import db
+    from models import LeadCustomField
+    import reference_data
+    import workspace_schema
+
+    failures = 0
+    save_queries = set()
+    with app.app_context():
+        for seed, rows in enumerate(args.rows):
+            workspace_id, _ = seed_workspace(rows, seed=seed)
+            headers = {header.header_name: header.id for header in reference_data.workspace_headers(workspace_id)}
+
+            def value_count(header_id):
+                return db.session.scalar(select(func.count()).where(LeadCustomField.header_id == header_id))
+
+            notes_values = value_count(headers['notes'])
+            submitted = [(headers['priority'], 'priority')]
+            submitted += [(header_id, 'comments' if name == 'notes' else name)
+                          for name, header_id in headers.items() if name not in ('priority', 'source')]
+            submitted.append((None, 'region'))
+
+            def save():
+                workspace_schema.apply_header_changes(workspace_id, submitted)
+                db.session.commit()
+
+            start = time.perf_counter()
+            _, queries = count_queries(save)
+            saved = time.perf_counter() - start
+            save_queries.add(queries)
+
+            start = time.perf_counter()
+            chunks = workspace_schema.purge_dropped_headers()
+            purged = time.perf_counter() - start
+
+            kept = value_count(headers['notes']) == notes_values
+            left = value_count(headers['source'])
+            if not kept or left:
+                failures += 1
+            print(f"{rows} leads: save {saved * 1000:.1f}ms ({queries} queries), "
+                  f"purge {purged * 1000:.1f}ms in {chunks} chunks, renamed values kept: {kept}, "
+                  f"dropped values left: {left}")
+
+    if len(save_queries) > 1:
+        print("FAIL: saving a workspace costs more queries as it grows")
+        return 1
+    if failures:
+        print("FAIL: header values were lost or not purged")
+        return 1
+    return 0
+
+
+# Run in a fresh interpreter per measurement: start the application the old
+# way ('eager': pandas and the import engine loaded, schema created on import)
+# or the new way, then serve the login page and a lead list
+STARTUP_CHILD = '''
+import json, resource, sys, time
+start = time.perf_counter()
+if sys.argv[1] == 'eager':
+    import pandas, csv_stream, importer
+from app import create_app, db, init_db
+app = create_app()
+if sys.argv[1] == 'eager':
+    with app.app_context():
+        init_db()
+startup = time.perf_counter() - start
+
+from models import User
+with app.app_context():
+    init_db()
+    user = User(username='bench_startup', email='bench_startup@example.com', role='admin')
+    user.set_password('bench')
+    db.session.add(user)
+    db.session.commit()
+    client = app.test_client()
+    client.get('/login')
+    client.post('/login', data={'username': 'bench_startup', 'password': 'bench'})
+    client.get('/admin/leads')
+    client.get('/admin/api/leads')
+print(json.dumps({'startup': startup, 'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  'pandas': 'pandas' in sys.modules}))
+'''
+
+
+def bench_startup(args):
+    """Web worker start time and memory: eager imports and schema creation vs the app factory
+
+    Exits non-zero if serving login and lead lists loads pandas.
+    """
+    import json
+    import statistics
+    import subprocess
+
+    env = dict(os.environ, LOG_LEVEL='WARNING')
+    results = {}
+    for mode in ('eager', 'lazy'):
+        runs = []
+        for _ in range(args.runs):
+            output = subprocess.run([sys.executable, '-c', STARTUP_CHILD, mode], env=env, check=True,
+                                    capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+        results[mode] = runs
+        print(f"{mode:<6} startup {statistics.median(run['startup'] for run in runs) * 1000:.0f}ms, "
+              f"RSS {max(run['rss_kb'] for run in runs) / 1024:.1f}MB, "
+              f"pandas loaded: {any(run['pandas'] for run in runs)}")
+
+    if any(run['pandas'] for run in results['lazy']):
+        print("FAIL: serving login and lead lists loads pandas")
+        return 1
+    return 0
+
+
+def in_shared_database(args):
+    """Re-run a check that needs several connections against a temporary SQLite file
+
+    An in-memory SQLite database lives in one connection, so concurrent
+    sessions cannot be tested on it.
+
+    Returns:
+        The re-run's exit status, or None if the database is already shared
+    """
+    import subprocess
+    import tempfile
+
+    if app.config['SQLALCHEMY_DATABASE_URI'] not in ('sqlite://', 'sqlite:///:memory:'):
+        return None
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{directory}/bench.db')
+        return subprocess.run([sys.executable, os.path.abspath(__file__), args.benchmark], env=env).returncode
+
+
+def interleave(first, second, delay=0.5):
+    """Run two writers in their own sessions, the second starting while the first is inside its write
+
+    first(ready) must call ready() once it has read what it is about to
+    change; second starts then, and first continues after delay seconds
+    (or as soon as second finishes).
+    """
+    import threading
+
+    started = threading.Event()
+    finished = threading.Event()
+    errors = []
+
+    def run(func, *args):
+        try:
+            with app.app_context():
+                func(*args)
+        except Exception as e:
+            errors.append(e)
+            started.set()
+
+    def ready():
+        started.set()
+        finished.wait(delay)
+
+    def run_second():
+        started.wait()
+        run(second)
+        finished.set()
+
+    threads = [threading.Thread(target=run, args=(first, ready)), threading.Thread(target=run_second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def bench_stats_race(args):
+    """Check that concurrent writes to the same leads keep the statistics rollup exact
+
+    Two sessions change the same leads at once, the second reading them while
+    the first is between its read and its write. Exits non-zero if
+    lead_daily_stats then differs from the counts of the leads.
+    """
+    from sqlalchemy import select, update
+    from app import db, init_db
+    from lead_stats import KEY_COLUMNS, lead_stat_keys, track_lead_stats
+    from models import Lead, LeadDailyStat, User
+
+    rerun = in_shared_database(args)
+    if rerun is not None:
+        return rerun
+
+    with app.app_context():
+        init_db()
+        workspace_id, lead_ids = seed_workspace(20)
+        user_ids = db.session.scalars(select(User.id).order_by(User.id)).all()
+
+    def change(lead_ids, ready=None, **values):
+        with track_lead_stats(lead_ids):
+            if ready:
+                ready()
+            db.session.execute(update(Lead).where(Lead.id.in_(lead_ids)).values(**values)
+                               .execution_options(synchronize_session=False))
+        db.session.commit()
+
+    scenarios = [
+        ('assign vs assign', dict(assigned_to=user_ids[0]), dict(assigned_to=user_ids[1])),
+        ('assign vs unassign', dict(assigned_to=user_ids[2]), dict(assigned_to=None)),
+        ('status vs assign', dict(status='Won'), dict(assigned_to=user_ids[3])),
+    ]
+    failures = 0
+    for index, (name, first, second) in enumerate(scenarios):
+        chunk = lead_ids[index * 5:(index + 1) * 5]
+        interleave(lambda ready: change(chunk, ready, **first), lambda: change(chunk, **second))
+        with app.app_context():
+            expected = lead_stat_keys(lead_ids)
+            stored = {tuple(getattr(row, column) for column in KEY_COLUMNS): row.lead_count
+                      for row in LeadDailyStat.query.filter_by(workspace_id=workspace_id)}
+            drift = {key for key in expected.keys() | stored.keys() if expected[key] != stored.get(key, 0)}
+        if drift:
+            failures += 1
+        print(f"{'FAIL' if drift else 'ok':<5} {name}: {len(drift)} rollup rows differ from the leads")
+
+    if failures:
+        print("Run `flask --app main rebuild-lead-stats` to repair a drifted rollup")
+        return 1
+    return 0
+
+
+def bench_assign_race(args):
+    """Check that automatic assignment leaves leads alone once an agent claims them
+
+    An agent claims leads from the work queue while auto-assignment is
+    between reading the unassigned leads and assigning them. Exits non-zero
+    if a lead under an unexpired lease ends up assigned to someone else, or
+    if a lead whose lease expired is not assigned.
+    """
+    from datetime import datetime, timedelta
+    from sqlalchemy import select, update
+    from app import db, init_db
+    from lead_ops import assign_leads
+    from lead_queue import claim_leads, claimable
+    from models import Lead, User
+
+    rerun = in_shared_database(args)
+    if rerun is not None:
+        return rerun
+
+    with app.app_context():
+        init_db()
+        workspace_id, lead_ids = seed_workspace(20)
+        user_ids = db.session.scalars(select(User.id).order_by(User.id)).all()
+        assign_leads(lead_ids, None)
+        # An old claim whose lease has run out
+        db.session.execute(update(Lead).where(Lead.id == lead_ids[-1])
+                           .values(claimed_by=user_ids[2], lease_expires_at=datetime.utcnow() - timedelta(minutes=1)))
+        db.session.commit()
+
+    claimed = []
+
+    def auto_assign(ready):
+        # What assignment.auto_assign does, with the agent's claim landing between read and write
+        ids = db.session.scalars(select(Lead.id).where(Lead.workspace_id == workspace_id,
+                                                       *claimable(datetime.utcnow()))).all()
+        ready()
+        assign_leads(ids, user_ids[0], only_unassigned=True)
+
+    def claim():
+        claimed.extend(lead.id for lead in claim_leads(workspace_id, user_ids[1], count=5))
+
+    interleave(auto_assign, claim)
+
+    with app.app_context():
+        taken = db.session.scalars(select(Lead.id).where(Lead.id.in_(claimed), Lead.assigned_to.isnot(None))).all()
+        expired = db.session.get(Lead, lead_ids[-1]).assigned_to
+
+    print(f"{'FAIL' if taken else 'ok':<5} {len(claimed)} claimed leads, {len(taken)} assigned to someone else")
+    print(f"{'FAIL' if expired != user_ids[0] else 'ok':<5} lead with an expired lease assigned: {expired is not None}")
+    return 1 if taken or not claimed or expired != user_ids[0] else 0
+
+
+def bench_csv_headers(args):
+    """Check that a CSV with repeated and blank headers reads the same through pandas and pyarrow
+
+    The mapping step names the columns as pandas does ('name', 'name.1',
+    'Unnamed: 2'); exits non-zero if either chunk reader names them
+    differently or returns different values, or if an import loses the
+    values of a renamed column.
+    """
+    import csv
+    import io
+    from sqlalchemy import select
+    from app import db, init_db
+    from csv_stream import iter_csv_chunks, pa_csv, read_csv_header
+    from models import Lead
+    from utils import process_csv_upload
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['first_name', 'last_name', '', 'last_name', 'email'])
+    for i in range(args.rows):
+        writer.writerow([f'First{i}', f'Last{i}', f'blank{i}', f'Other{i}', f'lead{i}@example.com'])
+    data = buffer.getvalue().encode()
+
+    headers, _ = read_csv_header(data)
+    print(f"mapping step: {headers}")
+    readers = [('pandas', False)] + ([('pyarrow', True)] if pa_csv is not None else [])
+    frames = {}
+    failed = False
+    for name, use_arrow in readers:
+        chunks = list(iter_csv_chunks(data, chunk_size=max(1, args.rows // 3), use_arrow=use_arrow))
+        frames[name] = pd.concat(chunks, ignore_index=True)
+        columns = {tuple(chunk.columns) for chunk in chunks}
+        ok = columns == {tuple(headers)}
+        failed |= not ok
+        print(f"{'ok' if ok else 'FAIL':<5} {name}: {len(chunks)} chunks, columns {sorted(columns)}")
+    if 'pyarrow' in frames:
+        same = frames['pandas'].equals(frames['pyarrow'])
+        failed |= not same
+        print(f"{'ok' if same else 'FAIL':<5} pandas and pyarrow values {'match' if same else 'differ'}")
+    else:
+        print("pyarrow is not installed; only the pandas reader was checked")
+
+    with app.app_context():
+        init_db()
+        workspace_id, _ = seed_workspace(0)
+        # The second last_name column holds the value to keep
+        process_csv_upload(data, workspace_id, {'first_name': 'first_name', 'last_name.1': 'last_name',
+                                                'email': 'email'})
+        last_names = db.session.scalars(select(Lead.last_name).where(Lead.workspace_id == workspace_id)).all()
+    ok = len(last_names) == args.rows and set(last_names) == {f'Other{i}' for i in range(args.rows)}
+    failed |= not ok
+    print(f"{'ok' if ok else 'FAIL':<5} import mapped 'last_name.1': {len(last_names)} leads")
+    return 1 if failed else 0
+
+
+def bench_dedupe_batches(args):
+    """Check that the 'update' duplicate policy gives the same leads whatever the batch size
+
+    Imports a file of new leads, repeats of them and repeats of leads
+    already stored, once a row per batch (every duplicate lands in a later
+    batch) and once in a single batch (every duplicate repeats an earlier
+    row of its batch). Exits non-zero if the two workspaces end up with
+    different leads, custom values or counts.
+    """
+    import csv
+    import io
+    from app import db, init_db
+    from custom_fields import load_custom_values
+    from importer import ImportResult
+    from models import Lead
+    from utils import process_csv_upload
+
+    columns = ['first_name', 'last_name', 'email', 'phone', 'city', 'source']
+
+    def csv_bytes(rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        writer.writerows(rows)
+        return buffer.getvalue().encode()
+
+    existing = csv_bytes([(f'Old{i}', 'Lead', f'old{i}@example.com', f'555-000-{i:04d}', 'Houston', 'Website')
+                          for i in range(args.rows)])
+    rows = []
+    for i in range(args.rows):
+        rows += [
+            (f'New{i}', 'Lead', f'new{i}@example.com', f'555-100-{i:04d}', 'Chicago', 'Referral'),
+            # Blank values keep what is stored
+            ('', '', f'new{i}@example.com', '', 'Boston', ''),
+            # Matched on phone; its new email then identifies the lead
+            (f'Renamed{i}', '', f'alt{i}@example.com', f'555-100-{i:04d}', '', ''),
+            ('', '', f'alt{i}@example.com', '', 'Denver', 'Import'),
+            # Stored leads, matched on email and then on the phone that gave them
+            ('', '', f'old{i}@example.com', f'555-200-{i:04d}', 'Austin', ''),
+            ('', 'Updated', '', f'555-200-{i:04d}', '', 'Import'),
+        ]
+    data = csv_bytes(rows)
+    mapping = {column: column for column in columns}
+
+    outcomes = {}
+    with app.app_context():
+        init_db()
+        for seed, batch_size in [(1, 1), (2, len(rows))]:
+            workspace_id, _ = seed_workspace(0, seed=seed)
+            process_csv_upload(existing, workspace_id, mapping)
+            result = ImportResult()
+            process_csv_upload(data, workspace_id, mapping, batch_size=batch_size, result=result,
+                               dedupe_policy='update', dedupe_on='email_or_phone')
+            leads = db.session.query(Lead).filter_by(workspace_id=workspace_id).order_by(Lead.id).all()
+            custom = load_custom_values(leads, CUSTOM_HEADERS)
+            outcomes[batch_size] = (
+                [(lead.first_name, lead.last_name, lead.email, lead.phone, lead.city, custom[lead.id].get('source'))
+                 for lead in leads],
+                (result.success_count, result.updated_count, result.skipped_count, result.error_count),
+            )
+
+    failed = False
+    for batch_size, (leads, counts) in outcomes.items():
+        print(f"batch size {batch_size:>5}: {len(leads)} leads; success, updated, skipped, errors {counts}")
+    (across_leads, across_counts), (within_leads, within_counts) = outcomes.values()
+    for label, ok in [('leads and custom values match', across_leads == within_leads),
+                      ('counts match', across_counts == within_counts),
+                      ('every duplicate updated a lead',
+                       len(across_leads) == len(within_leads) == 2 * args.rows)]:
+        failed |= not ok
+        print(f"{'ok' if ok else 'FAIL':<5} {label}")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run performance benchmarks.')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    normalize = subparsers.add_parser('normalize', help='Import normalization: per-row vs vectorized')
+    normalize.add_argument('--rows', type=int, default=20000, help='Number of CSV rows')
+    normalize.set_defaults(func=bench_normalize)
+
+    import_ = subparsers.add_parser('import', help='CSV import throughput: row-by-row vs bulk importer')
+    import_.add_argument('--rows', type=int, default=5000, help='Number of CSV rows')
+    import_.set_defaults(func=bench_import)
+
+    export = subparsers.add_parser('export', help='CSV export: per-row lookups vs bulk-loaded plan')
+    export.add_argument('--rows', type=int, default=4000, help='Number of leads')
+    export.set_defaults(func=bench_export)
+
+    stats = subparsers.add_parser('stats', help='Dashboard statistics: per-count queries, grouped scan and rollup')
+    stats.add_argument('--rows', type=int, default=50000, help='Number of leads')
+    stats.add_argument('--workspaces', type=int, default=5, help='Number of workspaces')
+    stats.add_argument('--users', type=int, default=5, help='Users per workspace')
+    stats.add_argument('--days', type=int, default=365, help='Days of lead history')
+    stats.set_defaults(func=bench_stats)
+
+    render = subparsers.add_parser('render', help='Admin lead grid render time vs rows and users')
+    render.add_argument('--rows', type=int, nargs='+', default=[100, 500, 1000], help='Rows per page')
+    render.add_argument('--users', type=int, nargs='+', default=[10, 100, 1000], help='Number of users')
+    render.add_argument('--workspaces', type=int, default=20, help='Number of workspaces')
+    render.set_defaults(func=bench_render)
+
+    plans = subparsers.add_parser('plans', help='Check that hot lead queries use an index (exits 1 on a full scan)')
+    plans.add_argument('--rows', type=int, default=8000, help='Number of leads')
+    plans.add_argument('--workspaces', type=int, default=4, help='Number of workspaces')
+    plans.set_defaults(func=bench_plans)
+
+    search = subparsers.add_parser('search', help='Lead search: LIKE scan vs search index')
+    search.add_argument('--rows', type=int, default=50000, help='Number of leads')
+    search.add_argument('--workspaces', type=int, default=5, help='Number of workspaces')
+    search.set_defaults(func=bench_search)
+
+    auth = subparsers.add_parser('auth', help='Per-request authentication: decode and lookup vs cached (one version read)')
+    auth.add_argument('--requests', type=int, default=2000, help='Number of requests')
+    auth.set_defaults(func=bench_auth)
+
+    reference = subparsers.add_parser('reference', help='Check hot views make no reference data queries')
+    reference.add_argument('--rows', type=int, default=500, help='Number of leads')
+    reference.set_defaults(func=bench_reference)
+
+    headers = subparsers.add_parser('headers', help='Workspace header save vs workspace size, and dropped header purge')
+    headers.add_argument('--rows', type=int, nargs='+', default=[1000, 10000], help='Leads per workspace')
+    headers.set_defaults(func=bench_headers)
+
+    startup = subparsers.add_parser('startup', help='Web worker start time and RSS: eager imports vs app factory')
+    startup.add_argument('--runs', type=int, default=5, help='Interpreters started per mode')
+    startup.set_defaults(func=bench_startup)
+
+    stats_race = subparsers.add_parser('stats-race', help='Check concurrent lead writes keep the statistics rollup exact')
+    stats_race.set_defaults(func=bench_stats_race)
+
+    assign_race = subparsers.add_parser('assign-race', help='Check auto-assignment skips leads claimed from the work queue')
+    assign_race.set_defaults(func=bench_assign_race)
+
+    csv_headers = subparsers.add_parser('csv-headers', help='Check repeated CSV headers read the same with pandas and pyarrow')
+    csv_headers.add_argument('--rows', type=int, default=1000, help='Number of CSV rows')
+    csv_headers.set_defaults(func=bench_csv_headers)
+
+    dedupe_batches = subparsers.add_parser('dedupe-batches',
+                                           help="Check the 'update' duplicate policy does not depend on batch size")
+    dedupe_batches.add_argument('--rows', type=int, default=200, help='Number of new leads')
+    dedupe_batches.set_defaults(func=bench_dedupe_batches)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,20 +1,51 @@
 import os
 
+def _database_url():
+    url = os.environ.get('DATABASE_URL')
+    # Some hosts still hand out postgres:// URLs, which SQLAlchemy no longer accepts
+    if url and url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+def engine_options(pool_size=None, max_overflow=None):
+    """SQLAlchemy engine options
+
+    Args:
+        pool_size: Connections kept per process; DB_POOL_SIZE (set per web worker by
+            gunicorn.conf.py) by default, else SQLAlchemy's default
+        max_overflow: Extra connections allowed under load; DB_MAX_OVERFLOW by default
+    """
+    options = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+    if pool_size is None and os.environ.get('DB_POOL_SIZE'):
+        pool_size = int(os.environ['DB_POOL_SIZE'])
+    if max_overflow is None:
+        max_overflow = int(os.environ.get('DB_MAX_OVERFLOW', 0))
+    # SQLite's pools take no size
+    if pool_size is not None and not (_database_url() or '').startswith('sqlite'):
+        options.update(
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        )
+    return options
+
 class Config:
     """Base configuration"""
     DEBUG = False
     TESTING = False
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
     SECRET_KEY = os.environ.get('SESSION_SECRET', 'dev_secret_key')
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
+    SQLALCHEMY_DATABASE_URI = _database_url()
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SQLALCHEMY_ENGINE_OPTIONS = {
-        "pool_recycle": 300,
-        "pool_pre_ping": True,
-    }
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options()
 
 class DevelopmentConfig(Config):
     """Development configuration"""
     DEBUG = True
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG')
 
 class ProductionConfig(Config):
     """Production configuration"""
@@ -40,6 +71,9 @@ DEFAULT_LEAD_FIELDS = [
     'date'
 ]
 
+# Lead columns that are copied straight from an import as text
+LEAD_TEXT_FIELDS = ['first_name', 'last_name', 'email', 'phone', 'city', 'state', 'status', 'bank']
+
 # Lead statuses
 LEAD_STATUSES = [
     'New',
@@ -50,3 +84,6 @@ LEAD_STATUSES = [
     'Won',
     'Lost'
 ]
+
+# Statuses of leads that are finished with; every other status counts toward a user's open leads
+CLOSED_LEAD_STATUSES = ['Won', 'Lost']
@@ -4,14 +4,17 @@ Run this script to add an admin user to the database.
 """
 import os
 import sys
-from app import app, db
+from app import create_app, db, init_db
 from models import User
 
 def create_admin_user(username, email, password):
     """
     Create an admin user if it doesn't already exist.
     """
-    with app.app_context():
+    with create_app().app_context():
+        # This is usually the first script run against a new database
+        init_db()
+        
         # Check if user already exists
         existing_user = User.query.filter_by(username=username).first()
         if existing_user:
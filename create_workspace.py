@@ -1,14 +1,14 @@
 """
 Script to create a sample workspace in the Lead Management System.
 """
-from app import app, db
+from app import create_app, db
 from models import User, Workspace, WorkspaceHeader
 
 def create_default_workspace():
     """
     Create a default workspace with standard headers if none exists.
     """
-    with app.app_context():
+    with create_app().app_context():
         # Get admin user
         admin = User.query.filter_by(role='admin').first()
         
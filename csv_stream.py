@@ -0,0 +1,194 @@
+"""
+Streaming CSV reader for lead uploads.
+
+Files are never loaded whole: the delimiter and encoding are sniffed from the
+first few kilobytes, the mapping step reads only the header plus a handful of
+sample rows, and imports walk the file in fixed-size DataFrame chunks. When
+pyarrow is installed its multithreaded streaming reader is used, otherwise
+pandas' C parser with ``chunksize``.
+
+Every column is read as text so values such as phone numbers keep their
+leading zeros; type conversion is left to the importer.
+"""
+import codecs
+import csv
+import io
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # pragma: no cover - pyarrow is optional
+    pa = None
+    pa_csv = None
+
+# Number of bytes inspected when sniffing delimiter and encoding
+SNIFF_BYTES = 64 * 1024
+
+# Number of rows per DataFrame chunk during import
+DEFAULT_CHUNK_SIZE = 50000
+
+# Number of data rows read for the header mapping step
+DEFAULT_SAMPLE_ROWS = 5
+
+CANDIDATE_DELIMITERS = ',;\t|'
+FALLBACK_ENCODING = 'cp1252'
+
+
+class CsvFormat:
+    """Delimiter and encoding detected for a CSV file"""
+
+    def __init__(self, delimiter=',', encoding='utf-8'):
+        self.delimiter = delimiter
+        self.encoding = encoding
+
+    def __repr__(self):
+        return f"CsvFormat(delimiter={self.delimiter!r}, encoding={self.encoding!r})"
+
+
+def _detect_encoding(sample):
+    """Guess the encoding of a byte sample"""
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.startswith(codecs.BOM_UTF16_LE) or sample.startswith(codecs.BOM_UTF16_BE):
+        return 'utf-16'
+    try:
+        # The sample may end in the middle of a multi-byte character
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+
+
+def sniff_bytes(sample):
+    """Detect the CsvFormat of a byte sample taken from the start of a file"""
+    encoding = _detect_encoding(sample)
+    text = sample.decode(encoding, errors='ignore')
+
+    # Only sniff complete lines so a truncated last row can't confuse the sniffer
+    if '\n' in text:
+        text = text[:text.rfind('\n')]
+
+    try:
+        delimiter = csv.Sniffer().sniff(text, delimiters=CANDIDATE_DELIMITERS).delimiter
+    except csv.Error:
+        delimiter = ','
+
+    return CsvFormat(delimiter=delimiter, encoding=encoding)
+
+
+def sniff_csv(source):
+    """Detect the CsvFormat of a file path or seekable binary file object"""
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return sniff_bytes(f.read(SNIFF_BYTES))
+
+    position = source.tell()
+    sample = source.read(SNIFF_BYTES)
+    source.seek(position)
+    if isinstance(sample, str):
+        sample = sample.encode('utf-8')
+    return sniff_bytes(sample)
+
+
+def _as_source(file_data):
+    """Normalize a path, file object or bytes into something pandas can read"""
+    if isinstance(file_data, str) or hasattr(file_data, 'read'):
+        return file_data
+    return io.BytesIO(file_data)
+
+
+def read_csv_header(file_data, sample_rows=DEFAULT_SAMPLE_ROWS, csv_format=None):
+    """Read only the header row and a few sample rows
+
+    Args:
+        file_data: File path, binary file object or bytes
+        sample_rows: Number of data rows to read
+        csv_format: Optional CsvFormat, sniffed when not given
+
+    Returns:
+        tuple: (headers, sample DataFrame)
+    """
+    source = _as_source(file_data)
+    csv_format = csv_format or sniff_csv(source)
+    sample = pd.read_csv(
+        source,
+        sep=csv_format.delimiter,
+        encoding=csv_format.encoding,
+        nrows=sample_rows,
+        dtype=str,
+        engine='c'
+    )
+    return sample.columns.tolist(), sample
+
+
+def _iter_pandas_chunks(source, csv_format, chunk_size):
+    reader = pd.read_csv(
+        source,
+        sep=csv_format.delimiter,
+        encoding=csv_format.encoding,
+        chunksize=chunk_size,
+        dtype=str,
+        engine='c'
+    )
+    with reader:
+        for chunk in reader:
+            yield chunk
+
+
+def _iter_arrow_chunks(source, csv_format, chunk_size):
+    # Column names come from pandas so that repeated and blank headers are renamed
+    # ('name', 'name.1', 'Unnamed: 3') exactly as in the mapping step
+    headers, _ = read_csv_header(source, sample_rows=0, csv_format=csv_format)
+    if not isinstance(source, str):
+        source.seek(0)
+
+    reader = pa_csv.open_csv(
+        source,
+        read_options=pa_csv.ReadOptions(encoding=csv_format.encoding, column_names=headers, skip_rows=1),
+        parse_options=pa_csv.ParseOptions(delimiter=csv_format.delimiter),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={name: pa.string() for name in headers},
+            strings_can_be_null=True
+        )
+    )
+
+    # Arrow batches are sized in bytes, so regroup them into chunk_size rows
+    pending = []
+    pending_rows = 0
+    for batch in reader:
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        while pending_rows >= chunk_size:
+            table = pa.Table.from_batches(pending)
+            yield table.slice(0, chunk_size).to_pandas()
+            rest = table.slice(chunk_size)
+            pending = rest.to_batches()
+            pending_rows = rest.num_rows
+    if pending_rows:
+        yield pa.Table.from_batches(pending).to_pandas()
+
+
+def iter_csv_chunks(file_data, chunk_size=DEFAULT_CHUNK_SIZE, csv_format=None, use_arrow=None):
+    """Yield the rows of a CSV file as DataFrames of at most chunk_size rows
+
+    Args:
+        file_data: File path, binary file object or bytes
+        chunk_size: Maximum rows per yielded DataFrame
+        csv_format: Optional CsvFormat, sniffed when not given
+        use_arrow: Force (True) or disable (False) the pyarrow reader;
+            by default it is used when installed
+
+    Yields:
+        pandas.DataFrame
+    """
+    source = _as_source(file_data)
+    csv_format = csv_format or sniff_csv(source)
+
+    if use_arrow is None:
+        use_arrow = pa_csv is not None
+    if use_arrow:
+        yield from _iter_arrow_chunks(source, csv_format, chunk_size)
+    else:
+        yield from _iter_pandas_chunks(source, csv_format, chunk_size)
@@ -0,0 +1,181 @@
+"""
+Custom field storage.
+
+A lead's custom field values can live in two places:
+
+- rows: one lead_custom_fields row per value (the original layout)
+- json: one JSON object per lead in leads.custom_data, keyed by header id
+  (JSONB with a GIN index on PostgreSQL)
+
+CUSTOM_FIELD_STORAGE picks the layout. 'dual' writes both and reads rows;
+it is the setting to run while migrate_custom_fields.py copies existing
+values into custom_data, after which the application can switch to 'json'.
+Import, export, the lead API and lead filters only go through the functions
+here, so they behave the same in every mode.
+"""
+import os
+
+from sqlalchemy import bindparam, false, or_, select, type_coerce, update
+from sqlalchemy.dialects.postgresql import JSONB
+
+import reference_data
+from app import db
+from models import Lead, LeadCustomField, WorkspaceHeader
+
+STORAGE_MODES = ('rows', 'dual', 'json')
+
+STORAGE = os.environ.get('CUSTOM_FIELD_STORAGE', 'rows')
+if STORAGE not in STORAGE_MODES:
+    raise ValueError(f"CUSTOM_FIELD_STORAGE must be one of {', '.join(STORAGE_MODES)}, not {STORAGE}")
+
+# Leads read or written per statement
+CHUNK_SIZE = 1000
+
+
+def writes_rows():
+    return STORAGE in ('rows', 'dual')
+
+
+def writes_json():
+    return STORAGE in ('dual', 'json')
+
+
+def reads_json():
+    return STORAGE == 'json'
+
+
+def custom_data(pairs):
+    """Build a lead's custom_data object from (header id, value) pairs, skipping empty values"""
+    data = {str(header_id): value for header_id, value in pairs if value is not None}
+    return data or None
+
+
+def merge_custom_data(values):
+    """Overwrite custom values of existing leads in custom_data
+
+    Args:
+        values: dict (lead id, header id) -> value
+    """
+    by_lead = {}
+    for (lead_id, header_id), value in values.items():
+        by_lead.setdefault(lead_id, {})[str(header_id)] = value
+    lead_ids = list(by_lead)
+    for start in range(0, len(lead_ids), CHUNK_SIZE):
+        chunk = lead_ids[start:start + CHUNK_SIZE]
+        current = dict(db.session.execute(select(Lead.id, Lead.custom_data).where(Lead.id.in_(chunk))).all())
+        db.session.execute(update(Lead), [
+            {'id': lead_id, 'custom_data': {**(current.get(lead_id) or {}), **by_lead[lead_id]}}
+            for lead_id in chunk
+        ])
+
+
+def replace_custom_rows(values):
+    """Delete the lead_custom_fields rows that new values for (lead id, header id) replace"""
+    table = LeadCustomField.__table__
+    db.session.connection().execute(
+        table.delete().where(
+            table.c.lead_id == bindparam('match_lead_id'),
+            table.c.header_id == bindparam('match_header_id')
+        ),
+        [{'match_lead_id': lead_id, 'match_header_id': header_id} for lead_id, header_id in values]
+    )
+
+
+def load_custom_values(leads, header_names):
+    """Custom values of a batch of leads for the given header names
+
+    Args:
+        leads: List of Lead objects
+        header_names: Header names wanted
+
+    Returns:
+        dict: lead id -> {header name: value}, with an entry for every lead
+    """
+    values = {lead.id: {} for lead in leads}
+    if not values or not header_names:
+        return values
+
+    if reads_json():
+        # The values are already on the leads, and header names are in the reference data cache
+        wanted = set(header_names)
+        names = {
+            header.id: header.header_name
+            for workspace_id in {lead.workspace_id for lead in leads}
+            for header in reference_data.workspace_headers(workspace_id)
+            if header.header_name in wanted
+        }
+        for lead in leads:
+            for key, value in (lead.custom_data or {}).items():
+                name = names.get(int(key))
+                if name is not None:
+                    values[lead.id][name] = value or ''
+        return values
+
+    # Unordered, so the lookup stays on the lead_id index; the first value stored
+    # for a header (lowest id) wins
+    rows = (
+        db.session.query(LeadCustomField.lead_id, WorkspaceHeader.header_name, LeadCustomField.id,
+                         LeadCustomField.value)
+        .join(WorkspaceHeader, LeadCustomField.header_id == WorkspaceHeader.id)
+        .filter(LeadCustomField.lead_id.in_(list(values)), WorkspaceHeader.header_name.in_(header_names),
+                WorkspaceHeader.dropped_at.is_(None))
+    )
+    first_ids = {}
+    for lead_id, header_name, field_id, value in rows:
+        key = (lead_id, header_name)
+        if key not in first_ids or field_id < first_ids[key]:
+            first_ids[key] = field_id
+            values[lead_id][header_name] = value or ''
+    return values
+
+
+def all_custom_values(lead_ids):
+    """Every custom value of the given leads, whatever its header, except values of dropped headers
+
+    Returns:
+        dict: lead id -> list of non-empty values
+    """
+    values = {lead_id: [] for lead_id in lead_ids}
+    if not values:
+        return values
+    if reads_json():
+        rows = db.session.execute(
+            select(Lead.id, Lead.workspace_id, Lead.custom_data).where(Lead.id.in_(list(values)))
+        ).all()
+        # Keys of the headers still in use, from the reference data cache
+        live_keys = {
+            workspace_id: {str(header.id) for header in reference_data.workspace_headers(workspace_id)}
+            for workspace_id in {row[1] for row in rows}
+        }
+        for lead_id, workspace_id, data in rows:
+            keys = live_keys[workspace_id]
+            values[lead_id].extend(value for key, value in (data or {}).items() if value and key in keys)
+        return values
+    rows = db.session.execute(
+        select(LeadCustomField.lead_id, LeadCustomField.value)
+        .join(WorkspaceHeader, LeadCustomField.header_id == WorkspaceHeader.id)
+        .where(LeadCustomField.lead_id.in_(list(values)), WorkspaceHeader.dropped_at.is_(None))
+    )
+    for lead_id, value in rows:
+        if value:
+            values[lead_id].append(value)
+    return values
+
+
+def custom_value_filter(header_ids, value):
+    """Criterion matching leads whose value for any of the given headers equals value"""
+    header_ids = list(header_ids)
+    if not header_ids:
+        return false()
+
+    if reads_json():
+        if db.session.get_bind().dialect.name == 'postgresql':
+            # Containment is answered by the GIN index
+            column = type_coerce(Lead.custom_data, JSONB)
+            return or_(*(column.contains({str(header_id): value}) for header_id in header_ids))
+        return or_(*(Lead.custom_data[str(header_id)].as_string() == value for header_id in header_ids))
+
+    return Lead.id.in_(
+        select(LeadCustomField.lead_id)
+        .where(LeadCustomField.header_id.in_(header_ids), LeadCustomField.value == value)
+    )
@@ -0,0 +1,170 @@
+"""
+Import-time duplicate detection.
+
+Incoming rows are matched against existing leads of the same workspace on
+normalized email and/or phone. Every lead stores its normalized keys
+(email_normalized, phone_normalized), indexed per workspace, so each import
+batch costs one indexed lookup per key type rather than one query per row.
+"""
+from app import db
+from models import Lead
+
+# What to do with an incoming row that matches an existing lead
+DEDUPE_POLICIES = {
+    'none': 'Import all rows',
+    'skip': 'Skip duplicates',
+    'update': 'Update existing leads',
+    'flag': 'Import and flag duplicates',
+}
+
+# Which normalized keys identify a duplicate
+DEDUPE_KEYS = {
+    'email_or_phone': 'Email or phone',
+    'email': 'Email',
+    'phone': 'Phone',
+}
+
+# Number of keys per IN (...) lookup
+LOOKUP_CHUNK_SIZE = 500
+
+
+def normalize_emails(values):
+    """Lower-case and trim a list of emails; blanks become None"""
+    import pandas as pd  # Only imports need it; the web workers import this module for its constants
+
+    emails = pd.Series(values, dtype='string').str.strip().str.lower()
+    emails = emails.mask(emails == '').str.slice(0, Lead.email_normalized.type.length)
+    return emails.astype(object).where(emails.notna(), None).tolist()
+
+
+def normalize_phones(values):
+    """Reduce a list of phone numbers to their digits, dropping a leading US country code"""
+    import pandas as pd
+
+    phones = pd.Series(values, dtype='string').str.replace(r'\D', '', regex=True)
+    phones = phones.mask((phones.str.len() == 11) & phones.str.startswith('1'), phones.str.slice(1))
+    phones = phones.mask(phones == '').str.slice(0, Lead.phone_normalized.type.length)
+    return phones.astype(object).where(phones.notna(), None).tolist()
+
+
+class BatchPlan:
+    """What to write for one import batch after duplicate resolution"""
+
+    def __init__(self):
+        self.leads = []  # Lead values to insert
+        self.custom_rows = []  # Custom (header_id, value) pairs per inserted lead
+        self.updates = []  # (existing lead id, lead values, custom pairs)
+        self.duplicate_links = []  # (index of inserted duplicate, index of its first occurrence)
+        self.merged = 0  # Rows applied to an earlier row of the same batch
+        self.skipped = 0
+        self.flagged = 0
+
+    def merge(self, index, lead, custom):
+        """Apply a duplicate row to the row at index, as an update of an existing lead would
+
+        Only non-empty incoming values overwrite, so the later row wins.
+        """
+        target = self.leads[index]
+        for field, value in lead.items():
+            if value is not None and field not in ('workspace_id', 'created_at'):
+                target[field] = value
+        values = dict(self.custom_rows[index])
+        values.update((header_id, value) for header_id, value in custom if value is not None)
+        self.custom_rows[index] = list(values.items())
+        self.merged += 1
+
+
+class DuplicateMatcher:
+    """Resolve each batch of incoming rows against existing leads
+
+    Args:
+        workspace_id: Workspace whose leads are matched
+        policy: One of DEDUPE_POLICIES
+        match_on: One of DEDUPE_KEYS
+    """
+
+    def __init__(self, workspace_id, policy='skip', match_on='email_or_phone'):
+        if policy not in DEDUPE_POLICIES:
+            raise ValueError(f"Unknown duplicate policy: {policy}")
+        if match_on not in DEDUPE_KEYS:
+            raise ValueError(f"Unknown duplicate key: {match_on}")
+        self.workspace_id = workspace_id
+        self.policy = policy
+        self.fields = []
+        if match_on in ('email', 'email_or_phone'):
+            self.fields.append('email_normalized')
+        if match_on in ('phone', 'email_or_phone'):
+            self.fields.append('phone_normalized')
+
+    def _keys(self, lead):
+        return [(field, lead[field]) for field in self.fields if lead.get(field)]
+
+    def lookup(self, leads):
+        """Find existing leads sharing a key with any of the given rows
+
+        Returns:
+            dict: (field, key) -> id of the oldest matching lead
+        """
+        found = {}
+        for field in self.fields:
+            column = getattr(Lead, field)
+            keys = list({lead[field] for lead in leads if lead.get(field)})
+            for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+                rows = (
+                    db.session.query(Lead.id, column)
+                    .filter(Lead.workspace_id == self.workspace_id, column.in_(keys[start:start + LOOKUP_CHUNK_SIZE]))
+                    .order_by(Lead.id)
+                    .all()
+                )
+                for lead_id, key in rows:
+                    found.setdefault((field, key), lead_id)
+        return found
+
+    def resolve(self, leads, custom_rows):
+        """Split a batch into inserts, updates and skips according to the policy
+
+        Returns:
+            BatchPlan
+        """
+        plan = BatchPlan()
+        existing = self.lookup(leads)
+        seen = {}  # key -> index in plan.leads of the first row with that key
+
+        for lead, custom in zip(leads, custom_rows):
+            if self.policy == 'flag':
+                lead['duplicate_of'] = None
+
+            keys = self._keys(lead)
+            match = next((existing[key] for key in keys if key in existing), None)
+            first = next((seen[key] for key in keys if key in seen), None)
+
+            if match is None and first is None:
+                for key in keys:
+                    seen[key] = len(plan.leads)
+                plan.leads.append(lead)
+                plan.custom_rows.append(custom)
+            elif self.policy == 'update':
+                # Whichever key a later batch would match on: the lead as
+                # stored by then, or this batch's earlier row
+                key = next(key for key in keys if key in existing or key in seen)
+                if key in existing:
+                    plan.updates.append((existing[key], lead, custom))
+                else:
+                    plan.merge(seen[key], lead, custom)
+                for other in keys:
+                    if other not in existing and other not in seen:
+                        if key in existing:
+                            existing[other] = existing[key]
+                        else:
+                            seen[other] = seen[key]
+            elif self.policy == 'flag':
+                lead['duplicate_of'] = match
+                if match is None:
+                    plan.duplicate_links.append((len(plan.leads), first))
+                plan.leads.append(lead)
+                plan.custom_rows.append(custom)
+                plan.flagged += 1
+            else:
+                plan.skipped += 1
+
+        return plan
@@ -0,0 +1,114 @@
+"""
+Gunicorn settings for the web service; gunicorn reads this file from the
+working directory, so `gunicorn main:app` is enough to use it.
+
+The application is loaded once in the master (preload_app) and forked, so
+workers share its memory and start instantly. Each worker discards the
+database engine it inherited and opens its own connections.
+
+GUNICORN_WORKER_CLASS picks how a worker serves concurrent requests:
+
+- gthread (default): GUNICORN_THREADS threads per worker
+- gevent: GUNICORN_WORKER_CONNECTIONS greenlets per worker (needs gevent,
+  and psycogreen so that queries yield to other greenlets)
+- sync: one request at a time
+
+DB_MAX_CONNECTIONS is the number of database connections the whole service
+may hold. One is kept for each of the IMPORT_WORKERS import workers (whose
+pools hold a single connection) and DB_RESERVED_CONNECTIONS for init-db,
+migrations and admin scripts. The web workers share the rest, each with a
+pool sized to the requests it can run at once. Startup fails if that leaves
+a web worker with no connection. Requests beyond the pool wait up to
+DB_POOL_TIMEOUT seconds for one.
+
+With IMPORT_WORKER_MODE=embedded (the default) the master starts a single
+import worker pool (`python jobs.py`) once it is ready and stops it on
+shutdown. The pool shares this machine's UPLOAD_STAGING_DIR, and the web
+workers leave imports to it rather than starting pools of their own.
+"""
+import logging
+import multiprocessing
+import os
+import subprocess
+import sys
+
+logger = logging.getLogger('gunicorn.error')
+
+WORKER_CLASSES = ('gthread', 'gevent', 'sync')
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class not in WORKER_CLASSES:
+    raise ValueError(f"GUNICORN_WORKER_CLASS must be one of {', '.join(WORKER_CLASSES)}, not {worker_class}")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 4)))
+threads = int(os.environ.get('GUNICORN_THREADS', 4)) if worker_class == 'gthread' else 1
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+preload_app = True
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+keepalive = 5
+accesslog = '-'
+
+if worker_class == 'gevent':
+    # Before the application (and its database driver) is imported by preload_app
+    from gevent import monkey
+    monkey.patch_all()
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:  # pragma: no cover - psycogreen is optional
+        logger.warning("psycogreen is not installed; database queries will block other greenlets")
+
+# Database connections: what the import workers and one-off commands need is set aside, and
+# each web worker gets at most one per request it runs at once from the rest
+DB_MAX_CONNECTIONS = int(os.environ.get('DB_MAX_CONNECTIONS', 20))
+DB_RESERVED_CONNECTIONS = int(os.environ.get('DB_RESERVED_CONNECTIONS', 1))
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 2))
+web_connections = DB_MAX_CONNECTIONS - IMPORT_WORKERS - DB_RESERVED_CONNECTIONS
+if web_connections < workers:
+    raise ValueError(f"DB_MAX_CONNECTIONS={DB_MAX_CONNECTIONS} leaves {web_connections} connections for "
+                     f"{workers} web workers after {IMPORT_WORKERS} import workers and "
+                     f"{DB_RESERVED_CONNECTIONS} reserved; raise it or lower WEB_CONCURRENCY or IMPORT_WORKERS")
+concurrency = {'gthread': threads, 'gevent': worker_connections, 'sync': 1}[worker_class]
+per_worker = web_connections // workers
+pool_size = min(concurrency, per_worker)
+# Read by config.py when gunicorn loads the application after this file; explicit settings win
+os.environ.setdefault('DB_POOL_SIZE', str(pool_size))
+os.environ.setdefault('DB_MAX_OVERFLOW', str(per_worker - pool_size))
+
+# Import workers: one pool run by the master, which the web workers see as external
+IMPORT_WORKER_MODE = os.environ.get('IMPORT_WORKER_MODE', 'embedded')
+if IMPORT_WORKER_MODE == 'embedded':
+    os.environ['IMPORT_WORKER_MODE'] = 'external'
+import_pool = None
+
+
+def when_ready(server):
+    global import_pool
+    logger.info("%s %s workers, %s concurrent requests each, %s + %s database connections per worker; "
+                "%s for import workers, %s reserved", workers, worker_class, concurrency,
+                os.environ['DB_POOL_SIZE'], os.environ['DB_MAX_OVERFLOW'], IMPORT_WORKERS, DB_RESERVED_CONNECTIONS)
+
+    if IMPORT_WORKER_MODE == 'embedded':
+        jobs_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.py')
+        import_pool = subprocess.Popen([sys.executable, jobs_script])
+        logger.info("Started the import worker pool (pid %s)", import_pool.pid)
+
+
+def on_exit(server):
+    if import_pool is not None and import_pool.poll() is None:
+        import_pool.terminate()
+        try:
+            import_pool.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            import_pool.kill()
+
+
+def post_fork(server, worker):
+    """Give the worker its own connection pool instead of the master's"""
+    from app import db
+    from main import app
+
+    with app.app_context():
+        # close=False leaves connections the master may hold to the master
+        db.engine.dispose(close=False)
@@ -0,0 +1,378 @@
+"""
+Bulk lead import engine.
+
+Each chunk of rows is first normalized a whole column at a time (trimming,
+null coercion, truncation to the declared column widths, date parsing with a
+cached format), so nothing that reaches the database can fail on its values.
+Rows are then written in batches: one multi-row INSERT ... RETURNING per batch
+of leads and one bulk insert (COPY on PostgreSQL) for their custom field
+values (or, with JSON custom field storage, the values ride along in the lead
+INSERT). Each batch is committed on its own, together with the search
+documents of its leads, so a large file never holds one huge transaction.
+"""
+import csv
+import logging
+import time
+from datetime import datetime
+from io import StringIO
+from itertools import repeat
+
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+from sqlalchemy import insert, update
+
+import custom_fields
+from app import db
+from config import DEFAULT_LEAD_FIELDS, LEAD_TEXT_FIELDS
+from dedupe import BatchPlan, DuplicateMatcher, normalize_emails, normalize_phones
+from lead_search import index_leads
+from lead_stats import apply_lead_stat_changes, lead_stat_keys
+from models import Lead, LeadCustomField
+
+logger = logging.getLogger(__name__)
+
+# Values that mean "no date" in the date column
+EMPTY_DATE_VALUES = ['nat', 'nan', '', 'none', 'null']
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class ImportAborted(Exception):
+    """Raised by an on_batch callback to stop an import instead of skipping the batch"""
+
+
+def column_lengths(model):
+    """Map each string column of a model to its declared length"""
+    return {
+        column.name: column.type.length
+        for column in model.__table__.columns
+        if getattr(column.type, 'length', None)
+    }
+
+
+class ImportResult:
+    """Running totals for one import"""
+
+    COUNTERS = ('success_count', 'error_count', 'skipped_count', 'updated_count', 'flagged_count')
+
+    def __init__(self):
+        self.success_count = 0  # Rows inserted or used to update an existing lead
+        self.error_count = 0
+        self.skipped_count = 0  # Duplicates skipped
+        self.updated_count = 0  # Duplicates that updated an existing lead
+        self.flagged_count = 0  # Duplicates inserted and flagged
+        self.errors = []
+        self.failed = False  # The import stopped before the end of the file
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+    @property
+    def rows_processed(self):
+        return self.success_count + self.error_count + self.skipped_count
+
+    def snapshot(self):
+        return tuple(getattr(self, name) for name in self.COUNTERS)
+
+    def restore(self, snapshot):
+        for name, value in zip(self.COUNTERS, snapshot):
+            setattr(self, name, value)
+
+    @property
+    def elapsed(self):
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.started_at
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed
+        return self.rows_processed / elapsed if elapsed > 0 else 0.0
+
+    def fail(self, message):
+        """Record an error that stopped the whole import; it is not a row, so no count changes"""
+        self.failed = True
+        self.errors.append(message)
+
+    def finish(self):
+        self.finished_at = time.monotonic()
+        return self
+
+    def as_tuple(self):
+        """Return the (success_count, error_count, errors) tuple used by process_csv_upload"""
+        return self.success_count, self.error_count, self.errors
+
+
+class BulkLeadImporter:
+    """Validate CSV rows and write them to leads/lead_custom_fields in batches
+
+    Args:
+        workspace_id: The workspace ID to associate leads with
+        header_mapping: Dictionary mapping CSV headers to database fields
+        workspace_headers: Dictionary of header name -> WorkspaceHeader
+        batch_size: Number of rows written and committed together
+        on_batch: Optional callable(result, last_row) run inside each batch's
+            transaction just before it commits, e.g. to record progress
+        dedupe_policy: 'none', 'skip', 'update' or 'flag' for rows matching an existing lead
+        dedupe_on: 'email', 'phone' or 'email_or_phone'
+    """
+
+    def __init__(self, workspace_id, header_mapping, workspace_headers, batch_size=DEFAULT_BATCH_SIZE,
+                 on_batch=None, dedupe_policy='none', dedupe_on='email_or_phone'):
+        self.workspace_id = workspace_id
+        self.header_mapping = header_mapping
+        self.workspace_headers = workspace_headers
+        self.batch_size = batch_size
+        self.on_batch = on_batch
+        self.matcher = None
+        if dedupe_policy != 'none':
+            self.matcher = DuplicateMatcher(workspace_id, dedupe_policy, dedupe_on)
+        self.lead_lengths = column_lengths(Lead)
+        self.custom_value_length = column_lengths(LeadCustomField)['value']
+        self.date_formats = {}  # CSV column position -> inferred date format
+
+    def _plan(self, columns):
+        """Work out once which CSV column feeds which lead field or custom header"""
+        positions = {name: i for i, name in enumerate(columns)}
+        text_fields = []
+        date_fields = []
+        custom_fields = []
+
+        for csv_header, db_field in self.header_mapping.items():
+            if csv_header not in positions:
+                continue
+            position = positions[csv_header]
+            if db_field in LEAD_TEXT_FIELDS:
+                text_fields.append((position, db_field))
+            elif db_field == 'date':
+                date_fields.append(position)
+            elif db_field in self.workspace_headers and db_field not in DEFAULT_LEAD_FIELDS:
+                custom_fields.append((position, self.workspace_headers[db_field].id))
+
+        return text_fields, date_fields, custom_fields
+
+    def _parse_date(self, value):
+        """Parse a single date cell, returning None for blanks and unparseable values"""
+        if pd.isna(value) or str(value).strip().lower() in EMPTY_DATE_VALUES:
+            return None
+        try:
+            return pd.to_datetime(value).date()
+        except Exception:
+            return None
+
+    def _normalize_text(self, series, max_length):
+        """Trim, null-coerce and truncate a whole column at once"""
+        text = series.astype('string').str.strip()
+        if max_length:
+            text = text.str.slice(0, max_length)
+        text = text.mask(text == '')
+        return text.astype(object).where(text.notna(), None).tolist()
+
+    def _normalize_dates(self, series, position):
+        """Parse a whole date column using a format inferred once per import
+
+        The format is guessed from the first non-blank value and cached for the
+        column, so later chunks parse with a fixed format. Values that don't
+        match it fall back to per-value parsing.
+        """
+        text = series.astype('string').str.strip()
+        blank = text.isna() | text.str.lower().isin(EMPTY_DATE_VALUES)
+        values = text[~blank]
+        dates = [None] * len(series)
+        if values.empty:
+            return dates
+
+        if position not in self.date_formats:
+            self.date_formats[position] = guess_datetime_format(values.iloc[0])
+        date_format = self.date_formats[position]
+
+        if date_format:
+            parsed = pd.to_datetime(values, format=date_format, errors='coerce')
+        else:
+            parsed = pd.Series(pd.NaT, index=values.index)
+
+        missed = parsed.isna()
+        for index, value in zip(values.index[~missed], parsed[~missed].dt.date):
+            dates[index] = value
+        for index, value in values[missed].items():
+            dates[index] = self._parse_date(value)
+        return dates
+
+    def normalize(self, df, plan):
+        """Convert a whole chunk into per-column lists of database-ready values
+
+        Args:
+            df: DataFrame with a default RangeIndex
+            plan: Column plan from _plan
+
+        Returns:
+            tuple: (lead field -> values, [(header_id, values)])
+        """
+        text_fields, date_fields, custom_fields = plan
+        lead_columns = {}
+        for position, db_field in text_fields:
+            lead_columns[db_field] = self._normalize_text(df.iloc[:, position], self.lead_lengths.get(db_field))
+        for position in date_fields:
+            lead_columns['date'] = self._normalize_dates(df.iloc[:, position], position)
+
+        # Keys used to recognize this lead if it is imported again
+        if 'email' in lead_columns:
+            lead_columns['email_normalized'] = normalize_emails(lead_columns['email'])
+        if 'phone' in lead_columns:
+            lead_columns['phone_normalized'] = normalize_phones(lead_columns['phone'])
+
+        custom_columns = [
+            (header_id, self._normalize_text(df.iloc[:, position], self.custom_value_length))
+            for position, header_id in custom_fields
+        ]
+        return lead_columns, custom_columns
+
+    def build_rows(self, lead_columns, custom_columns, start, stop, created_at):
+        """Turn a slice of normalized columns into lead dicts and custom value pairs"""
+        fields = list(lead_columns)
+        lead_values = zip(*(lead_columns[field][start:stop] for field in fields)) if fields else repeat((), stop - start)
+        leads = [
+            dict(zip(fields, values), workspace_id=self.workspace_id, created_at=created_at)
+            for values in lead_values
+        ]
+
+        header_ids = [header_id for header_id, _ in custom_columns]
+        if header_ids:
+            custom_values = zip(*(values[start:stop] for _, values in custom_columns))
+            custom_rows = [list(zip(header_ids, values)) for values in custom_values]
+        else:
+            custom_rows = [[] for _ in range(stop - start)]
+
+        return leads, custom_rows
+
+    def import_dataframe(self, df, result=None, row_offset=0):
+        """Import every row of a DataFrame
+
+        Args:
+            df: DataFrame holding the CSV rows
+            result: Optional ImportResult to accumulate into
+            row_offset: Number of rows already consumed before this frame
+
+        Returns:
+            ImportResult
+        """
+        result = result or ImportResult()
+        df = df.reset_index(drop=True)
+        plan = self._plan(list(df.columns))
+        lead_columns, custom_columns = self.normalize(df, plan)
+
+        for start in range(0, len(df), self.batch_size):
+            stop = min(start + self.batch_size, len(df))
+            leads, custom_rows = self.build_rows(lead_columns, custom_columns, start, stop, datetime.utcnow())
+            if self.matcher:
+                batch = self.matcher.resolve(leads, custom_rows)
+            else:
+                batch = BatchPlan()
+                batch.leads, batch.custom_rows = leads, custom_rows
+            self._write_batch(batch, row_offset + start + 1, row_offset + stop, result)
+
+        return result
+
+    def _write_batch(self, batch, first_row, last_row, result):
+        """Insert (and for duplicates, update) one batch of leads plus custom values and commit it"""
+        before = result.snapshot()
+        try:
+            updated_ids = [lead_id for lead_id, _, _ in batch.updates]
+            stats_before = lead_stat_keys(updated_ids, lock=True)
+            lead_ids = []
+            if batch.leads:
+                if custom_fields.writes_json():
+                    for lead, custom in zip(batch.leads, batch.custom_rows):
+                        lead['custom_data'] = custom_fields.custom_data(custom)
+                stmt = insert(Lead).returning(Lead.id, sort_by_parameter_order=True)
+                lead_ids = db.session.scalars(stmt, batch.leads).all()
+
+            if batch.duplicate_links:
+                db.session.execute(update(Lead), [
+                    {'id': lead_ids[index], 'duplicate_of': lead_ids[first]}
+                    for index, first in batch.duplicate_links
+                ])
+
+            custom_values = []
+            if custom_fields.writes_rows():
+                custom_values = [
+                    {'lead_id': lead_id, 'header_id': header_id, 'value': value}
+                    for lead_id, custom in zip(lead_ids, batch.custom_rows)
+                    for header_id, value in custom
+                ]
+            if batch.updates:
+                custom_values += self._update_existing(batch.updates)
+            if custom_values:
+                self._insert_custom_fields(custom_values)
+            index_leads(lead_ids + updated_ids)
+            apply_lead_stat_changes(stats_before, lead_stat_keys(lead_ids + updated_ids))
+
+            result.success_count += len(batch.leads) + len(batch.updates) + batch.merged
+            result.updated_count += len(batch.updates) + batch.merged
+            result.flagged_count += batch.flagged
+            result.skipped_count += batch.skipped
+            if self.on_batch:
+                self.on_batch(result, last_row)
+            db.session.commit()
+        except ImportAborted:
+            db.session.rollback()
+            result.restore(before)
+            raise
+        except Exception as e:
+            db.session.rollback()
+            logger.exception("Error writing rows %s-%s", first_row, last_row)
+            result.restore(before)
+            result.error_count += len(batch.leads) + len(batch.updates) + batch.merged
+            result.skipped_count += batch.skipped
+            result.errors.append(f"Database error in rows {first_row}-{last_row}: {str(e)}")
+
+    def _update_existing(self, updates):
+        """Apply duplicate rows to the leads they matched
+
+        Only non-empty incoming values overwrite existing data.
+
+        Returns:
+            list: Custom field values to insert for the updated leads, when
+            values are stored as rows
+        """
+        lead_values = []
+        custom_values = {}  # (lead id, header id) -> value; a later row wins
+        for lead_id, lead, custom in updates:
+            values = {field: value for field, value in lead.items()
+                      if value is not None and field not in ('workspace_id', 'created_at')}
+            values['id'] = lead_id
+            lead_values.append(values)
+            for header_id, value in custom:
+                if value is not None:
+                    custom_values[(lead_id, header_id)] = value
+
+        db.session.execute(update(Lead), lead_values)
+        if custom_values and custom_fields.writes_json():
+            custom_fields.merge_custom_data(custom_values)
+        if not custom_values or not custom_fields.writes_rows():
+            return []
+        custom_fields.replace_custom_rows(custom_values)
+        return [
+            {'lead_id': lead_id, 'header_id': header_id, 'value': value}
+            for (lead_id, header_id), value in custom_values.items()
+        ]
+
+    def _insert_custom_fields(self, custom_values):
+        """Write custom field values, using COPY when the driver supports it"""
+        connection = db.session.connection()
+        if connection.dialect.name == 'postgresql':
+            cursor = connection.connection.dbapi_connection.cursor()
+            if hasattr(cursor, 'copy_expert'):
+                buffer = StringIO()
+                # QUOTE_NONNUMERIC keeps '' and NULL distinct in COPY's CSV format
+                writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+                for row in custom_values:
+                    writer.writerow([row['lead_id'], row['header_id'], row['value']])
+                buffer.seek(0)
+                cursor.copy_expert(
+                    "COPY lead_custom_fields (lead_id, header_id, value) FROM STDIN WITH (FORMAT csv)",
+                    buffer
+                )
+                cursor.close()
+                return
+            cursor.close()
+
+        db.session.execute(insert(LeadCustomField), custom_values)
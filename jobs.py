@@ -0,0 +1,361 @@
+"""
+Background lead import jobs.
+
+Imports are recorded in the import_jobs table and picked up by a small pool
+of worker processes, so no external broker is needed and the request that
+submits an import returns immediately. Progress is written in the same
+transaction as each committed batch, which lets a job that was interrupted
+(worker killed, web worker restarted) resume from its last committed row once
+its heartbeat goes stale.
+
+By default (IMPORT_WORKER_MODE=embedded) the pool runs beside the web
+server: under gunicorn the master starts one pool when it boots (see
+gunicorn.conf.py), so queued and interrupted jobs are picked up straight
+away and adding web workers does not add import workers. Other servers
+start it from the web process on the first submission. To run the pool
+elsewhere, for instance on its own machine sharing UPLOAD_STAGING_DIR:
+
+    IMPORT_WORKER_MODE=external gunicorn main:app
+    python jobs.py --workers 2
+
+Workers with no import to run purge the values of dropped workspace headers,
+one chunk at a time (see workspace_schema.py).
+"""
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from app import db
+from assignment import assign_after_import
+from models import ImportJob
+from utils import process_csv_upload
+from workspace_schema import purge_next_chunk
+
+logger = logging.getLogger(__name__)
+
+# 'embedded' runs the pool beside the web server, 'external' leaves it to `python jobs.py`
+WORKER_MODE = os.environ.get('IMPORT_WORKER_MODE', 'embedded')
+DEFAULT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 2))
+POLL_INTERVAL = float(os.environ.get('IMPORT_POLL_INTERVAL', 2))
+
+# A running job whose heartbeat is older than this is assumed dead and requeued
+STALE_AFTER = timedelta(seconds=int(os.environ.get('IMPORT_STALE_SECONDS', 300)))
+
+# Only the first errors are kept on the job row
+MAX_STORED_ERRORS = 100
+
+_pool = []
+
+
+def count_data_rows(path):
+    """Estimate the number of data rows in a CSV file by counting line breaks"""
+    lines = 0
+    last_byte = b'\n'
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(1024 * 1024)
+            if not block:
+                break
+            lines += block.count(b'\n')
+            last_byte = block[-1:]
+    if last_byte != b'\n':
+        lines += 1
+    return max(lines - 1, 0)
+
+
+def job_progress(job):
+    """Summarize a job for the status API"""
+    rows_per_second = 0.0
+    if job.started_at:
+        end = job.finished_at or job.heartbeat_at or job.started_at
+        elapsed = (end - job.started_at).total_seconds()
+        if elapsed > 0:
+            rows_per_second = job.rows_processed / elapsed
+
+    eta_seconds = None
+    if job.status in ('queued', 'running') and job.total_rows and rows_per_second > 0:
+        eta_seconds = max(job.total_rows - job.rows_processed, 0) / rows_per_second
+
+    return {
+        'id': job.id,
+        'workspace_id': job.workspace_id,
+        'status': job.status,
+        'total_rows': job.total_rows,
+        'rows_processed': job.rows_processed,
+        'success_count': job.success_count,
+        'error_count': job.error_count,
+        'skipped_count': job.skipped_count,
+        'updated_count': job.updated_count,
+        'flagged_count': job.flagged_count,
+        'errors': json.loads(job.errors) if job.errors else [],
+        'rows_per_second': round(rows_per_second, 1),
+        'eta_seconds': round(eta_seconds) if eta_seconds is not None else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def submit_import_job(workspace_id, file_path, header_mapping, created_by=None,
+                      dedupe_policy='none', dedupe_on='email_or_phone'):
+    """Queue a CSV import and make sure a worker pool will pick it up
+
+    Returns:
+        ImportJob
+    """
+    job = ImportJob(
+        workspace_id=workspace_id,
+        created_by=created_by,
+        file_path=file_path,
+        header_mapping=json.dumps(header_mapping),
+        dedupe_policy=dedupe_policy,
+        dedupe_on=dedupe_on,
+        status='queued'
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    if WORKER_MODE == 'embedded':
+        ensure_worker_pool()
+
+    return job
+
+
+def forget_job_creator(user_id):
+    """Clear created_by on a user's import jobs, in the caller's transaction, before deleting the user"""
+    db.session.execute(
+        update(ImportJob)
+        .where(ImportJob.created_by == user_id)
+        .values(created_by=None)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def requeue_stale_jobs():
+    """Put running jobs whose worker stopped sending heartbeats back in the queue"""
+    cutoff = datetime.utcnow() - STALE_AFTER
+    result = db.session.execute(
+        update(ImportJob)
+        .where(ImportJob.status == 'running', ImportJob.heartbeat_at < cutoff)
+        .values(status='queued', worker_pid=None)
+    )
+    db.session.commit()
+    if result.rowcount:
+        logger.warning("Requeued %s stale import jobs", result.rowcount)
+
+
+def claim_next_job():
+    """Atomically move the oldest queued job to running for this process
+
+    Returns:
+        ImportJob or None
+    """
+    requeue_stale_jobs()
+
+    candidates = db.session.query(ImportJob.id).filter_by(status='queued').order_by(ImportJob.id).limit(5).all()
+    for (job_id,) in candidates:
+        now = datetime.utcnow()
+        result = db.session.execute(
+            update(ImportJob)
+            .where(ImportJob.id == job_id, ImportJob.status == 'queued')
+            .values(status='running', worker_pid=os.getpid(), heartbeat_at=now)
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            job = db.session.get(ImportJob, job_id)
+            if job.started_at is None:
+                job.started_at = now
+                db.session.commit()
+            return job
+    return None
+
+
+def run_job(job):
+    """Run (or resume) a claimed import job to completion"""
+    from importer import ImportAborted, ImportResult  # Loads pandas, which web workers do without
+
+    job_id = job.id
+    workspace_id = job.workspace_id
+    pid = os.getpid()
+
+    result = ImportResult()
+    for name in ImportResult.COUNTERS:
+        setattr(result, name, getattr(job, name) or 0)
+    result.errors = json.loads(job.errors) if job.errors else []
+
+    def record_progress(result, last_row):
+        # Runs inside the batch transaction, so progress and rows commit together
+        updated = db.session.execute(
+            update(ImportJob)
+            .where(ImportJob.id == job_id, ImportJob.status == 'running', ImportJob.worker_pid == pid)
+            .values(
+                rows_processed=result.rows_processed,
+                errors=json.dumps(result.errors[:MAX_STORED_ERRORS]),
+                heartbeat_at=datetime.utcnow(),
+                **dict(zip(ImportResult.COUNTERS, result.snapshot()))
+            )
+        )
+        if updated.rowcount != 1:
+            raise ImportAborted(f"Import job {job_id} was claimed by another worker")
+
+    try:
+        if job.total_rows is None:
+            job.total_rows = count_data_rows(job.file_path)
+            db.session.commit()
+
+        process_csv_upload(
+            job.file_path,
+            job.workspace_id,
+            json.loads(job.header_mapping),
+            result=result,
+            skip_rows=job.rows_processed,
+            on_batch=record_progress,
+            dedupe_policy=job.dedupe_policy,
+            dedupe_on=job.dedupe_on
+        )
+        status = 'failed' if result.failed else 'completed'
+    except ImportAborted:
+        logger.warning("Import job %s lost its claim, stopping", job_id)
+        db.session.rollback()
+        return
+    except Exception as e:
+        logger.exception("Import job %s failed", job_id)
+        db.session.rollback()
+        result.fail(f"Import failed: {str(e)}")
+        status = 'failed'
+
+    db.session.execute(
+        update(ImportJob)
+        .where(ImportJob.id == job_id, ImportJob.worker_pid == pid)
+        .values(
+            status=status,
+            rows_processed=result.rows_processed,
+            errors=json.dumps(result.errors[:MAX_STORED_ERRORS]),
+            heartbeat_at=datetime.utcnow(),
+            finished_at=datetime.utcnow(),
+            **dict(zip(ImportResult.COUNTERS, result.snapshot()))
+        )
+    )
+    db.session.commit()
+
+    logger.info("Import job %s %s: %s imported, %s errors",
+                job_id, status, result.success_count, result.error_count)
+
+    if status == 'completed':
+        # Hand the new leads out now if the workspace assigns automatically
+        assign_after_import(workspace_id)
+
+
+def purge_when_idle():
+    """Purge one chunk of a dropped workspace header while there is no import to run
+
+    Returns:
+        True if a chunk was purged
+    """
+    try:
+        return purge_next_chunk()
+    except Exception:
+        logger.exception("Error purging dropped workspace headers")
+        db.session.rollback()
+        return False
+
+
+def worker_loop(poll_interval=POLL_INTERVAL):
+    """Claim and run jobs forever, purging dropped headers in between; must be called inside an app context"""
+    logger.info("Import worker %s started", os.getpid())
+    while True:
+        try:
+            job = claim_next_job()
+        except Exception:
+            logger.exception("Error claiming import job")
+            db.session.rollback()
+            job = None
+
+        if job is None:
+            purged = purge_when_idle()
+            db.session.remove()
+            if not purged:
+                time.sleep(poll_interval)
+            continue
+
+        run_job(job)
+        db.session.remove()
+
+
+def _worker_main():
+    from app import create_app
+    from config import engine_options
+    # A worker only ever uses its session's connection; gunicorn.conf.py budgets one per worker
+    app = create_app(overrides={'SQLALCHEMY_ENGINE_OPTIONS': engine_options(pool_size=1, max_overflow=0)})
+    with app.app_context():
+        worker_loop()
+
+
+def _start_worker(index, daemon):
+    # spawn gives each worker a fresh interpreter and DB engine
+    context = multiprocessing.get_context('spawn')
+    process = context.Process(target=_worker_main, name=f'import-worker-{index}', daemon=daemon)
+    process.start()
+    return process
+
+
+def start_worker_pool(num_workers=DEFAULT_WORKERS, daemon=True):
+    """Start worker processes, each with a pool of one database connection
+
+    Returns:
+        List of the started processes
+    """
+    return [_start_worker(i, daemon) for i in range(num_workers)]
+
+
+def ensure_worker_pool():
+    """Start the embedded pool for this process if it is not already running"""
+    global _pool
+    _pool = [p for p in _pool if p.is_alive()]
+    missing = DEFAULT_WORKERS - len(_pool)
+    if missing > 0:
+        _pool += start_worker_pool(missing)
+
+
+def run_worker_pool(num_workers=DEFAULT_WORKERS):
+    """Run a pool until SIGTERM or SIGINT, replacing workers that die
+
+    A worker stopped in the middle of a job leaves it to be resumed once its
+    heartbeat goes stale.
+    """
+    workers = start_worker_pool(num_workers, daemon=False)
+    logger.info("Started %s import workers", num_workers)
+
+    stopping = []
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stopping.append(signum))
+
+    while not stopping:
+        for i, worker in enumerate(workers):
+            if not worker.is_alive():
+                logger.warning("Import worker %s exited with code %s, restarting", worker.name, worker.exitcode)
+                workers[i] = _start_worker(i, daemon=False)
+        time.sleep(POLL_INTERVAL)
+
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.join()
+    logger.info("Stopped import workers")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run background lead import workers.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Number of worker processes')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+    run_worker_pool(args.workers)
@@ -0,0 +1,147 @@
+"""
+Set-based bulk operations on leads.
+
+Assign, status change and delete act on a selection of leads, either an
+explicit list of ids or every lead matching the lead list filters, with one
+UPDATE or DELETE per chunk of ids instead of loading each lead through the
+ORM. Each chunk is its own transaction, together with its statistics
+rollup change, so locks are held for one chunk at a time; an operation that
+fails part way keeps the chunks already committed.
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import delete, update
+
+from app import db
+from lead_query import apply_lead_filters
+from lead_queue import claimable
+from lead_stats import track_lead_stats
+from models import Lead, LeadCustomField, LeadSearchDocument
+
+logger = logging.getLogger(__name__)
+
+# Leads written per statement and transaction
+BULK_CHUNK_SIZE = 1000
+
+
+def select_lead_ids(lead_ids=None, filter_args=None, query=None):
+    """Resolve a bulk selection to lead ids
+
+    Args:
+        lead_ids: Explicit lead ids; invalid entries are ignored
+        filter_args: Lead list filters (see lead_query.apply_lead_filters),
+            used instead of lead_ids to select every matching lead
+        query: Base query of Lead.id to select from, e.g. one user's leads
+
+    Returns:
+        Sorted list of existing lead ids
+    """
+    if query is None:
+        query = db.session.query(Lead.id)
+    if filter_args is not None:
+        query = apply_lead_filters(query, filter_args)
+        return [lead_id for (lead_id,) in query.order_by(Lead.id)]
+
+    ids = set()
+    for lead_id in lead_ids or []:
+        try:
+            ids.add(int(lead_id))
+        except (TypeError, ValueError):
+            continue
+    ids = sorted(ids)
+    existing = []
+    for start in range(0, len(ids), BULK_CHUNK_SIZE):
+        chunk = ids[start:start + BULK_CHUNK_SIZE]
+        existing.extend(lead_id for (lead_id,) in query.filter(Lead.id.in_(chunk)))
+    return sorted(existing)
+
+
+def _apply_in_chunks(lead_ids, write, commit=True):
+    """Run write(chunk) -> rows affected for each chunk of ids in its own transaction
+
+    With commit=False every chunk is left in the caller's transaction, for
+    callers that must commit the change together with other writes.
+    """
+    affected = 0
+    for start in range(0, len(lead_ids), BULK_CHUNK_SIZE):
+        chunk = lead_ids[start:start + BULK_CHUNK_SIZE]
+        try:
+            with track_lead_stats(chunk):
+                affected += write(chunk)
+            if commit:
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception("Bulk lead operation failed after %s leads", affected)
+            raise
+    return affected
+
+
+def assign_leads(lead_ids, user_id, only_unassigned=False, commit=True):
+    """Assign leads to a user, or unassign them if user_id is None
+
+    Args:
+        lead_ids: Lead ids
+        user_id: User id or None
+        only_unassigned: Leave alone leads that were assigned in the meantime, or
+            that an agent holds an unexpired work queue lease on
+        commit: Commit each chunk; False leaves the whole change to the caller's commit
+
+    Returns:
+        Number of leads updated
+    """
+    def write(chunk):
+        criteria = [Lead.id.in_(chunk)]
+        if only_unassigned:
+            criteria += claimable(datetime.utcnow())
+        return db.session.execute(
+            update(Lead).where(*criteria).values(assigned_to=user_id)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+
+    return _apply_in_chunks(lead_ids, write, commit)
+
+
+def set_lead_status(lead_ids, status):
+    """Set the status of leads
+
+    Returns:
+        Number of leads updated
+    """
+    def write(chunk):
+        return db.session.execute(
+            update(Lead).where(Lead.id.in_(chunk)).values(status=status)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+
+    return _apply_in_chunks(lead_ids, write)
+
+
+def delete_leads(lead_ids):
+    """Delete leads with their custom field values and search documents
+
+    Leads flagged as duplicates of a deleted lead keep their data but lose the flag.
+
+    Returns:
+        Number of leads deleted
+    """
+    def write(chunk):
+        db.session.execute(
+            delete(LeadCustomField).where(LeadCustomField.lead_id.in_(chunk))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            delete(LeadSearchDocument).where(LeadSearchDocument.lead_id.in_(chunk))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            update(Lead).where(Lead.duplicate_of.in_(chunk)).values(duplicate_of=None)
+            .execution_options(synchronize_session=False)
+        )
+        return db.session.execute(
+            delete(Lead).where(Lead.id.in_(chunk))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+
+    return _apply_in_chunks(lead_ids, write)
@@ -0,0 +1,232 @@
+"""
+Lead list queries shared by the HTML lead pages and the JSON lead API.
+
+Filters are parsed from request arguments once, here, so both views accept
+the same ones. The API pages with an opaque cursor on (sort column, id) and
+returns only the requested fields as arrays, building them with the
+export engine's column plan so custom fields and names are loaded in bulk.
+"""
+import base64
+import json
+from datetime import date, datetime
+
+from sqlalchemy import Date, false, func, literal, tuple_
+
+import reference_data
+from custom_fields import custom_value_filter
+from exporter import LeadExportPlan
+from config import LEAD_TEXT_FIELDS
+from lead_search import MIN_TERM_LENGTH, matching_leads
+from models import Lead
+from utils import page_size
+
+# Fields the API can sort on; text and date columns sort with NULLs as the lowest value
+SORT_FIELDS = ['created_at', 'id', 'date'] + LEAD_TEXT_FIELDS
+
+# Fields returned when the request does not name any
+ADMIN_DEFAULT_FIELDS = ['id', 'first_name', 'last_name', 'email', 'phone', 'status', 'city', 'state',
+                        'created_at', 'assigned_to', 'workspace', 'duplicate_of']
+USER_DEFAULT_FIELDS = ['id', 'first_name', 'last_name', 'email', 'phone', 'status', 'city', 'state', 'created_at']
+
+# Filter argument prefix for custom field values, e.g. custom.Source=Referral
+CUSTOM_FILTER_PREFIX = 'custom.'
+
+
+class LeadQueryError(ValueError):
+    """A lead API request that cannot be answered, reported to the client as a 400"""
+
+
+def parse_date_arg(value):
+    """Parse a MM/DD/YYYY or YYYY-MM-DD date argument
+
+    Returns:
+        datetime at midnight, or None if the value is empty or invalid
+    """
+    if not value:
+        return None
+    for fmt in ('%m/%d/%Y', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def apply_lead_filters(query, args):
+    """Apply the lead list filters found in request arguments
+
+    Supports workspace_id, status, assigned_to (-1 for unassigned), start_date
+    and end_date (inclusive), date (a single day), custom.<header name> (an
+    exact custom field value) and q (a search text, see lead_search.py).
+    """
+    workspace_id = args.get('workspace_id', type=int)
+    status = args.get('status')
+    assigned_to = args.get('assigned_to', type=int)
+    start_date = parse_date_arg(args.get('start_date'))
+    end_date = parse_date_arg(args.get('end_date'))
+    day = parse_date_arg(args.get('date'))
+
+    if workspace_id:
+        query = query.filter(Lead.workspace_id == workspace_id)
+    if status:
+        query = query.filter(Lead.status == status)
+    if assigned_to == -1:
+        query = query.filter(Lead.assigned_to.is_(None))
+    elif assigned_to:
+        query = query.filter(Lead.assigned_to == assigned_to)
+    if start_date:
+        query = query.filter(Lead.created_at >= start_date)
+    if end_date:
+        query = query.filter(Lead.created_at <= end_date.replace(hour=23, minute=59, second=59))
+    if day:
+        query = query.filter(Lead.created_at >= day, Lead.created_at <= day.replace(hour=23, minute=59, second=59))
+    if args.get('q'):
+        matches = matching_leads(args.get('q'))
+        query = query.filter(Lead.id.in_(matches) if matches is not None else false())
+    for key, value in args.items():
+        if key.startswith(CUSTOM_FILTER_PREFIX) and value:
+            query = query.filter(custom_value_filter(
+                reference_data.header_ids(key[len(CUSTOM_FILTER_PREFIX):], workspace_id), value))
+    return query
+
+
+class LeadQueryPlan(LeadExportPlan):
+    """Column plan for API rows: the export columns plus ids and timestamps as JSON values"""
+
+    BUILTIN_FIELDS = LeadExportPlan.BUILTIN_FIELDS | {'id', 'created_at', 'duplicate_of'}
+
+    def _accessor(self, name):
+        if name in ('id', 'duplicate_of'):
+            return lambda lead, custom: getattr(lead, name)
+        if name == 'created_at':
+            return lambda lead, custom: lead.created_at.isoformat() if lead.created_at else None
+        if name == 'date':
+            return lambda lead, custom: lead.date.isoformat() if lead.date else None
+        return super()._accessor(name)
+
+
+def _sort_expression(sort):
+    column = getattr(Lead, sort)
+    if sort in LEAD_TEXT_FIELDS:
+        return func.coalesce(column, '')
+    if sort == 'date':
+        return func.coalesce(column, literal(date.min, Date))
+    return column
+
+
+def _encode_cursor(sort, value, lead_id):
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    raw = json.dumps([sort, [value, lead_id]])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor, sort):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        cursor_sort, (value, lead_id) = json.loads(raw)
+        if cursor_sort != sort:
+            raise ValueError(cursor_sort)
+        if sort == 'created_at':
+            value = datetime.fromisoformat(value)
+        elif sort == 'date':
+            value = date.fromisoformat(value)
+        elif sort == 'id':
+            value = int(value)
+        return value, int(lead_id)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise LeadQueryError('Invalid cursor')
+
+
+def resolve_fields(requested, default_fields, workspace_id=None):
+    """Validate requested field names against built-in fields and custom headers
+
+    Args:
+        requested: Comma-separated field names, or None for the defaults
+        default_fields: Fields to return when none are requested
+        workspace_id: Workspace whose custom headers may be requested; any workspace if None
+
+    Returns:
+        List of field names
+    """
+    if not requested:
+        return list(default_fields)
+    fields = [name.strip() for name in requested.split(',') if name.strip()]
+    custom = [name for name in fields if name not in LeadQueryPlan.BUILTIN_FIELDS]
+    if custom:
+        known = reference_data.header_names(workspace_id)
+        unknown = [name for name in custom if name not in known]
+        if unknown:
+            raise LeadQueryError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def query_leads(query, fields, sort='created_at', order='desc', after=None, limit=None):
+    """Fetch one page of leads as compact rows
+
+    Args:
+        query: Filtered Lead query
+        fields: Field names to return (see resolve_fields)
+        sort: One of SORT_FIELDS
+        order: 'asc' or 'desc'
+        after: Cursor returned as 'next' by the previous page
+        limit: Page size, clamped by utils.page_size
+
+    Returns:
+        dict with 'fields', 'rows' (one list of values per lead, in field order) and
+        'next' (cursor of the following page, or None)
+    """
+    if sort not in SORT_FIELDS:
+        raise LeadQueryError(f"Cannot sort by {sort}")
+    if order not in ('asc', 'desc'):
+        raise LeadQueryError(f"Invalid order: {order}")
+    limit = page_size(limit)
+
+    expression = _sort_expression(sort)
+    key = tuple_(expression, Lead.id)
+    if after:
+        position = _decode_cursor(after, sort)
+        query = query.filter(key < position if order == 'desc' else key > position)
+    if order == 'desc':
+        query = query.order_by(expression.desc(), Lead.id.desc())
+    else:
+        query = query.order_by(expression.asc(), Lead.id.asc())
+
+    leads = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(leads) > limit:
+        leads = leads[:limit]
+        last = leads[-1]
+        value = getattr(last, sort)
+        if value is None:
+            value = '' if sort in LEAD_TEXT_FIELDS else date.min
+        next_cursor = _encode_cursor(sort, value, last.id)
+
+    plan = LeadQueryPlan(fields)
+    return {'fields': fields, 'rows': plan.rows(leads), 'next': next_cursor}
+
+
+def search_leads(query, text, fields, limit=None):
+    """Fetch the leads that best match a search text, best first
+
+    Args:
+        query: Filtered Lead query to search within
+        text: Search text
+        fields: Field names to return (see resolve_fields)
+        limit: Number of leads, clamped by utils.page_size
+
+    Returns:
+        dict with 'fields' and 'rows' (one list of values per lead, in field order)
+    """
+    matches = matching_leads(text, ranked=True)
+    if matches is None:
+        raise LeadQueryError(f"Search needs a term of at least {MIN_TERM_LENGTH} characters")
+    matches = matches.subquery()
+    leads = (
+        query.join(matches, matches.c.lead_id == Lead.id)
+        .order_by(matches.c.score.desc(), Lead.id.desc())
+        .limit(page_size(limit))
+        .all()
+    )
+    plan = LeadQueryPlan(fields)
+    return {'fields': fields, 'rows': plan.rows(leads)}
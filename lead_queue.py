@@ -0,0 +1,183 @@
+"""
+Pull-based lead work queue.
+
+Agents claim the oldest unassigned leads of a workspace one at a time or in
+small batches. A claim is a lease: the lead stays unassigned, but carries the
+agent in claimed_by and a lease expiry, and no one else can claim it until
+the lease runs out. Completing a claim assigns the lead to the agent for
+good; releasing it, or letting the lease expire, returns it to the queue.
+
+On PostgreSQL the candidates are selected FOR UPDATE SKIP LOCKED, so
+concurrent agents each lock different rows instead of waiting on one another.
+Elsewhere (SQLite) the claim is a guarded UPDATE that only takes leads that
+are still free, followed by reading back which of them this claim won.
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, select, update
+
+from app import db
+from lead_stats import track_lead_stats
+from models import AssignmentMember, AssignmentRule, Lead
+
+logger = logging.getLogger(__name__)
+
+# Seconds an agent holds a claimed lead before it returns to the queue
+LEASE_SECONDS = int(os.environ.get('LEAD_LEASE_SECONDS', 900))
+
+# Most leads one claim may take
+MAX_CLAIM_BATCH = 50
+
+# Times the fallback claim retries when other agents took its candidates first
+CLAIM_ATTEMPTS = 5
+
+
+def claimable(now):
+    """Criteria of leads that can be claimed at the given time"""
+    return [
+        Lead.assigned_to.is_(None),
+        or_(Lead.lease_expires_at.is_(None), Lead.lease_expires_at < now),
+    ]
+
+
+def queue_workspace_ids(user_id):
+    """Workspaces whose queue a user may pull from: those whose assignment rule lists them"""
+    rows = (
+        db.session.query(AssignmentRule.workspace_id)
+        .join(AssignmentMember, AssignmentMember.rule_id == AssignmentRule.id)
+        .filter(AssignmentMember.user_id == user_id)
+    )
+    return [workspace_id for (workspace_id,) in rows]
+
+
+def claim_leads(workspace_id, user_id, count=1):
+    """Lease the oldest claimable leads of a workspace to a user
+
+    Args:
+        workspace_id: Workspace to pull from
+        user_id: Claiming user
+        count: Number of leads wanted, at most MAX_CLAIM_BATCH
+
+    Returns:
+        List of claimed Lead objects, oldest first; fewer than count when the queue runs dry
+    """
+    count = max(1, min(count, MAX_CLAIM_BATCH))
+    now = datetime.utcnow()
+    expires = now + timedelta(seconds=LEASE_SECONDS)
+    candidates = (
+        select(Lead.id)
+        .where(Lead.workspace_id == workspace_id, *claimable(now))
+        .order_by(Lead.created_at, Lead.id)
+    )
+
+    try:
+        if db.session.get_bind().dialect.name == 'postgresql':
+            lead_ids = list(db.session.scalars(candidates.limit(count).with_for_update(skip_locked=True)))
+            if lead_ids:
+                db.session.execute(
+                    update(Lead).where(Lead.id.in_(lead_ids))
+                    .values(claimed_by=user_id, lease_expires_at=expires)
+                    .execution_options(synchronize_session=False)
+                )
+            db.session.commit()
+        else:
+            lead_ids = _claim_guarded(candidates, count, user_id, now, expires)
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if not lead_ids:
+        return []
+    return Lead.query.filter(Lead.id.in_(lead_ids)).order_by(Lead.created_at, Lead.id).all()
+
+
+def _claim_guarded(candidates, count, user_id, now, expires):
+    """Claim without row locks: take only leads still free, then read back which were won"""
+    claimed = []
+    for _ in range(CLAIM_ATTEMPTS):
+        wanted = count - len(claimed)
+        lead_ids = list(db.session.scalars(candidates.limit(wanted)))
+        if not lead_ids:
+            break
+        won = db.session.execute(
+            update(Lead)
+            .where(Lead.id.in_(lead_ids), *claimable(now))
+            .values(claimed_by=user_id, lease_expires_at=expires)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if won:
+            claimed += db.session.scalars(
+                select(Lead.id).where(Lead.id.in_(lead_ids), Lead.claimed_by == user_id,
+                                      Lead.lease_expires_at == expires)
+            ).all()
+        db.session.commit()
+        if won == len(lead_ids) or len(claimed) >= count:
+            break
+    return claimed
+
+
+def active_claims(user_id, workspace_id=None):
+    """Leads a user currently holds a lease on, oldest first"""
+    query = Lead.query.filter(Lead.claimed_by == user_id, Lead.assigned_to.is_(None),
+                              Lead.lease_expires_at >= datetime.utcnow())
+    if workspace_id:
+        query = query.filter(Lead.workspace_id == workspace_id)
+    return query.order_by(Lead.created_at, Lead.id).all()
+
+
+def complete_claim(lead_id, user_id, status=None):
+    """Assign a claimed lead to the agent holding its lease
+
+    Args:
+        lead_id: Lead id
+        user_id: Agent completing the claim
+        status: New status for the lead, or None to keep it
+
+    Returns:
+        True if the lease was still held and the lead is now assigned
+    """
+    values = {'assigned_to': user_id, 'claimed_by': None, 'lease_expires_at': None}
+    if status:
+        values['status'] = status
+    try:
+        with track_lead_stats([lead_id]):
+            completed = db.session.execute(
+                update(Lead)
+                .where(Lead.id == lead_id, Lead.claimed_by == user_id, Lead.assigned_to.is_(None),
+                       Lead.lease_expires_at >= datetime.utcnow())
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return completed == 1
+
+
+def release_claim(lead_id, user_id):
+    """Return a claimed lead to the queue
+
+    Returns:
+        True if the user held a lease on the lead
+    """
+    released = db.session.execute(
+        update(Lead)
+        .where(Lead.id == lead_id, Lead.claimed_by == user_id, Lead.assigned_to.is_(None))
+        .values(claimed_by=None, lease_expires_at=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return released == 1
+
+
+def release_user_claims(user_id):
+    """Drop every lease a user holds, e.g. before deleting the user"""
+    db.session.execute(
+        update(Lead)
+        .where(Lead.claimed_by == user_id)
+        .values(claimed_by=None, lease_expires_at=None)
+        .execution_options(synchronize_session=False)
+    )
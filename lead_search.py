@@ -0,0 +1,146 @@
+"""
+Lead search index.
+
+Each lead has one search document: its names, contact details (the phone
+also as digits only) and custom field values, lower-cased into one text
+column. Imports rewrite the documents of the leads each batch inserts or
+updates, in the batch's transaction, and deleting leads deletes theirs, so
+the index stays current without full rebuilds. A rebuild is still needed
+once on a database that predates search, or after loading leads by hand:
+
+    python lead_search.py [--workspace 3]
+
+On PostgreSQL a document matches when it contains every term as a word
+(tsvector GIN index) or, fuzzily, as a fragment or near miss (pg_trgm GIN
+index); matches rank by ts_rank plus trigram word similarity. On SQLite an
+FTS5 table with the trigram tokenizer matches fragments and ranks by bm25.
+Terms shorter than MIN_TERM_LENGTH are ignored on both.
+"""
+import logging
+
+from sqlalchemy import and_, column, delete, insert, literal, literal_column, or_, select, table
+
+import custom_fields
+from app import db
+from models import Lead, LeadSearchDocument
+
+logger = logging.getLogger(__name__)
+
+# Lead columns that go into the search document
+SEARCH_FIELDS = ['first_name', 'last_name', 'email', 'phone', 'phone_normalized', 'city', 'state', 'bank']
+
+# Shortest term that is searched for; trigram matching needs three characters
+MIN_TERM_LENGTH = 3
+
+# Most terms of a search that are used
+MAX_TERMS = 8
+
+# Leads indexed per statement
+INDEX_CHUNK_SIZE = 1000
+
+# Text search configuration, written as in the PostgreSQL index expression so the planner can use it
+SEARCH_CONFIG = literal_column("'simple'")
+
+# SQLite FTS5 table kept in step with lead_search_documents (see models.LeadSearchDocument)
+lead_search_fts = table('lead_search_fts', column('rowid'), column('rank'), column('lead_search_fts'))
+
+
+def search_terms(text):
+    """Split a search text into the lower-cased terms that are searched for"""
+    terms = [term for term in (text or '').lower().split() if len(term) >= MIN_TERM_LENGTH]
+    return terms[:MAX_TERMS]
+
+
+def index_leads(lead_ids):
+    """Rewrite the search documents of leads, in the caller's transaction
+
+    Args:
+        lead_ids: Lead ids; ids of leads that no longer exist lose their document
+    """
+    lead_ids = sorted(set(lead_ids))
+    columns = [getattr(Lead, field) for field in SEARCH_FIELDS]
+    for start in range(0, len(lead_ids), INDEX_CHUNK_SIZE):
+        chunk = lead_ids[start:start + INDEX_CHUNK_SIZE]
+        rows = db.session.execute(select(Lead.id, *columns).where(Lead.id.in_(chunk))).all()
+        custom_values = custom_fields.all_custom_values([row[0] for row in rows])
+        db.session.execute(
+            delete(LeadSearchDocument).where(LeadSearchDocument.lead_id.in_(chunk))
+            .execution_options(synchronize_session=False)
+        )
+        documents = []
+        for lead_id, *values in rows:
+            values += custom_values[lead_id]
+            documents.append({'lead_id': lead_id, 'content': ' '.join(value for value in values if value).lower()})
+        if documents:
+            db.session.execute(insert(LeadSearchDocument), documents)
+
+
+def matching_leads(text, ranked=False):
+    """Select the leads whose documents match a search text
+
+    Args:
+        text: Search text
+        ranked: Also select a score column, higher for better matches
+
+    Returns:
+        Select of lead_id (and score), or None if the text has no usable terms
+    """
+    terms = search_terms(text)
+    if not terms:
+        return None
+
+    if db.session.get_bind().dialect.name == 'sqlite':
+        # Every term as a quoted FTS5 string: each must occur, anywhere in the document
+        match = ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+        columns = [lead_search_fts.c.rowid.label('lead_id')]
+        if ranked:
+            columns.append((-lead_search_fts.c.rank).label('score'))  # bm25, lower is better
+        return select(*columns).where(lead_search_fts.c.lead_search_fts.op('MATCH')(match))
+
+    content = LeadSearchDocument.content
+    words = db.func.to_tsvector(SEARCH_CONFIG, content)
+    query = db.func.plainto_tsquery(SEARCH_CONFIG, ' '.join(terms))
+    criterion = or_(
+        words.op('@@')(query),
+        and_(*(literal(term).op('<%')(content) for term in terms))
+    )
+    columns = [LeadSearchDocument.lead_id.label('lead_id')]
+    if ranked:
+        columns.append((db.func.ts_rank(words, query) +
+                        db.func.word_similarity(' '.join(terms), content)).label('score'))
+    return select(*columns).where(criterion)
+
+
+def rebuild(workspace_id=None):
+    """Index every lead, or every lead of one workspace, committing one chunk at a time
+
+    Returns:
+        Number of leads indexed
+    """
+    indexed = 0
+    last_id = 0
+    while True:
+        query = select(Lead.id).where(Lead.id > last_id)
+        if workspace_id:
+            query = query.where(Lead.workspace_id == workspace_id)
+        lead_ids = db.session.scalars(query.order_by(Lead.id).limit(INDEX_CHUNK_SIZE)).all()
+        if not lead_ids:
+            break
+        index_leads(lead_ids)
+        db.session.commit()
+        indexed += len(lead_ids)
+        last_id = lead_ids[-1]
+    logger.info("Indexed %s leads for search", indexed)
+    return indexed
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description='Rebuild the lead search index.')
+    parser.add_argument('--workspace', type=int, help='Only index this workspace')
+    args = parser.parse_args()
+
+    with create_app().app_context():
+        print(f"Indexed {rebuild(args.workspace)} leads")
@@ -0,0 +1,237 @@
+"""
+Lead statistics rollup.
+
+lead_daily_stats holds the number of leads per creation day, workspace,
+status and assignee, so dashboard and report figures are sums over a few
+rollup rows instead of scans of the leads table. Every code path that
+creates, reassigns, changes the status of or deletes leads records the
+difference in the same transaction as the write: it locks the affected
+leads and takes their rollup keys, writes, takes the keys again and applies
+the delta with an upsert, and once the transaction commits the cached
+statistics of the touched workspaces are invalidated. The lock makes a
+concurrent writer of the same leads wait and then read what this one wrote.
+
+The rebuild command recomputes the whole table from the leads, for
+backfills and to repair drift:
+
+    flask --app main rebuild-lead-stats
+"""
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, datetime
+
+from sqlalchemy import delete, event, func, insert, select, update
+from sqlalchemy.orm import Session
+
+import reference_data
+from app import db
+from models import Lead, LeadDailyStat
+from result_cache import bump_generations
+
+logger = logging.getLogger(__name__)
+
+# assigned_to value of unassigned leads, and status value of leads without one
+UNASSIGNED = 0
+NO_STATUS = ''
+
+# Number of lead ids per IN (...) lookup
+KEY_CHUNK_SIZE = 1000
+
+KEY_COLUMNS = ('day', 'workspace_id', 'status', 'assigned_to')
+
+# Session.info entry collecting the workspaces whose statistics changed in the transaction
+CHANGED_WORKSPACES = 'lead_stats_changed_workspaces'
+
+
+def stats_generations(workspace_id=None):
+    """Result cache generations that statistics for a workspace (or all) depend on
+
+    There is no generation for all workspaces together, which every lead write
+    would have to lock: statistics over all workspaces depend on the
+    generation of each one instead.
+    """
+    if workspace_id:
+        return [f'lead_stats:{workspace_id}']
+    return [f'lead_stats:{workspace.id}' for workspace in reference_data.workspaces()]
+
+
+@event.listens_for(Session, 'before_commit')
+def _invalidate_cached_stats(session):
+    workspace_ids = session.info.pop(CHANGED_WORKSPACES, None)
+    if workspace_ids:
+        bump_generations([f'lead_stats:{workspace_id}' for workspace_id in workspace_ids], session)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_stats(session):
+    session.info.pop(CHANGED_WORKSPACES, None)
+
+
+def lead_stat_keys(lead_ids, lock=False):
+    """Count the given leads by rollup key
+
+    Args:
+        lead_ids: Lead ids
+        lock: Lock the leads until the transaction ends, so that a concurrent
+            writer cannot change them between this read and the caller's
+            write; the "before" read of a tracked write must lock, or two
+            writers both apply their delta to the same old keys
+
+    Returns:
+        Counter: (day, workspace_id, status, assigned_to) -> number of leads
+    """
+    keys = Counter()
+    ids = sorted({int(lead_id) for lead_id in lead_ids})
+    sqlite = lock and db.session.get_bind().dialect.name == 'sqlite'
+    for start in range(0, len(ids), KEY_CHUNK_SIZE):
+        chunk = ids[start:start + KEY_CHUNK_SIZE]
+        rows = (
+            db.session.query(Lead.created_at, Lead.workspace_id, Lead.status, Lead.assigned_to)
+            .filter(Lead.id.in_(chunk))
+        )
+        if sqlite:
+            # SQLite has no row locks; a no-op write takes the database write lock instead
+            table = Lead.__table__
+            db.session.execute(table.update().where(table.c.id.in_(chunk)).values(id=table.c.id))
+        elif lock:
+            # In id order, so writers locking overlapping leads cannot deadlock
+            rows = rows.order_by(Lead.id).with_for_update()
+        for created_at, workspace_id, status, assigned_to in rows:
+            if created_at is None:
+                continue
+            keys[(created_at.date(), workspace_id, status or NO_STATUS, assigned_to or UNASSIGNED)] += 1
+    return keys
+
+
+def apply_lead_stat_changes(before, after):
+    """Apply the difference between two lead_stat_keys() counts to the rollup
+
+    Runs in the caller's transaction, so the rollup commits or rolls back
+    together with the lead write it describes.
+    """
+    deltas = [
+        dict(zip(KEY_COLUMNS, key), lead_count=after[key] - before[key])
+        for key in before.keys() | after.keys()
+        if after[key] != before[key]
+    ]
+    if not deltas:
+        return
+
+    _upsert(deltas)
+    # Cached statistics are invalidated once the write commits
+    db.session.info.setdefault(CHANGED_WORKSPACES, set()).update(row['workspace_id'] for row in deltas)
+    # Drop rows that no longer count any lead
+    db.session.execute(
+        delete(LeadDailyStat)
+        .where(LeadDailyStat.lead_count <= 0, LeadDailyStat.day.in_({row['day'] for row in deltas}))
+    )
+
+
+def _upsert(deltas):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        dialect_insert = None
+
+    if dialect_insert is not None:
+        stmt = dialect_insert(LeadDailyStat)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(KEY_COLUMNS),
+            set_={'lead_count': LeadDailyStat.lead_count + stmt.excluded.lead_count}
+        )
+        db.session.execute(stmt, deltas)
+        return
+
+    # Databases without ON CONFLICT: update what exists, insert the rest
+    for row in deltas:
+        matched = db.session.execute(
+            update(LeadDailyStat)
+            .where(*(getattr(LeadDailyStat, column) == row[column] for column in KEY_COLUMNS))
+            .values(lead_count=LeadDailyStat.lead_count + row['lead_count'])
+        ).rowcount
+        if not matched:
+            db.session.execute(insert(LeadDailyStat), [row])
+
+
+@contextmanager
+def track_lead_stats(lead_ids):
+    """Keep the rollup in step with a write to the given leads
+
+    Usage:
+        with track_lead_stats(lead_ids):
+            ... assign, update or delete those leads ...
+        db.session.commit()
+    """
+    lead_ids = list(lead_ids)
+    before = lead_stat_keys(lead_ids, lock=True)
+    yield
+    db.session.flush()
+    apply_lead_stat_changes(before, lead_stat_keys(lead_ids))
+
+
+def day_bounds(start_date=None, end_date=None):
+    """Turn the created_at bounds used by get_lead_stats into rollup day bounds
+
+    created_at <= an end date at midnight means "before that day"; any later
+    end time includes its whole day.
+
+    Returns:
+        (first day or None, last day or None), both inclusive
+    """
+    first = last = None
+    if start_date:
+        first = start_date.date() if isinstance(start_date, datetime) else start_date
+    if end_date:
+        if isinstance(end_date, datetime) and end_date.time() != datetime.min.time():
+            last = end_date.date()
+        else:
+            day = end_date.date() if isinstance(end_date, datetime) else end_date
+            last = date.fromordinal(day.toordinal() - 1)
+    return first, last
+
+
+def rebuild():
+    """Recompute the whole rollup from the leads table in one transaction
+
+    Returns:
+        Number of rollup rows written
+    """
+    day = func.date(Lead.created_at)
+    status = func.coalesce(Lead.status, NO_STATUS)
+    assigned_to = func.coalesce(Lead.assigned_to, UNASSIGNED)
+    counts = (
+        select(day, Lead.workspace_id, status, assigned_to, func.count())
+        .where(Lead.created_at.isnot(None))
+        .group_by(day, Lead.workspace_id, status, assigned_to)
+    )
+    try:
+        db.session.execute(delete(LeadDailyStat))
+        db.session.execute(
+            insert(LeadDailyStat).from_select(list(KEY_COLUMNS) + ['lead_count'], counts)
+        )
+        rows = db.session.query(func.count(LeadDailyStat.id)).scalar()
+        db.session.info.setdefault(CHANGED_WORKSPACES, set()).update(
+            workspace_id for (workspace_id,) in db.session.query(LeadDailyStat.workspace_id).distinct()
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    logger.info("Rebuilt lead statistics rollup with %s rows", rows)
+    return rows
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description='Maintain the lead statistics rollup.')
+    parser.add_argument('command', choices=['rebuild'], help='rebuild: recompute the rollup from all leads')
+    args = parser.parse_args()
+
+    with create_app().app_context():
+        print(f"Rebuilt lead_daily_stats: {rebuild()} rows")
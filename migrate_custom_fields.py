@@ -0,0 +1,93 @@
+"""
+Database migration script for JSON custom field storage.
+Adds the custom_data column to the leads table, creates its GIN index on
+PostgreSQL and copies every lead's lead_custom_fields values into it.
+
+The copy runs online, one committed chunk of leads at a time, while the
+application keeps writing both layouts with CUSTOM_FIELD_STORAGE=dual. Once
+it has finished the application can be switched to CUSTOM_FIELD_STORAGE=json.
+Running it again is safe; it rewrites custom_data from the rows.
+"""
+import logging
+import sys
+
+from sqlalchemy import inspect, select, text, update
+
+from app import create_app, db
+from custom_fields import CHUNK_SIZE, custom_data
+from migrate_indexes import create_indexes
+from models import Lead, LeadCustomField
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def add_column():
+    """Add the custom_data column if it doesn't already exist"""
+    existing = {col['name'] for col in inspect(db.engine).get_columns('leads')}
+    if 'custom_data' in existing:
+        logger.info("Column custom_data already exists in leads table.")
+        return
+    column_type = Lead.__table__.c.custom_data.type.compile(dialect=db.engine.dialect)
+    logger.info(f"Adding column custom_data ({column_type}) to leads table...")
+    with db.engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE leads ADD COLUMN custom_data {column_type}"))
+
+
+def backfill_custom_data():
+    """Copy custom field rows into custom_data, one chunk of leads per transaction
+
+    Returns:
+        Number of leads written
+    """
+    written = 0
+    last_id = 0
+    while True:
+        lead_ids = db.session.scalars(
+            select(Lead.id).where(Lead.id > last_id).order_by(Lead.id).limit(CHUNK_SIZE)
+        ).all()
+        if not lead_ids:
+            break
+        last_id = lead_ids[-1]
+
+        # The first value stored for a header (lowest id) wins, as when reading rows
+        pairs = {}
+        rows = db.session.execute(
+            select(LeadCustomField.lead_id, LeadCustomField.header_id, LeadCustomField.value)
+            .where(LeadCustomField.lead_id.in_(lead_ids))
+            .order_by(LeadCustomField.id.desc())
+        )
+        for lead_id, header_id, value in rows:
+            pairs.setdefault(lead_id, {})[header_id] = value
+
+        current = dict(db.session.execute(
+            select(Lead.id, Lead.custom_data).where(Lead.id.in_(list(pairs)))
+        ).all())
+        values = []
+        for lead_id, by_header in pairs.items():
+            data = {**(current.get(lead_id) or {}), **(custom_data(by_header.items()) or {})}
+            values.append({'id': lead_id, 'custom_data': data or None})
+        if values:
+            db.session.execute(update(Lead), values)
+        db.session.commit()
+        written += len(values)
+        logger.info(f"Backfilled custom_data up to lead {last_id} ({written} leads written)")
+    return written
+
+
+def run_migrations():
+    """Run all steps of the migration"""
+    try:
+        with create_app().app_context():
+            add_column()
+            create_indexes()
+            written = backfill_custom_data()
+            logger.info(f"Migration completed successfully, custom_data written for {written} leads")
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run_migrations()
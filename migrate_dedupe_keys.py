@@ -0,0 +1,93 @@
+"""
+Database migration script for import-time duplicate detection.
+Adds the normalized email/phone columns and duplicate_of to the leads table,
+creates their indexes and backfills the keys for existing leads in chunks.
+"""
+import logging
+import sys
+
+from sqlalchemy import inspect, text, update
+
+from app import create_app, db
+from dedupe import normalize_emails, normalize_phones
+from models import Lead
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BACKFILL_CHUNK_SIZE = 5000
+
+COLUMNS = [
+    ('email_normalized', 'VARCHAR(120)'),
+    ('phone_normalized', 'VARCHAR(20)'),
+    ('duplicate_of', 'INTEGER REFERENCES leads (id)'),
+]
+
+
+def add_columns():
+    """Add the new columns if they don't already exist"""
+    existing = {col['name'] for col in inspect(db.engine).get_columns('leads')}
+    with db.engine.begin() as conn:
+        for column_name, column_type in COLUMNS:
+            if column_name in existing:
+                logger.info(f"Column {column_name} already exists in leads table.")
+                continue
+            logger.info(f"Adding column {column_name} to leads table...")
+            conn.execute(text(f"ALTER TABLE leads ADD COLUMN {column_name} {column_type}"))
+
+
+def create_indexes():
+    """Create the lookup indexes declared on the Lead model"""
+    for index in Lead.__table__.indexes:
+        if index.name in ('ix_leads_workspace_email_normalized', 'ix_leads_workspace_phone_normalized'):
+            logger.info(f"Creating index {index.name}...")
+            index.create(db.engine, checkfirst=True)
+
+
+def backfill_keys():
+    """Fill normalized keys for leads imported before they existed"""
+    total = 0
+    last_id = 0
+    while True:
+        rows = (
+            db.session.query(Lead.id, Lead.email, Lead.phone)
+            .filter(Lead.id > last_id, Lead.email_normalized.is_(None), Lead.phone_normalized.is_(None))
+            .order_by(Lead.id)
+            .limit(BACKFILL_CHUNK_SIZE)
+            .all()
+        )
+        if not rows:
+            break
+
+        ids = [row.id for row in rows]
+        emails = normalize_emails([row.email for row in rows])
+        phones = normalize_phones([row.phone for row in rows])
+        db.session.execute(update(Lead), [
+            {'id': lead_id, 'email_normalized': email, 'phone_normalized': phone}
+            for lead_id, email, phone in zip(ids, emails, phones)
+        ])
+        db.session.commit()
+
+        total += len(rows)
+        last_id = ids[-1]
+        logger.info(f"Backfilled {total} leads...")
+
+    return total
+
+
+def run_migrations():
+    """Run all steps of the migration"""
+    try:
+        with create_app().app_context():
+            add_columns()
+            create_indexes()
+            total = backfill_keys()
+            logger.info(f"Migration completed successfully, {total} leads backfilled")
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run_migrations()
@@ -0,0 +1,54 @@
+"""
+Database migration script for import job owners.
+Recreates the import_jobs.created_by foreign key with ON DELETE SET NULL, so
+that users who have submitted imports can be deleted.
+"""
+import logging
+import sys
+
+from sqlalchemy import inspect, text
+
+from app import create_app, db
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def update_created_by_key():
+    """Replace the created_by foreign key if it does not set null on delete yet"""
+    if db.engine.dialect.name != 'postgresql':
+        # SQLite cannot alter constraints, and does not enforce this one unless foreign keys are switched on
+        logger.info("Skipping: foreign keys can only be altered on PostgreSQL.")
+        return
+
+    keys = [key for key in inspect(db.engine).get_foreign_keys('import_jobs')
+            if key['constrained_columns'] == ['created_by']]
+    if keys and all((key.get('options') or {}).get('ondelete', '').upper() == 'SET NULL' for key in keys):
+        logger.info("Foreign key on import_jobs.created_by already sets null on delete.")
+        return
+
+    with db.engine.begin() as conn:
+        for key in keys:
+            logger.info(f"Dropping foreign key {key['name']}...")
+            conn.execute(text(f'ALTER TABLE import_jobs DROP CONSTRAINT "{key["name"]}"'))
+        logger.info("Adding foreign key import_jobs_created_by_fkey with ON DELETE SET NULL...")
+        conn.execute(text(
+            "ALTER TABLE import_jobs ADD CONSTRAINT import_jobs_created_by_fkey "
+            "FOREIGN KEY (created_by) REFERENCES users (id) ON DELETE SET NULL"
+        ))
+
+
+def run_migrations():
+    """Run all steps of the migration"""
+    try:
+        with create_app().app_context():
+            update_created_by_key()
+            logger.info("Migration completed successfully")
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run_migrations()
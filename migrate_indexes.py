@@ -0,0 +1,55 @@
+"""
+Database migration script for the lead query indexes.
+Creates every index declared on the models that an existing database is
+missing, e.g. the lead list, assignee and custom field indexes. New databases
+get them from db.create_all(). On PostgreSQL the indexes are built
+concurrently, so the tables stay writable while they build.
+"""
+import logging
+import sys
+
+from app import create_app, db
+from models import Lead, LeadCustomField, WorkspaceHeader
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MODELS = [Lead, LeadCustomField, WorkspaceHeader]
+
+
+def create_indexes():
+    """Create the indexes declared on the models if they don't already exist
+
+    Returns:
+        Number of indexes checked
+    """
+    concurrently = db.engine.dialect.name == 'postgresql'
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    options = {'isolation_level': 'AUTOCOMMIT'} if concurrently else {}
+    count = 0
+    with db.engine.connect().execution_options(**options) as conn:
+        for model in MODELS:
+            for index in model.__table__.indexes:
+                if concurrently:
+                    index.dialect_options['postgresql']['concurrently'] = True
+                logger.info(f"Creating index {index.name} if missing...")
+                index.create(conn, checkfirst=True)
+                count += 1
+        conn.commit()
+    return count
+
+
+def run_migrations():
+    """Run all steps of the migration"""
+    try:
+        with create_app().app_context():
+            count = create_indexes()
+            logger.info(f"Migration completed successfully, {count} indexes checked")
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run_migrations()
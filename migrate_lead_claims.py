@@ -0,0 +1,49 @@
+"""
+Database migration script for the lead work queue.
+Adds the claimed_by and lease_expires_at columns to the leads table and
+creates the queue indexes.
+"""
+import logging
+import sys
+
+from sqlalchemy import inspect, text
+
+from app import create_app, db
+from migrate_indexes import create_indexes
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+COLUMNS = [
+    ('claimed_by', 'INTEGER REFERENCES users (id)'),
+    ('lease_expires_at', 'TIMESTAMP'),
+]
+
+
+def add_columns():
+    """Add the new columns if they don't already exist"""
+    existing = {col['name'] for col in inspect(db.engine).get_columns('leads')}
+    with db.engine.begin() as conn:
+        for column_name, column_type in COLUMNS:
+            if column_name in existing:
+                logger.info(f"Column {column_name} already exists in leads table.")
+                continue
+            logger.info(f"Adding column {column_name} to leads table...")
+            conn.execute(text(f"ALTER TABLE leads ADD COLUMN {column_name} {column_type}"))
+
+
+def run_migrations():
+    """Run all steps of the migration"""
+    try:
+        with create_app().app_context():
+            add_columns()
+            create_indexes()
+            logger.info("Migration completed successfully")
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run_migrations()
@@ -0,0 +1,49 @@
+"""
+Database migration script for diff-based workspace header edits.
+Adds the dropped_at and purged_through columns to the workspace_headers table
+and creates the lead_custom_fields index the purge of dropped headers uses.
+"""
+import logging
+import sys
+
+from sqlalchemy import inspect, text
+
+from app import create_app, db
+from migrate_indexes import create_indexes
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+COLUMNS = [
+    ('dropped_at', 'TIMESTAMP'),
+    ('purged_through', 'INTEGER'),
+]
+
+
+def add_columns():
+    """Add the new columns if they don't already exist"""
+    existing = {col['name'] for col in inspect(db.engine).get_columns('workspace_headers')}
+    with db.engine.begin() as conn:
+        for column_name, column_type in COLUMNS:
+            if column_name in existing:
+                logger.info(f"Column {column_name} already exists in workspace_headers table.")
+                continue
+            logger.info(f"Adding column {column_name} to workspace_headers table...")
+            conn.execute(text(f"ALTER TABLE workspace_headers ADD COLUMN {column_name} {column_type}"))
+
+
+def run_migrations():
+    """Run all steps of the migration"""
+    try:
+        with create_app().app_context():
+            add_columns()
+            create_indexes()
+            logger.info("Migration completed successfully")
+    except Exception as e:
+        logger.error(f"Error during migration: {str(e)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run_migrations()
@@ -6,7 +6,7 @@ import os
 import sys
 import logging
 from sqlalchemy import text, inspect
-from app import app, db
+from app import create_app, db
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -23,7 +23,7 @@ def run_migrations():
     conn = None
     try:
         # Set up application context
-        with app.app_context():
+        with create_app().app_context():
             # Connect to the database
             conn = db.engine.connect()
             logger.info("Connected to database, starting migrations...")
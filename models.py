@@ -1,4 +1,8 @@
 from datetime import datetime
+from itertools import chain
+from sqlalchemy import DDL, event
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import JSONB
 from app import db
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -37,15 +41,42 @@ class Workspace(db.Model):
 
 class WorkspaceHeader(db.Model):
     __tablename__ = 'workspace_headers'
+    __table_args__ = (
+        # Header lists are loaded per workspace in display order
+        db.Index('ix_workspace_headers_workspace_order', 'workspace_id', 'order'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     workspace_id = db.Column(db.Integer, db.ForeignKey('workspaces.id'), nullable=False)
     header_name = db.Column(db.String(100), nullable=False)
     is_default = db.Column(db.Boolean, default=False)  # True for system default headers
     order = db.Column(db.Integer, nullable=False)  # To maintain header order
+    # Set when an edit removes the header; its values are purged in the background (see workspace_schema)
+    dropped_at = db.Column(db.DateTime)
+    purged_through = db.Column(db.Integer)  # Last lead id whose custom_data the purge has cleaned
 
 class Lead(db.Model):
     __tablename__ = 'leads'
+    __table_args__ = (
+        # Duplicate detection on import looks leads up by normalized key within a workspace
+        db.Index('ix_leads_workspace_email_normalized', 'workspace_id', 'email_normalized'),
+        db.Index('ix_leads_workspace_phone_normalized', 'workspace_id', 'phone_normalized'),
+        # Lead lists are paginated by seeking on (created_at, id), within a workspace or assignee when filtered
+        db.Index('ix_leads_created_at_id', 'created_at', 'id'),
+        db.Index('ix_leads_workspace_created_at', 'workspace_id', 'created_at', 'id'),
+        db.Index('ix_leads_assigned_to_created_at', 'assigned_to', 'created_at', 'id'),
+        # Status filters and counts within a workspace
+        db.Index('ix_leads_workspace_status', 'workspace_id', 'status'),
+        # Deleting a lead clears duplicate_of on the leads flagged against it
+        db.Index('ix_leads_duplicate_of', 'duplicate_of'),
+        # The work queue pulls the oldest unassigned leads of a workspace, see lead_queue.py
+        db.Index('ix_leads_unassigned_queue', 'workspace_id', 'created_at', 'id',
+                 postgresql_where=db.text('assigned_to IS NULL'), sqlite_where=db.text('assigned_to IS NULL')),
+        db.Index('ix_leads_claimed_by', 'claimed_by'),
+        # Custom field lookups by value (JSON storage mode, see custom_fields.py); GIN exists on PostgreSQL only
+        db.Index('ix_leads_custom_data', 'custom_data', postgresql_using='gin',
+                 postgresql_ops={'custom_data': 'jsonb_path_ops'}).ddl_if(dialect='postgresql'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(100))
@@ -60,12 +91,24 @@ class Lead(db.Model):
     assigned_to = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     workspace_id = db.Column(db.Integer, db.ForeignKey('workspaces.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    email_normalized = db.Column(db.String(120))  # Lower-cased email, used for duplicate detection
+    phone_normalized = db.Column(db.String(20))  # Digits only, used for duplicate detection
+    duplicate_of = db.Column(db.Integer, db.ForeignKey('leads.id'), nullable=True)  # Set when imported as a flagged duplicate
+    claimed_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # Agent holding a work queue lease
+    lease_expires_at = db.Column(db.DateTime)  # The lead returns to the queue after this unless completed
+    custom_data = db.Column(db.JSON().with_variant(JSONB(), 'postgresql'))  # Header id -> value, when custom fields are stored as JSON
     
     # For custom fields
     custom_fields = db.relationship('LeadCustomField', backref='lead', lazy=True, cascade='all, delete-orphan')
 
 class LeadCustomField(db.Model):
     __tablename__ = 'lead_custom_fields'
+    __table_args__ = (
+        # Custom values are loaded and deleted by lead
+        db.Index('ix_lead_custom_fields_lead_header', 'lead_id', 'header_id'),
+        # Dropped headers have their values purged by header
+        db.Index('ix_lead_custom_fields_header', 'header_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     lead_id = db.Column(db.Integer, db.ForeignKey('leads.id'), nullable=False)
@@ -73,3 +116,145 @@ class LeadCustomField(db.Model):
     value = db.Column(db.String(255))
     
     header = db.relationship('WorkspaceHeader')
+
+class LeadSearchDocument(db.Model):
+    __tablename__ = 'lead_search_documents'
+    __table_args__ = (
+        # Word search and fuzzy (trigram) matching, see lead_search.py; PostgreSQL only,
+        # SQLite searches the lead_search_fts table kept in step by triggers instead
+        db.Index('ix_lead_search_documents_words', db.text("to_tsvector('simple', content)"),
+                 postgresql_using='gin').ddl_if(dialect='postgresql'),
+        db.Index('ix_lead_search_documents_trigrams', 'content', postgresql_using='gin',
+                 postgresql_ops={'content': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
+    
+    # The text a lead is found by: names, contact details and custom field values, lower-cased
+    lead_id = db.Column(db.Integer, db.ForeignKey('leads.id', ondelete='CASCADE'), primary_key=True)
+    content = db.Column(db.Text, nullable=False, default='')
+
+event.listen(LeadSearchDocument.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+for statement in [
+    # External content FTS5 table over lead_search_documents; trigram tokens match any fragment of 3+ characters
+    "CREATE VIRTUAL TABLE IF NOT EXISTS lead_search_fts USING fts5("
+    "content, content='lead_search_documents', content_rowid='lead_id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS lead_search_fts_insert AFTER INSERT ON lead_search_documents BEGIN "
+    "INSERT INTO lead_search_fts (rowid, content) VALUES (new.lead_id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS lead_search_fts_delete AFTER DELETE ON lead_search_documents BEGIN "
+    "INSERT INTO lead_search_fts (lead_search_fts, rowid, content) VALUES ('delete', old.lead_id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS lead_search_fts_update AFTER UPDATE ON lead_search_documents BEGIN "
+    "INSERT INTO lead_search_fts (lead_search_fts, rowid, content) VALUES ('delete', old.lead_id, old.content); "
+    "INSERT INTO lead_search_fts (rowid, content) VALUES (new.lead_id, new.content); END",
+]:
+    event.listen(LeadSearchDocument.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(LeadSearchDocument.__table__, 'after_drop',
+             DDL('DROP TABLE IF EXISTS lead_search_fts').execute_if(dialect='sqlite'))
+
+class ImportJob(db.Model):
+    __tablename__ = 'import_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    workspace_id = db.Column(db.Integer, db.ForeignKey('workspaces.id'), nullable=False)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)  # Cleared when the user is deleted
+    file_path = db.Column(db.String(500), nullable=False)
+    header_mapping = db.Column(db.Text, nullable=False)  # JSON encoded CSV header -> field mapping
+    dedupe_policy = db.Column(db.String(20), nullable=False, default='none')  # none, skip, update or flag
+    dedupe_on = db.Column(db.String(20), nullable=False, default='email_or_phone')  # email, phone or email_or_phone
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, completed, failed
+    total_rows = db.Column(db.Integer)  # Estimated from the file's line count
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)  # Rows committed so far
+    success_count = db.Column(db.Integer, nullable=False, default=0)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    skipped_count = db.Column(db.Integer, nullable=False, default=0)  # Duplicates skipped
+    updated_count = db.Column(db.Integer, nullable=False, default=0)  # Duplicates that updated an existing lead
+    flagged_count = db.Column(db.Integer, nullable=False, default=0)  # Duplicates imported with duplicate_of set
+    errors = db.Column(db.Text)  # JSON encoded list, capped
+    worker_pid = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)  # Bumped on every committed batch
+    finished_at = db.Column(db.DateTime)
+    
+    workspace = db.relationship('Workspace')
+
+class LeadDailyStat(db.Model):
+    __tablename__ = 'lead_daily_stats'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'workspace_id', 'status', 'assigned_to', name='uq_lead_daily_stats_key'),
+    )
+    
+    # Rollup of lead counts, maintained by lead_stats.py; no foreign keys so it never blocks deletes
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)  # UTC date of Lead.created_at
+    workspace_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(50), nullable=False)  # '' for leads without a status
+    assigned_to = db.Column(db.Integer, nullable=False)  # 0 for unassigned leads
+    lead_count = db.Column(db.Integer, nullable=False, default=0)
+
+class ReferenceVersion(db.Model):
+    __tablename__ = 'reference_versions'
+    
+    # One row, bumped whenever users, workspaces or workspace headers change (see reference_data.py)
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+event.listen(ReferenceVersion.__table__, 'after_create',
+             DDL('INSERT INTO reference_versions (id, version) VALUES (1, 0)'))
+
+class ResultGeneration(db.Model):
+    __tablename__ = 'result_generations'
+    
+    # Invalidation counters of the result cache, shared by every process (see result_cache.py)
+    name = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class AssignmentRule(db.Model):
+    __tablename__ = 'assignment_rules'
+    
+    # How unassigned leads of a workspace are distributed, see assignment.py
+    id = db.Column(db.Integer, primary_key=True)
+    workspace_id = db.Column(db.Integer, db.ForeignKey('workspaces.id'), nullable=False, unique=True)
+    strategy = db.Column(db.String(20), nullable=False, default='round_robin')  # round_robin, weighted or least_loaded
+    auto_assign = db.Column(db.Boolean, nullable=False, default=False)  # Run after every import into the workspace
+    next_position = db.Column(db.Integer, nullable=False, default=0)  # Round-robin position carried between runs
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    workspace = db.relationship('Workspace', backref=db.backref('assignment_rule', uselist=False, cascade='all, delete-orphan'))
+    members = db.relationship('AssignmentMember', backref='rule', lazy=True, cascade='all, delete-orphan',
+                              order_by='AssignmentMember.user_id')
+
+class AssignmentMember(db.Model):
+    __tablename__ = 'assignment_members'
+    __table_args__ = (
+        db.UniqueConstraint('rule_id', 'user_id', name='uq_assignment_members_rule_user'),
+    )
+    
+    # A user eligible for a workspace's automatic assignment
+    id = db.Column(db.Integer, primary_key=True)
+    rule_id = db.Column(db.Integer, db.ForeignKey('assignment_rules.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    weight = db.Column(db.Integer, nullable=False, default=1)  # Relative capacity for the weighted strategy
+    
+    user = db.relationship('User', backref=db.backref('assignment_memberships', cascade='all, delete-orphan'))
+
+# Reference data (users, workspaces, headers) is cached per process; every write to it bumps the
+# version row in the same transaction so that all processes reload (see reference_data.py)
+REFERENCE_MODELS = (User, Workspace, WorkspaceHeader)
+
+def bump_reference_version(session):
+    session.connection().execute(
+        ReferenceVersion.__table__.update().where(ReferenceVersion.id == 1)
+        .values(version=ReferenceVersion.version + 1)
+    )
+
+@event.listens_for(Session, 'after_flush')
+def _reference_data_flushed(session, flush_context):
+    if any(isinstance(obj, REFERENCE_MODELS) for obj in chain(session.new, session.dirty, session.deleted)):
+        bump_reference_version(session)
+
+@event.listens_for(Session, 'do_orm_execute')
+def _reference_data_bulk_write(orm_execute_state):
+    mapper = orm_execute_state.bind_mapper
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and mapper is not None \
+            and mapper.class_ in REFERENCE_MODELS:
+        bump_reference_version(orm_execute_state.session)
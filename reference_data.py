@@ -0,0 +1,139 @@
+"""
+Process-local cache of reference data: users, workspaces and each workspace's
+ordered headers.
+
+These tables are small, read by nearly every page, import and export, and
+change only when an admin edits them. Each process keeps one snapshot of all
+three, tagged with the version in the reference_versions row. Every flush or
+bulk statement that writes a User, Workspace or WorkspaceHeader bumps that
+version in its own transaction (see models.py), so the first check after the
+commit, in any process, sees the new version and reloads the snapshot.
+
+A request checks the version once, however often it uses the cache, so a
+page costs one primary key lookup instead of its reference queries. Outside
+requests (import workers, scripts) every use checks.
+
+Snapshot entries are read-only tuples, safe to share between requests and
+threads.
+"""
+import logging
+from collections import namedtuple
+
+from flask import has_request_context, request
+from sqlalchemy import select
+
+from app import db
+from models import ReferenceVersion, User, Workspace, WorkspaceHeader
+
+logger = logging.getLogger(__name__)
+
+UserInfo = namedtuple('UserInfo', ['id', 'username', 'email', 'role', 'created_at'])
+WorkspaceInfo = namedtuple('WorkspaceInfo', ['id', 'name', 'created_at', 'created_by', 'creator_name', 'headers'])
+HeaderInfo = namedtuple('HeaderInfo', ['id', 'workspace_id', 'header_name', 'is_default', 'order'])
+
+Snapshot = namedtuple('Snapshot', ['version', 'users', 'users_by_id', 'user_names',
+                                   'workspaces', 'workspaces_by_id', 'workspace_names'])
+
+# Where a request keeps the version it has checked
+ENVIRON_KEY = 'reference_data.version'
+
+_snapshot = None
+
+
+def current_version():
+    """Read the reference data version, once per request"""
+    if has_request_context() and ENVIRON_KEY in request.environ:
+        return request.environ[ENVIRON_KEY]
+    version = db.session.scalar(select(ReferenceVersion.version).where(ReferenceVersion.id == 1)) or 0
+    if has_request_context():
+        request.environ[ENVIRON_KEY] = version
+    return version
+
+
+def _load(version):
+    users = [UserInfo(*row) for row in db.session.execute(
+        select(User.id, User.username, User.email, User.role, User.created_at).order_by(User.id)
+    )]
+    users_by_id = {user.id: user for user in users}
+
+    headers = {}
+    for row in db.session.execute(
+        select(WorkspaceHeader.id, WorkspaceHeader.workspace_id, WorkspaceHeader.header_name,
+               WorkspaceHeader.is_default, WorkspaceHeader.order)
+        .where(WorkspaceHeader.dropped_at.is_(None))
+        .order_by(WorkspaceHeader.workspace_id, WorkspaceHeader.order, WorkspaceHeader.id)
+    ):
+        header = HeaderInfo(*row)
+        headers.setdefault(header.workspace_id, []).append(header)
+
+    workspaces = []
+    for workspace_id, name, created_at, created_by in db.session.execute(
+        select(Workspace.id, Workspace.name, Workspace.created_at, Workspace.created_by).order_by(Workspace.id)
+    ):
+        creator = users_by_id.get(created_by)
+        workspaces.append(WorkspaceInfo(workspace_id, name, created_at, created_by,
+                                        creator.username if creator else '',
+                                        tuple(headers.get(workspace_id, ()))))
+
+    logger.debug("Loaded reference data version %s", version)
+    return Snapshot(version, users, users_by_id, {user.id: user.username for user in users},
+                    workspaces, {workspace.id: workspace for workspace in workspaces},
+                    {workspace.id: workspace.name for workspace in workspaces})
+
+
+def snapshot():
+    """The current reference data, reloaded if another write has happened since it was read"""
+    global _snapshot
+    version = current_version()
+    cached = _snapshot
+    if cached is None or cached.version != version:
+        cached = _snapshot = _load(version)
+    return cached
+
+
+def users():
+    """All users, by id"""
+    return snapshot().users
+
+
+def user(user_id):
+    """A user, or None if they do not exist"""
+    return snapshot().users_by_id.get(user_id)
+
+
+def user_names():
+    """dict: user id -> username; do not modify"""
+    return snapshot().user_names
+
+
+def workspaces():
+    """All workspaces, by id"""
+    return snapshot().workspaces
+
+
+def workspace(workspace_id):
+    """A workspace, or None if it does not exist"""
+    return snapshot().workspaces_by_id.get(workspace_id)
+
+
+def workspace_names():
+    """dict: workspace id -> name; do not modify"""
+    return snapshot().workspace_names
+
+
+def workspace_headers(workspace_id):
+    """A workspace's headers in display order; empty if the workspace does not exist"""
+    found = snapshot().workspaces_by_id.get(workspace_id)
+    return list(found.headers) if found else []
+
+
+def header_ids(header_name, workspace_id=None):
+    """Ids of the headers with a name, in one workspace or in all of them"""
+    selected = [workspace(workspace_id)] if workspace_id else workspaces()
+    return [header.id for ws in selected if ws for header in ws.headers if header.header_name == header_name]
+
+
+def header_names(workspace_id=None):
+    """Names of the headers of one workspace, or of every workspace"""
+    selected = [workspace(workspace_id)] if workspace_id else workspaces()
+    return {header.header_name for ws in selected if ws for header in ws.headers}
@@ -0,0 +1,284 @@
+"""
+Result cache for computed reports.
+
+Results are stored under a key that embeds the current value of one or more
+generation counters. Writes never delete entries; they bump the generations
+they affect, after which every older entry is simply never read again and
+ages out through its TTL. A hit therefore costs one generation read plus one
+lookup, and a result can be stale for at most the TTL even if an
+invalidation is lost.
+
+Generations are kept in the result_generations table of the application
+database, whatever the backend, so a bump made by any process (a web worker
+or an import worker) is seen by every other process on its next read. A
+bump is part of the transaction of the write that caused it, made just
+before that transaction commits so the counter rows stay locked only briefly.
+
+The backend holding the results is chosen with RESULT_CACHE_URL:
+
+- memory:// (default): an LRU in each process.
+- sqlite:////path/to/cache.db: a SQLite file shared by all processes on the host.
+- redis://host:port/db: a Redis server (needs the redis package).
+- none://: caching disabled.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_URL = os.environ.get('RESULT_CACHE_URL', 'memory://')
+
+# Seconds a cached result may be served
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 60))
+
+# Maximum entries held by the in-process backend
+MEMORY_CACHE_SIZE = 256
+
+# Above this many generations a key embeds a digest of them instead of each value
+MAX_KEY_GENERATIONS = 4
+
+
+class MemoryCache:
+    """LRU cache with per-entry expiry, local to the process"""
+
+    def __init__(self, maxsize=MEMORY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # key -> (expires at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache:
+    """Cache in a SQLite file, shared by every process on the host
+
+    Values are stored as JSON.
+    """
+
+    # Expired rows are purged on one in this many writes
+    PURGE_EVERY = 100
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        # sqlite3 connections must not cross threads or forked processes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, expires REAL)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value FROM results WHERE key = ? AND expires >= ?', (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl):
+        conn = self._connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO results (key, value, expires) VALUES (?, ?, ?)',
+            (key, json.dumps(value), time.time() + ttl)
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute('DELETE FROM results WHERE expires < ?', (time.time(),))
+
+
+class RedisCache:
+    """Cache in Redis, or in anything that speaks the same get/set calls
+
+    Args:
+        client: A redis.Redis instance or a compatible stand-in
+        prefix: Namespace for every key
+    """
+
+    def __init__(self, client, prefix='result_cache:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(ttl)))
+
+
+class NullCache:
+    """Backend that never stores anything"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+
+def create_cache(url):
+    """Build a cache backend from a RESULT_CACHE_URL value"""
+    scheme, _, rest = url.partition('://')
+    if scheme == 'memory':
+        return MemoryCache()
+    if scheme == 'sqlite':
+        # Same form as SQLAlchemy URLs: sqlite:///relative.db or sqlite:////absolute.db
+        return SQLiteCache(rest[1:] if rest.startswith('/') else rest)
+    if scheme in ('redis', 'rediss'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RESULT_CACHE_URL uses Redis but the redis package is not installed')
+        return RedisCache(redis.Redis.from_url(url))
+    if scheme == 'none':
+        return NullCache()
+    raise ValueError(f"Unsupported RESULT_CACHE_URL: {url}")
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = create_cache(RESULT_CACHE_URL)
+    return _cache
+
+
+def set_cache(cache):
+    """Replace the process-wide backend, e.g. with a RedisCache around a local stand-in"""
+    global _cache
+    _cache = cache
+
+
+def cached(namespace, generations, key_parts, compute, ttl=RESULT_CACHE_TTL):
+    """Return a cached result, computing and storing it on a miss
+
+    Args:
+        namespace: Prefix of the cache key
+        generations: Names of the generation counters the result depends on
+        key_parts: Values that identify the result, e.g. the function's arguments
+        compute: Zero-argument function producing a JSON-serializable result
+        ttl: Seconds the result may be served
+
+    Returns:
+        The cached or freshly computed result. Callers must not modify it.
+    """
+    cache = get_cache()
+    try:
+        versions = [str(version) for version in read_generations(generations)]
+        if len(versions) > MAX_KEY_GENERATIONS:
+            # e.g. one per workspace; the names are part of the digest, as the set can change
+            stamp = ','.join(f'{name}={version}' for name, version in zip(generations, versions))
+            versions = [hashlib.sha1(stamp.encode()).hexdigest()]
+        key = ':'.join([namespace] + versions + [_key_part(part) for part in key_parts])
+        value = cache.get(key)
+    except Exception:
+        logger.exception("Result cache unavailable, computing %s directly", namespace)
+        return compute()
+
+    if value is not None:
+        return value
+
+    value = compute()
+    try:
+        cache.set(key, value, ttl)
+    except Exception:
+        logger.exception("Could not store %s in the result cache", namespace)
+    return value
+
+
+def read_generations(names):
+    """Current values of generation counters, 0 for those never bumped"""
+    from sqlalchemy import select
+    from app import db
+    from models import ResultGeneration
+
+    values = dict(db.session.execute(
+        select(ResultGeneration.name, ResultGeneration.value).where(ResultGeneration.name.in_(names))
+    ).all())
+    return [values.get(name, 0) for name in names]
+
+
+def bump_generations(names, session=None):
+    """Invalidate every cached result that depends on any of the named generations
+
+    The counters are bumped in the session's transaction and take effect when
+    it commits. Call this right before the commit (e.g. from a before_commit
+    listener), as the counter rows stay locked until then.
+
+    Args:
+        names: Generation names
+        session: Session whose transaction to use; the application's by default
+    """
+    from app import db
+    from models import ResultGeneration
+
+    session = session or db.session
+    table = ResultGeneration.__table__
+    # Sorted, so concurrent writers lock the counters in the same order
+    rows = [{'name': name, 'value': 1} for name in sorted(set(names))]
+
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        dialect_insert = None
+
+    if dialect_insert is not None:
+        stmt = dialect_insert(table)
+        session.execute(stmt.on_conflict_do_update(index_elements=['name'], set_={'value': table.c.value + 1}), rows)
+        return
+
+    # Databases without ON CONFLICT: update what exists, insert the rest
+    for row in rows:
+        bumped = session.execute(table.update().where(table.c.name == row['name']).values(value=table.c.value + 1))
+        if not bumped.rowcount:
+            session.execute(table.insert(), [row])
+
+
+def _key_part(value):
+    if value is None:
+        return '-'
+    if isinstance(value, (list, tuple)):
+        return '(' + ','.join(_key_part(item) for item in value) + ')'
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
@@ -1,12 +1,20 @@
 import os
-from flask import Blueprint, render_template, request, redirect, url_for, flash, g, jsonify, Response
+from flask import Blueprint, render_template, request, redirect, url_for, flash, g, jsonify, Response, stream_with_context
 from datetime import datetime, timedelta
 from app import db
-from models import User, Workspace, WorkspaceHeader, Lead, LeadCustomField
+from models import User, Workspace, WorkspaceHeader, Lead, LeadCustomField, ImportJob, AssignmentRule, AssignmentMember
 from auth import admin_required
 from config import DEFAULT_LEAD_FIELDS, LEAD_STATUSES
-from utils import process_csv_upload, export_leads_to_csv, get_lead_stats
-import pandas as pd
+from utils import stream_leads_csv, iter_leads_by_ids, lead_workspace_ids, get_lead_stats, get_lead_stats_windows, keyset_paginate, page_size
+from staging import stage_upload, get_preview, previous_imports, staged_path, is_valid_digest
+from jobs import submit_import_job, job_progress, ensure_worker_pool, forget_job_creator, WORKER_MODE
+from dedupe import DEDUPE_POLICIES, DEDUPE_KEYS
+from lead_query import apply_lead_filters, resolve_fields, query_leads, search_leads, LeadQueryError, ADMIN_DEFAULT_FIELDS
+import lead_ops
+import reference_data
+from assignment import auto_assign, open_lead_counts, STRATEGIES as ASSIGNMENT_STRATEGIES
+from lead_queue import release_user_claims
+from workspace_schema import apply_header_changes
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -19,11 +27,13 @@ def dashboard():
     start_of_week = today - timedelta(days=today.weekday())
     start_of_month = today.replace(day=1)
     
-    # Get stats
-    daily_stats = get_lead_stats(today, today + timedelta(days=1))
-    weekly_stats = get_lead_stats(start_of_week, start_of_week + timedelta(days=7))
-    monthly_stats = get_lead_stats(start_of_month, today + timedelta(days=1))
-    all_time_stats = get_lead_stats()
+    # Get stats for all four windows in one pass
+    daily_stats, weekly_stats, monthly_stats, all_time_stats = get_lead_stats_windows([
+        (today, today + timedelta(days=1)),
+        (start_of_week, start_of_week + timedelta(days=7)),
+        (start_of_month, today + timedelta(days=1)),
+        (None, None),
+    ])
     
     return render_template('admin/dashboard.html', 
                            daily_stats=daily_stats,
@@ -35,7 +45,7 @@ def dashboard():
 @admin_required
 def users():
     """Manage users"""
-    users_list = User.query.all()
+    users_list = reference_data.users()
     return render_template('admin/users.html', users=users_list)
 
 @admin_bp.route('/users/delete/<int:user_id>', methods=['POST'])
@@ -50,6 +60,11 @@ def delete_user(user_id):
         return redirect(url_for('admin.users'))
     
     try:
+        # Deleting a user unassigns their leads, in the same transaction as the delete
+        lead_ids = [lead_id for (lead_id,) in db.session.query(Lead.id).filter_by(assigned_to=user.id)]
+        lead_ops.assign_leads(lead_ids, None, commit=False)
+        release_user_claims(user.id)
+        forget_job_creator(user.id)
         db.session.delete(user)
         db.session.commit()
         flash('User deleted successfully', 'success')
@@ -99,13 +114,13 @@ def edit_user(user_id):
             db.session.rollback()
             flash(f'Error updating user: {str(e)}', 'danger')
     
-    return render_template('admin/users.html', edit_user=user, users=User.query.all())
+    return render_template('admin/users.html', edit_user=user, users=reference_data.users())
 
 @admin_bp.route('/workspaces')
 @admin_required
 def workspaces():
     """Manage workspaces"""
-    workspaces_list = Workspace.query.all()
+    workspaces_list = reference_data.workspaces()
     return render_template('admin/workspaces.html', workspaces=workspaces_list)
 
 @admin_bp.route('/workspaces/create', methods=['GET', 'POST'])
@@ -151,7 +166,7 @@ def create_workspace():
             db.session.rollback()
             flash(f'Error creating workspace: {str(e)}', 'danger')
     
-    return render_template('admin/workspaces.html', workspaces=Workspace.query.all(), creating=True)
+    return render_template('admin/workspaces.html', workspaces=reference_data.workspaces(), creating=True)
 
 @admin_bp.route('/workspaces/edit/<int:workspace_id>', methods=['GET', 'POST'])
 @admin_required
@@ -162,6 +177,9 @@ def edit_workspace(workspace_id):
     if request.method == 'POST':
         name = request.form.get('name')
         headers = request.form.getlist('headers[]')
+        # Ids of the submitted headers, empty for new rows; older forms send none
+        header_ids = [int(value) if value.isdigit() else None for value in request.form.getlist('header_ids[]')]
+        header_ids += [None] * (len(headers) - len(header_ids))
         
         if not name:
             flash('Workspace name is required', 'danger')
@@ -171,24 +189,13 @@ def edit_workspace(workspace_id):
         workspace.name = name
         
         try:
-            # Delete all existing headers (both default and custom)
-            WorkspaceHeader.query.filter_by(workspace_id=workspace.id).delete()
-            
-            # Add all headers (both default and custom)
-            order = 0
-            for header_name in headers:
-                if header_name:  # Make sure header name is not empty
-                    is_default = header_name in DEFAULT_LEAD_FIELDS
-                    header = WorkspaceHeader(
-                        workspace_id=workspace.id,
-                        header_name=header_name,
-                        is_default=is_default,
-                        order=order
-                    )
-                    db.session.add(header)
-                    order += 1
+            # Only changed headers are written; header ids and their values are kept
+            changes = apply_header_changes(workspace.id, list(zip(header_ids, headers)))
             
             db.session.commit()
+            if changes.dropped and WORKER_MODE == 'embedded':
+                # The workers purge the dropped headers' values
+                ensure_worker_pool()
             flash('Workspace updated successfully', 'success')
             return redirect(url_for('admin.workspaces'))
         except Exception as e:
@@ -196,16 +203,17 @@ def edit_workspace(workspace_id):
             flash(f'Error updating workspace: {str(e)}', 'danger')
     
     # Get ALL headers for the workspace, both default and custom
-    all_headers = WorkspaceHeader.query.filter_by(workspace_id=workspace.id).order_by(WorkspaceHeader.order).all()
-    workspace_headers = [h.header_name for h in all_headers]
+    all_headers = reference_data.workspace_headers(workspace.id)
+    workspace_headers = [(h.id, h.header_name) for h in all_headers]
     
     # Add any missing default headers for display purposes
+    header_names = {h.header_name for h in all_headers}
     for default_header in DEFAULT_LEAD_FIELDS:
-        if default_header not in workspace_headers:
-            workspace_headers.append(default_header)
+        if default_header not in header_names:
+            workspace_headers.append(('', default_header))
     
     return render_template('admin/workspaces.html', 
-                          workspaces=Workspace.query.all(), 
+                          workspaces=reference_data.workspaces(), 
                           edit_workspace=workspace,
                           workspace_headers=workspace_headers,
                           default_headers=DEFAULT_LEAD_FIELDS)
@@ -233,6 +241,65 @@ def delete_workspace(workspace_id):
     
     return redirect(url_for('admin.workspaces'))
 
+@admin_bp.route('/workspaces/<int:workspace_id>/assignment', methods=['GET', 'POST'])
+@admin_required
+def workspace_assignment(workspace_id):
+    """Configure and run automatic lead assignment for a workspace"""
+    workspace = Workspace.query.get_or_404(workspace_id)
+    rule = AssignmentRule.query.filter_by(workspace_id=workspace.id).first()
+    users = sorted(reference_data.users(), key=lambda user: user.username)
+    
+    if request.method == 'POST':
+        strategy = request.form.get('strategy')
+        if strategy not in ASSIGNMENT_STRATEGIES:
+            flash('Please select a valid assignment strategy', 'danger')
+            return redirect(url_for('admin.workspace_assignment', workspace_id=workspace.id))
+        
+        try:
+            if rule is None:
+                rule = AssignmentRule(workspace_id=workspace.id)
+                db.session.add(rule)
+            rule.strategy = strategy
+            rule.auto_assign = bool(request.form.get('auto_assign'))
+            
+            # Replace the member list with the ticked users
+            weights = {}
+            for user in users:
+                if request.form.get(f'member_{user.id}'):
+                    weights[user.id] = max(request.form.get(f'weight_{user.id}', 1, type=int), 0)
+            members = {member.user_id: member for member in rule.members}
+            for user_id, member in members.items():
+                if user_id not in weights:
+                    rule.members.remove(member)
+            for user_id, weight in weights.items():
+                if user_id in members:
+                    members[user_id].weight = weight
+                else:
+                    rule.members.append(AssignmentMember(user_id=user_id, weight=weight))
+            db.session.commit()
+            
+            if request.form.get('action') == 'run':
+                assigned = auto_assign(workspace.id)
+                flash(f'Assigned {sum(assigned.values())} leads to {len(assigned)} users', 'success')
+            else:
+                flash('Assignment settings saved', 'success')
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error updating assignment: {str(e)}', 'danger')
+        return redirect(url_for('admin.workspace_assignment', workspace_id=workspace.id))
+    
+    members = {member.user_id: member for member in rule.members} if rule else {}
+    unassigned_count = Lead.query.filter(Lead.workspace_id == workspace.id, Lead.assigned_to.is_(None)).count()
+    
+    return render_template('admin/assignment.html',
+                          workspace=workspace,
+                          rule=rule,
+                          users=users,
+                          members=members,
+                          open_counts=open_lead_counts([user.id for user in users]),
+                          unassigned_count=unassigned_count,
+                          strategies=ASSIGNMENT_STRATEGIES)
+
 @admin_bp.route('/leads')
 @admin_required
 def leads():
@@ -242,56 +309,86 @@ def leads():
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
     assigned_to = request.args.get('assigned_to', type=int)
+    view = request.args.get('view', 'pages')
     
     # Build query
-    query = Lead.query
-    
-    # Apply filters
-    if workspace_id:
-        query = query.filter_by(workspace_id=workspace_id)
-    if status:
-        query = query.filter_by(status=status)
-    if assigned_to:
-        query = query.filter_by(assigned_to=assigned_to)
-    if start_date:
-        try:
-            # Try both MM/DD/YYYY and YYYY-MM-DD formats
-            try:
-                start_date_obj = datetime.strptime(start_date, '%m/%d/%Y')
-            except ValueError:
-                start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
-            query = query.filter(Lead.created_at >= start_date_obj)
-        except ValueError:
-            pass
-    if end_date:
-        try:
-            # Try both MM/DD/YYYY and YYYY-MM-DD formats
-            try:
-                end_date_obj = datetime.strptime(end_date, '%m/%d/%Y')
-            except ValueError:
-                end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
-            end_date_obj = end_date_obj.replace(hour=23, minute=59, second=59)
-            query = query.filter(Lead.created_at <= end_date_obj)
-        except ValueError:
-            pass
+    query = apply_lead_filters(Lead.query, request.args)
     
-    # Get leads
-    leads_list = query.order_by(Lead.created_at.desc()).all()
+    # Get one page of leads; the scrolling view loads its rows from the lead API instead
+    page = None
+    if view != 'scroll':
+        per_page = page_size(request.args.get('per_page', type=int))
+        page = keyset_paginate(query, request.args.get('after'), request.args.get('before'), per_page)
+    page_args = {key: value for key, value in request.args.items() if key not in ('after', 'before', 'view')}
+    bulk_filters = {key: value for key, value in page_args.items() if key != 'per_page' and value}
     
-    # Get workspaces and users for filters
-    workspaces = Workspace.query.all()
-    users = User.query.all()
+    # Get workspaces and users for filters, plus id -> name maps for the rows
+    workspaces = reference_data.workspaces()
+    users = reference_data.users()
     
     return render_template('admin/leads.html', 
-                          leads=leads_list,
+                          leads=page.items if page else [],
+                          page=page,
+                          page_args=page_args,
+                          bulk_filters=bulk_filters,
+                          view=view,
                           workspaces=workspaces,
                           users=users,
+                          workspace_names=reference_data.workspace_names(),
+                          user_names=reference_data.user_names(),
                           statuses=LEAD_STATUSES,
                           selected_workspace=workspace_id,
                           selected_status=status,
                           selected_start_date=start_date,
                           selected_end_date=end_date,
-                          selected_assigned_to=assigned_to)
+                          selected_assigned_to=assigned_to,
+                          selected_search=request.args.get('q'))
+
+@admin_bp.route('/api/leads')
+@admin_required
+def api_leads():
+    """Query leads as compact JSON
+    
+    Accepts the lead list filters plus fields (comma-separated, including custom
+    headers), sort, order (asc/desc), limit and after (the previous page's 'next').
+    """
+    try:
+        fields = resolve_fields(request.args.get('fields'), ADMIN_DEFAULT_FIELDS,
+                                request.args.get('workspace_id', type=int))
+        result = query_leads(
+            apply_lead_filters(Lead.query, request.args),
+            fields,
+            sort=request.args.get('sort', 'created_at'),
+            order=request.args.get('order', 'desc'),
+            after=request.args.get('after'),
+            limit=request.args.get('limit', type=int)
+        )
+    except LeadQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+@admin_bp.route('/api/leads/search')
+@admin_required
+def search_leads_api():
+    """Search leads by name, contact details or custom field values
+    
+    Accepts q (the search text), the lead list filters, fields and limit; returns
+    the best matches first.
+    """
+    filters = request.args.copy()
+    text = filters.pop('q', None)
+    try:
+        fields = resolve_fields(request.args.get('fields'), ADMIN_DEFAULT_FIELDS,
+                                request.args.get('workspace_id', type=int))
+        result = search_leads(
+            apply_lead_filters(Lead.query, filters),
+            text,
+            fields,
+            limit=request.args.get('limit', type=int)
+        )
+    except LeadQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
 
 @admin_bp.route('/leads/upload', methods=['GET', 'POST'])
 @admin_required
@@ -309,11 +406,14 @@ def upload_leads():
             # Get workspace
             workspace = Workspace.query.get_or_404(workspace_id)
             
+            upload_id = request.form.get('upload_id')
+            if not is_valid_digest(upload_id) or not os.path.exists(staged_path(upload_id)):
+                flash('The uploaded file has expired. Please upload it again.', 'danger')
+                return redirect(url_for('admin.leads'))
+            
             try:
-                # Process the mapping and import
-                temp_file_path = '/tmp/temp_csv_file.csv'
-                csv_data = pd.read_csv(temp_file_path)
-                csv_headers = csv_data.columns.tolist()
+                # Headers come from the staged preview, the CSV itself isn't read again
+                csv_headers = get_preview(upload_id)['headers']
                 
                 # Get header mapping
                 header_mapping = {}
@@ -322,17 +422,18 @@ def upload_leads():
                     if db_header and db_header != 'ignore':
                         header_mapping[csv_header] = db_header
                 
-                # Process CSV using the temp file
-                success_count, error_count, errors = process_csv_upload(temp_file_path, workspace_id, header_mapping)
-                
-                if success_count > 0:
-                    flash(f'Successfully imported {success_count} leads. {error_count} errors.', 'success')
-                else:
-                    flash(f'Failed to import leads. {len(errors)} errors.', 'danger')
-                    for error in errors:
-                        flash(error, 'warning')
+                # Duplicate handling chosen on the mapping form
+                dedupe_policy = request.form.get('dedupe_policy', 'none')
+                dedupe_on = request.form.get('dedupe_on', 'email_or_phone')
+                if dedupe_policy not in DEDUPE_POLICIES or dedupe_on not in DEDUPE_KEYS:
+                    flash('Invalid duplicate handling option', 'danger')
+                    return redirect(url_for('admin.leads'))
                 
-                return redirect(url_for('admin.leads', workspace_id=workspace_id))
+                # Run the import in the background worker pool
+                job = submit_import_job(workspace_id, staged_path(upload_id), header_mapping, created_by=g.user_id,
+                                        dedupe_policy=dedupe_policy, dedupe_on=dedupe_on)
+                flash(f'Import of leads into {workspace.name} has been queued.', 'info')
+                return redirect(url_for('admin.import_job', job_id=job.id))
                 
             except Exception as e:
                 import traceback
@@ -362,14 +463,20 @@ def upload_leads():
         
         # Process file headers
         try:
-            # Make a copy of the file data to avoid reading it twice
-            temp_file_path = '/tmp/temp_csv_file.csv'
-            file.save(temp_file_path)  # Save to temp file
-            csv_data = pd.read_csv(temp_file_path)
-            csv_headers = csv_data.columns.tolist()
+            # Stage the upload under its content hash; a re-upload reuses the staged file
+            staged = stage_upload(file)
+            preview = get_preview(staged.digest)
+            csv_headers = preview['headers']
+            csv_samples = preview['samples']
+            
+            if not staged.is_new:
+                earlier = [job for job in previous_imports(staged.digest) if job.status != 'failed']
+                if earlier:
+                    flash(f'This file was already imported on {earlier[0].created_at.strftime("%m/%d/%Y %H:%M")} '
+                          f'into {earlier[0].workspace.name}.', 'warning')
             
             # Render header mapping form - include all headers, both default and custom
-            all_headers = WorkspaceHeader.query.filter_by(workspace_id=workspace_id).order_by(WorkspaceHeader.order).all()
+            all_headers = reference_data.workspace_headers(workspace_id)
             db_headers = [h.header_name for h in all_headers]
             default_headers = [h.header_name for h in all_headers if h.is_default]
             custom_headers = [h.header_name for h in all_headers if not h.is_default]
@@ -380,10 +487,14 @@ def upload_leads():
             
             return render_template('admin/leads.html', 
                                   csv_headers=csv_headers,
+                                  csv_samples=csv_samples,
                                   db_headers=db_headers,
                                   default_headers=default_headers,
                                   custom_headers=custom_headers,
                                   workspace=workspace,
+                                  upload_id=staged.digest,
+                                  dedupe_policies=DEDUPE_POLICIES,
+                                  dedupe_keys=DEDUPE_KEYS,
                                   mapping=True)
         
         except Exception as e:
@@ -394,47 +505,88 @@ def upload_leads():
             return redirect(url_for('admin.leads'))
     
     # GET request - show upload form
-    workspaces = Workspace.query.all()
+    workspaces = reference_data.workspaces()
     return render_template('admin/leads.html', 
                           workspaces=workspaces,
                           upload=True)
 
+@admin_bp.route('/leads/imports/<int:job_id>')
+@admin_required
+def import_job(job_id):
+    """Show the progress of a background import"""
+    job = ImportJob.query.get_or_404(job_id)
+    return render_template('admin/import_job.html', job=job, progress=job_progress(job))
+
+@admin_bp.route('/leads/imports/<int:job_id>/status')
+@admin_required
+def import_job_status(job_id):
+    """Report the progress of a background import as JSON"""
+    job = ImportJob.query.get_or_404(job_id)
+    return jsonify(job_progress(job))
+
+def bulk_selection():
+    """Lead ids a bulk action applies to: the ticked leads, or with select=filter
+    every lead matching the filter fields posted with the form"""
+    if request.form.get('select') == 'filter':
+        return lead_ops.select_lead_ids(filter_args=request.form)
+    return lead_ops.select_lead_ids(request.form.getlist('lead_ids[]'))
+
 @admin_bp.route('/leads/assign', methods=['POST'])
 @admin_required
 def assign_leads():
     """Assign leads to users"""
-    lead_ids = request.form.getlist('lead_ids[]')
     user_id = request.form.get('user_id', type=int)
     
-    if not lead_ids or user_id is None:
+    if user_id is None:
         flash('Please select leads and a user to assign them to', 'danger')
         return redirect(url_for('admin.leads'))
     
     # Check if user exists
-    if user_id > 0 and not User.query.get(user_id):
+    user = User.query.get(user_id) if user_id > 0 else None
+    if user_id > 0 and not user:
         flash('Selected user does not exist', 'danger')
         return redirect(url_for('admin.leads'))
     
+    lead_ids = bulk_selection()
+    if not lead_ids:
+        flash('Please select leads and a user to assign them to', 'danger')
+        return redirect(url_for('admin.leads'))
+    
     try:
-        # Update lead assignments
-        for lead_id in lead_ids:
-            lead = Lead.query.get(lead_id)
-            if lead:
-                lead.assigned_to = user_id if user_id > 0 else None
+        updated_count = lead_ops.assign_leads(lead_ids, user.id if user else None)
         
-        db.session.commit()
-        
-        if user_id > 0:
-            user = User.query.get(user_id)
-            flash(f'Successfully assigned {len(lead_ids)} leads to {user.username}', 'success')
+        if user:
+            flash(f'Successfully assigned {updated_count} leads to {user.username}', 'success')
         else:
-            flash(f'Successfully unassigned {len(lead_ids)} leads', 'success')
+            flash(f'Successfully unassigned {updated_count} leads', 'success')
     except Exception as e:
-        db.session.rollback()
         flash(f'Error assigning leads: {str(e)}', 'danger')
     
     return redirect(url_for('admin.leads'))
 
+@admin_bp.route('/leads/status', methods=['POST'])
+@admin_required
+def set_leads_status():
+    """Change the status of leads"""
+    status = request.form.get('new_status')
+    
+    if status not in LEAD_STATUSES:
+        flash('Please select a valid status', 'danger')
+        return redirect(url_for('admin.leads'))
+    
+    lead_ids = bulk_selection()
+    if not lead_ids:
+        flash('Please select leads to update', 'danger')
+        return redirect(url_for('admin.leads'))
+    
+    try:
+        updated_count = lead_ops.set_lead_status(lead_ids, status)
+        flash(f'Successfully set {updated_count} leads to {status}', 'success')
+    except Exception as e:
+        flash(f'Error updating leads: {str(e)}', 'danger')
+    
+    return redirect(url_for('admin.leads'))
+
 @admin_bp.route('/leads/export', methods=['POST'])
 @admin_required
 def export_leads():
@@ -446,35 +598,27 @@ def export_leads():
         return redirect(url_for('admin.leads'))
     
     try:
-        # Get leads
-        leads = Lead.query.filter(Lead.id.in_(lead_ids)).all()
+        # Only the workspace ids are loaded here; the leads themselves are streamed
+        workspace_ids = lead_workspace_ids(lead_ids)
         
-        if not leads:
+        if not workspace_ids:
             flash('No leads found to export', 'danger')
             return redirect(url_for('admin.leads'))
         
-        # Group leads by workspace
-        workspace_leads = {}
-        for lead in leads:
-            if lead.workspace_id not in workspace_leads:
-                workspace_leads[lead.workspace_id] = []
-            
-            workspace_leads[lead.workspace_id].append(lead)
-        
         # If leads from multiple workspaces, export separately
-        if len(workspace_leads) > 1:
+        if len(workspace_ids) > 1:
             flash('Leads from multiple workspaces must be exported separately', 'danger')
             return redirect(url_for('admin.leads'))
         
         # Export CSV
-        workspace_id = list(workspace_leads.keys())[0]
-        csv_data = export_leads_to_csv(leads, workspace_id)
-        
-        workspace = Workspace.query.get(workspace_id)
+        workspace_id = workspace_ids.pop()
+        workspace = reference_data.workspace(workspace_id)
         filename = f"{workspace.name}_leads_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         
+        # Stream the CSV as it is generated instead of building it in memory
+        leads = iter_leads_by_ids(lead_ids)
         return Response(
-            csv_data.getvalue(),
+            stream_with_context(stream_leads_csv(leads, workspace_id)),
             mimetype='text/csv',
             headers={"Content-Disposition": f"attachment;filename={filename}"}
         )
@@ -486,25 +630,16 @@ def export_leads():
 @admin_required
 def delete_leads():
     """Delete leads"""
-    lead_ids = request.form.getlist('lead_ids[]')
+    lead_ids = bulk_selection()
     
     if not lead_ids:
         flash('Please select leads to delete', 'danger')
         return redirect(url_for('admin.leads'))
     
     try:
-        # Delete leads
-        deleted_count = 0
-        for lead_id in lead_ids:
-            lead = Lead.query.get(lead_id)
-            if lead:
-                db.session.delete(lead)
-                deleted_count += 1
-        
-        db.session.commit()
+        deleted_count = lead_ops.delete_leads(lead_ids)
         flash(f'Successfully deleted {deleted_count} leads', 'success')
     except Exception as e:
-        db.session.rollback()
         flash(f'Error deleting leads: {str(e)}', 'danger')
     
     return redirect(url_for('admin.leads'))
@@ -545,7 +680,7 @@ def reports():
     stats = get_lead_stats(start_date_obj, end_date_obj, workspace_id)
     
     # Get workspaces for filter
-    workspaces = Workspace.query.all()
+    workspaces = reference_data.workspaces()
     
     return render_template('admin/reports.html',
                           stats=stats,
@@ -1,7 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, g
 from app import db
 from models import User
-from auth import generate_token, decode_token, login_required
+from auth import generate_token, authenticate, login_required
 from werkzeug.security import generate_password_hash
 
 auth_bp = Blueprint('auth', __name__)
@@ -9,24 +9,16 @@ auth_bp = Blueprint('auth', __name__)
 @auth_bp.before_request
 def load_user():
     if session.get('token'):
-        payload = decode_token(session['token'])
-        if 'error' not in payload:
-            g.user_id = payload['user_id']
-            g.role = payload['role']
-            # Get the username for the logged-in user
-            user = User.query.get(payload['user_id'])
-            if user:
-                g.username = user.username
+        authenticate(session['token'])
 
 @auth_bp.route('/')
 def index():
     """Redirect to login page or dashboard based on login status"""
     if session.get('token'):
         # Check token validity
-        payload = decode_token(session['token'])
-        if 'error' not in payload:
+        if authenticate(session['token']):
             # Valid token, redirect based on role
-            if payload['role'] == 'admin':
+            if g.role == 'admin':
                 return redirect(url_for('admin.dashboard'))
             else:
                 return redirect(url_for('user.leads'))
@@ -0,0 +1,13 @@
+"""
+Health check for the load balancer and the platform.
+Answers without reading the session or touching the database, so it stays
+cheap however often it is polled and keeps answering while a worker is busy.
+"""
+from flask import Blueprint
+
+health_bp = Blueprint('health', __name__)
+
+@health_bp.route('/healthz')
+def healthz():
+    """Report that the worker is up"""
+    return 'ok', 200, {'Content-Type': 'text/plain', 'Cache-Control': 'no-store'}
@@ -5,7 +5,7 @@ Only use this route for initial setup when shell access is not available.
 from flask import Blueprint, jsonify, request, render_template, flash, redirect, url_for
 import os
 import secrets
-from app import db
+from app import db, init_db
 from models import User, Workspace, WorkspaceHeader
 
 # Create blueprint
@@ -30,6 +30,9 @@ def setup():
     if not request_key or request_key != setup_key:
         return render_template('setup/access.html')
     
+    # Hosts without a shell or release step get their tables here
+    init_db()
+    
     # Check if setup is already done
     admin_exists = User.query.filter_by(role='admin').first() is not None
     workspace_exists = Workspace.query.first() is not None
@@ -123,6 +126,8 @@ def create_admin():
     if not request_key or request_key != setup_key:
         return jsonify({"error": "Unauthorized. Invalid or missing setup key."}), 401
     
+    init_db()
+    
     try:
         # Generate a secure password
         password = request.args.get('password', secrets.token_urlsafe(12))
@@ -1,9 +1,13 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, g, Response
+from flask import Blueprint, render_template, request, redirect, url_for, flash, g, jsonify, Response, stream_with_context
 from datetime import datetime
 from app import db
 from models import Lead, User, Workspace, WorkspaceHeader
 from auth import login_required
-from utils import export_leads_to_csv
+from utils import stream_leads_csv, iter_leads_by_ids, lead_workspace_ids, keyset_paginate, page_size
+from lead_query import apply_lead_filters, resolve_fields, query_leads, search_leads, LeadQueryError, LeadQueryPlan, USER_DEFAULT_FIELDS
+from lead_queue import claim_leads, active_claims, complete_claim, release_claim, queue_workspace_ids, LEASE_SECONDS
+from config import LEAD_STATUSES
+import reference_data
 
 user_bp = Blueprint('user', __name__, url_prefix='/user')
 
@@ -16,31 +20,70 @@ def leads():
     
     # Get filter values
     date_filter = request.args.get('date')
+    view = request.args.get('view', 'pages')
     
     # Build query
-    query = Lead.query.filter_by(assigned_to=user_id)
+    query = apply_lead_filters(Lead.query.filter_by(assigned_to=user_id), request.args)
     
-    # Apply date filter if provided
-    if date_filter:
-        try:
-            # Try both MM/DD/YYYY and YYYY-MM-DD formats
-            try:
-                date_obj = datetime.strptime(date_filter, '%m/%d/%Y')
-            except ValueError:
-                date_obj = datetime.strptime(date_filter, '%Y-%m-%d')
-            # Filter for a single day
-            next_day = date_obj.replace(hour=23, minute=59, second=59)
-            query = query.filter(Lead.created_at >= date_obj, Lead.created_at <= next_day)
-        except ValueError:
-            pass
-    
-    # Get leads
-    leads_list = query.order_by(Lead.created_at.desc()).all()
+    # Get one page of leads; the scrolling view loads its rows from the lead API instead
+    page = None
+    if view != 'scroll':
+        per_page = page_size(request.args.get('per_page', type=int))
+        page = keyset_paginate(query, request.args.get('after'), request.args.get('before'), per_page)
+    page_args = {key: value for key, value in request.args.items() if key not in ('after', 'before', 'view')}
     
     # No need to pass workspaces to the template since we removed the workspace column
     return render_template('user/leads.html', 
-                          leads=leads_list,
-                          selected_date=date_filter)
+                          leads=page.items if page else [],
+                          page=page,
+                          page_args=page_args,
+                          view=view,
+                          selected_date=date_filter,
+                          selected_search=request.args.get('q'))
+
+@user_bp.route('/api/leads')
+@login_required
+def api_leads():
+    """Query the user's assigned leads as compact JSON
+    
+    Accepts the same arguments as admin.api_leads.
+    """
+    try:
+        fields = resolve_fields(request.args.get('fields'), USER_DEFAULT_FIELDS,
+                                request.args.get('workspace_id', type=int))
+        result = query_leads(
+            apply_lead_filters(Lead.query.filter_by(assigned_to=g.user_id), request.args),
+            fields,
+            sort=request.args.get('sort', 'created_at'),
+            order=request.args.get('order', 'desc'),
+            after=request.args.get('after'),
+            limit=request.args.get('limit', type=int)
+        )
+    except LeadQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+@user_bp.route('/api/leads/search')
+@login_required
+def search_leads_api():
+    """Search the user's assigned leads, best matches first
+    
+    Accepts the same arguments as admin.search_leads_api.
+    """
+    filters = request.args.copy()
+    text = filters.pop('q', None)
+    try:
+        fields = resolve_fields(request.args.get('fields'), USER_DEFAULT_FIELDS,
+                                request.args.get('workspace_id', type=int))
+        result = search_leads(
+            apply_lead_filters(Lead.query.filter_by(assigned_to=g.user_id), filters),
+            text,
+            fields,
+            limit=request.args.get('limit', type=int)
+        )
+    except LeadQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
 
 @user_bp.route('/leads/export', methods=['POST'])
 @login_required
@@ -54,38 +97,100 @@ def export_leads():
         return redirect(url_for('user.leads'))
     
     try:
-        # Get leads that belong to this user
-        leads = Lead.query.filter(Lead.id.in_(lead_ids), Lead.assigned_to == user_id).all()
+        # Only the workspace ids are loaded here; the leads themselves are streamed
+        workspace_ids = lead_workspace_ids(lead_ids, Lead.assigned_to == user_id)
         
-        if not leads:
+        if not workspace_ids:
             flash('No leads found to export', 'danger')
             return redirect(url_for('user.leads'))
         
-        # Group leads by workspace
-        workspace_leads = {}
-        for lead in leads:
-            if lead.workspace_id not in workspace_leads:
-                workspace_leads[lead.workspace_id] = []
-            
-            workspace_leads[lead.workspace_id].append(lead)
-        
         # If leads from multiple workspaces, export separately
-        if len(workspace_leads) > 1:
+        if len(workspace_ids) > 1:
             flash('Leads from multiple workspaces must be exported separately', 'danger')
             return redirect(url_for('user.leads'))
         
         # Export CSV
-        workspace_id = list(workspace_leads.keys())[0]
-        csv_data = export_leads_to_csv(leads, workspace_id)
-        
-        workspace = Workspace.query.get(workspace_id)
+        workspace_id = workspace_ids.pop()
+        workspace = reference_data.workspace(workspace_id)
         filename = f"{workspace.name}_leads_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         
+        # Stream the CSV as it is generated instead of building it in memory
+        leads = iter_leads_by_ids(lead_ids, Lead.assigned_to == user_id)
         return Response(
-            csv_data.getvalue(),
+            stream_with_context(stream_leads_csv(leads, workspace_id)),
             mimetype='text/csv',
             headers={"Content-Disposition": f"attachment;filename={filename}"}
         )
     except Exception as e:
         flash(f'Error exporting leads: {str(e)}', 'danger')
         return redirect(url_for('user.leads'))
+
+def queue_response(message, category, status_code=200, leads=None):
+    """Answer a work queue action: JSON for API clients, otherwise flash and go back to the queue"""
+    if request.is_json:
+        body = {'message': message}
+        if leads is not None:
+            body['fields'] = USER_DEFAULT_FIELDS + ['lease_expires_at']
+            body['rows'] = [
+                row + [lead.lease_expires_at.isoformat()]
+                for row, lead in zip(LeadQueryPlan(USER_DEFAULT_FIELDS).rows(leads), leads)
+            ]
+        return jsonify(body), status_code
+    flash(message, category)
+    return redirect(url_for('user.queue'))
+
+@user_bp.route('/queue')
+@login_required
+def queue():
+    """Work queue: claim the next unassigned leads of a workspace"""
+    workspace_ids = queue_workspace_ids(g.user_id)
+    workspaces = sorted((workspace for workspace in map(reference_data.workspace, workspace_ids) if workspace),
+                        key=lambda workspace: workspace.name)
+    return render_template('user/queue.html',
+                          workspaces=workspaces,
+                          claims=active_claims(g.user_id),
+                          statuses=LEAD_STATUSES,
+                          lease_minutes=LEASE_SECONDS // 60)
+
+@user_bp.route('/queue/claim', methods=['POST'])
+@login_required
+def claim():
+    """Lease the next lead (or count leads) of a workspace to the current user
+    
+    Accepts form fields or a JSON body with workspace_id and count.
+    """
+    data = request.get_json(silent=True) or request.form
+    try:
+        workspace_id = int(data.get('workspace_id'))
+        count = int(data.get('count') or 1)
+    except (TypeError, ValueError):
+        return queue_response('Please select a workspace', 'danger', 400)
+    
+    if workspace_id not in queue_workspace_ids(g.user_id):
+        return queue_response('You are not eligible for leads from this workspace', 'danger', 403)
+    
+    leads = claim_leads(workspace_id, g.user_id, count)
+    if not leads:
+        return queue_response('No unassigned leads are waiting in this workspace', 'info', leads=[])
+    return queue_response(f'Claimed {len(leads)} leads', 'success', leads=leads)
+
+@user_bp.route('/queue/<int:lead_id>/complete', methods=['POST'])
+@login_required
+def complete(lead_id):
+    """Keep a claimed lead: assign it to the current user, optionally with a new status"""
+    data = request.get_json(silent=True) or request.form
+    status = data.get('status') or None
+    if status is not None and status not in LEAD_STATUSES:
+        return queue_response('Please select a valid status', 'danger', 400)
+    
+    if not complete_claim(lead_id, g.user_id, status):
+        return queue_response('Your claim on this lead has expired', 'warning', 409)
+    return queue_response('Lead added to My Leads', 'success')
+
+@user_bp.route('/queue/<int:lead_id>/release', methods=['POST'])
+@login_required
+def release(lead_id):
+    """Return a claimed lead to the queue"""
+    if not release_claim(lead_id, g.user_id):
+        return queue_response('You do not hold a claim on this lead', 'warning', 409)
+    return queue_response('Lead returned to the queue', 'success')
@@ -0,0 +1,204 @@
+"""
+Staging store for uploaded CSV files.
+
+Each upload is streamed to disk while it is hashed and stored under its
+SHA-256 digest, so concurrent uploads never share a file and re-uploading the
+same file reuses what is already staged. The header row and sample rows are
+parsed once per file and kept next to it as JSON; the header mapping step
+reads that instead of touching the CSV again. A janitor removes staged files
+that are older than the TTL and not referenced by a pending import job.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from collections import OrderedDict
+
+from app import db
+from models import ImportJob
+
+logger = logging.getLogger(__name__)
+
+STAGING_DIR = os.environ.get('UPLOAD_STAGING_DIR', os.path.join(tempfile.gettempdir(), 'lead_uploads'))
+
+# Staged files untouched for longer than this are removed by the janitor
+STAGING_TTL = int(os.environ.get('UPLOAD_STAGING_TTL', 24 * 60 * 60))
+
+# Minimum seconds between janitor runs in one process
+JANITOR_INTERVAL = 10 * 60
+
+# Number of sample values shown per column on the mapping form
+SAMPLE_VALUES = 3
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+_PREVIEW_CACHE_SIZE = 64
+_preview_cache = OrderedDict()
+_last_janitor_run = 0.0
+
+
+class StagedUpload:
+    """An uploaded CSV file stored under its content hash"""
+
+    def __init__(self, digest, is_new):
+        self.digest = digest
+        self.is_new = is_new  # False when the same content had already been staged
+
+    @property
+    def path(self):
+        return staged_path(self.digest)
+
+
+def is_valid_digest(digest):
+    return bool(digest) and bool(_DIGEST_RE.match(digest))
+
+
+def staged_path(digest):
+    """Path of the staged CSV for a digest"""
+    if not is_valid_digest(digest):
+        raise ValueError('Invalid upload id')
+    return os.path.join(STAGING_DIR, f'{digest}.csv')
+
+
+def _preview_path(digest):
+    return os.path.join(STAGING_DIR, f'{digest}.json')
+
+
+def stage_upload(file):
+    """Stream an uploaded file into the staging store
+
+    Args:
+        file: A werkzeug FileStorage or any binary file object
+
+    Returns:
+        StagedUpload
+    """
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    purge_expired()
+
+    stream = getattr(file, 'stream', file)
+    sha = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(dir=STAGING_DIR, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                block = stream.read(1024 * 1024)
+                if not block:
+                    break
+                sha.update(block)
+                out.write(block)
+
+        digest = sha.hexdigest()
+        path = staged_path(digest)
+        if os.path.exists(path):
+            # Same content was staged before: keep the existing file and refresh its TTL
+            os.remove(temp_path)
+            os.utime(path)
+            return StagedUpload(digest, is_new=False)
+
+        os.replace(temp_path, path)
+        return StagedUpload(digest, is_new=True)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def get_preview(digest):
+    """Return the cached header/sample preview of a staged file, parsing it at most once
+
+    Returns:
+        dict with 'headers', 'samples' (header -> sample values), 'delimiter' and 'encoding'
+    """
+    if digest in _preview_cache:
+        _preview_cache.move_to_end(digest)
+        return _preview_cache[digest]
+
+    path = staged_path(digest)
+    preview_path = _preview_path(digest)
+    try:
+        with open(preview_path) as f:
+            preview = json.load(f)
+    except (OSError, ValueError):
+        from csv_stream import read_csv_header, sniff_csv  # Loads pandas
+
+        csv_format = sniff_csv(path)
+        headers, sample = read_csv_header(path, csv_format=csv_format)
+        preview = {
+            'headers': headers,
+            'samples': {
+                header: [value for value in sample[header].tolist() if isinstance(value, str)][:SAMPLE_VALUES]
+                for header in headers
+            },
+            'delimiter': csv_format.delimiter,
+            'encoding': csv_format.encoding,
+        }
+        fd, temp_path = tempfile.mkstemp(dir=STAGING_DIR, suffix='.part')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(preview, f)
+        os.replace(temp_path, preview_path)
+
+    _preview_cache[digest] = preview
+    if len(_preview_cache) > _PREVIEW_CACHE_SIZE:
+        _preview_cache.popitem(last=False)
+    return preview
+
+
+def previous_imports(digest):
+    """Import jobs that already used this staged file, newest first"""
+    return ImportJob.query.filter_by(file_path=staged_path(digest)).order_by(ImportJob.id.desc()).all()
+
+
+def purge_expired(ttl=STAGING_TTL, force=False):
+    """Remove staged files older than ttl that no pending import job still needs
+
+    Returns:
+        Number of files removed
+    """
+    global _last_janitor_run
+    now = time.time()
+    if not force and now - _last_janitor_run < JANITOR_INTERVAL:
+        return 0
+    _last_janitor_run = now
+
+    if not os.path.isdir(STAGING_DIR):
+        return 0
+
+    in_use = {
+        path for (path,) in db.session.query(ImportJob.file_path)
+        .filter(ImportJob.status.in_(['queued', 'running']))
+    }
+
+    removed = 0
+    for name in os.listdir(STAGING_DIR):
+        path = os.path.join(STAGING_DIR, name)
+        digest = name.split('.', 1)[0]
+        try:
+            if now - os.path.getmtime(path) < ttl:
+                continue
+            if is_valid_digest(digest) and staged_path(digest) in in_use:
+                continue
+            os.remove(path)
+            _preview_cache.pop(digest, None)
+            removed += 1
+        except OSError:
+            # Another worker may have removed it first
+            continue
+
+    if removed:
+        logger.info("Removed %s expired staged upload files", removed)
+    return removed
+
+
+if __name__ == '__main__':
+    import argparse
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description='Remove expired staged CSV uploads.')
+    parser.add_argument('--ttl', type=int, default=STAGING_TTL, help='Maximum age in seconds')
+    args = parser.parse_args()
+
+    with create_app().app_context():
+        print(f"Removed {purge_expired(args.ttl, force=True)} files from {STAGING_DIR}")
@@ -1,2 +1,201 @@
-// This file is intentionally left empty because all leads functionality is implemented
-// directly in the admin/leads.html and user/leads.html templates with inline JavaScript.
+// Virtualized lead grid backed by the lead JSON API (/admin/api/leads and /user/api/leads).
+//
+// Rows are fetched a page at a time with the API's cursor as the user scrolls, and
+// only the rows inside the viewport (plus a small overscan) exist in the DOM, so the
+// grid stays fast however many leads the filters match.
+
+class LeadGrid {
+    constructor(container, options) {
+        this.container = container;
+        this.url = options.url;
+        this.params = options.params || {};  // Lead list filters passed to the API
+        this.columns = options.columns;  // [{field, label, render(value, row, indexes), sortable}]
+        this.extraFields = options.extraFields || [];  // Fetched for render functions but not shown
+        this.rowHeight = options.rowHeight || 41;
+        this.height = options.height || 600;
+        this.pageSize = options.pageSize || 200;
+        this.overscan = options.overscan || 10;
+        this.onSelectionChange = options.onSelectionChange || function() {};
+        this.sort = options.sort || { field: 'created_at', order: 'desc' };
+
+        this.selected = new Set();
+        this.build();
+        this.reset();
+    }
+
+    build() {
+        this.container.innerHTML = `
+            <table class="table table-striped mb-0 lead-grid-head">
+                <thead><tr>
+                    <th style="width: 40px;"><input type="checkbox" class="lead-grid-select-all"></th>
+                    ${this.columns.map(column => column.sortable === false
+                        ? `<th>${column.label}</th>`
+                        : `<th data-field="${column.field}" role="button">${column.label}</th>`).join('')}
+                </tr></thead>
+            </table>
+            <div class="lead-grid-viewport" style="height: ${this.height}px; overflow-y: auto; position: relative;">
+                <div class="lead-grid-spacer"></div>
+                <table class="table table-striped mb-0 lead-grid-body" style="position: absolute; top: 0; left: 0; width: 100%;">
+                    <tbody></tbody>
+                </table>
+            </div>
+            <div class="text-muted mt-2 lead-grid-status"></div>`;
+
+        this.viewport = this.container.querySelector('.lead-grid-viewport');
+        this.spacer = this.container.querySelector('.lead-grid-spacer');
+        this.body = this.container.querySelector('.lead-grid-body');
+        this.tbody = this.body.querySelector('tbody');
+        this.status = this.container.querySelector('.lead-grid-status');
+        this.selectAll = this.container.querySelector('.lead-grid-select-all');
+
+        this.viewport.addEventListener('scroll', () => this.onScroll());
+
+        this.container.querySelectorAll('th[data-field]').forEach(th => {
+            th.addEventListener('click', () => {
+                const field = th.dataset.field;
+                const order = this.sort.field === field && this.sort.order === 'desc' ? 'asc' : 'desc';
+                this.sort = { field, order };
+                this.reset();
+            });
+        });
+
+        this.selectAll.addEventListener('change', () => {
+            // Selects every loaded row
+            this.rows.forEach(row => {
+                if (this.selectAll.checked) {
+                    this.selected.add(row[this.idIndex]);
+                } else {
+                    this.selected.delete(row[this.idIndex]);
+                }
+            });
+            this.render();
+            this.onSelectionChange(this.selected.size);
+        });
+
+        this.tbody.addEventListener('change', event => {
+            if (!event.target.classList.contains('lead-grid-checkbox')) {
+                return;
+            }
+            const id = Number(event.target.dataset.id);
+            if (event.target.checked) {
+                this.selected.add(id);
+            } else {
+                this.selected.delete(id);
+            }
+            this.onSelectionChange(this.selected.size);
+        });
+    }
+
+    reset() {
+        this.rows = [];
+        this.next = null;
+        this.done = false;
+        this.generation = (this.generation || 0) + 1;
+        this.viewport.scrollTop = 0;
+        this.container.querySelectorAll('th[data-field]').forEach(th => {
+            const arrow = th.dataset.field === this.sort.field ? (this.sort.order === 'desc' ? ' ▾' : ' ▴') : '';
+            th.textContent = this.columns.find(column => column.field === th.dataset.field).label + arrow;
+        });
+        this.render();
+        this.loadMore();
+    }
+
+    loadMore() {
+        if (this.loading || this.done) {
+            return;
+        }
+        this.loading = true;
+        const generation = this.generation;
+        const params = new URLSearchParams(this.params);
+        const fields = new Set(this.columns.map(column => column.field).concat(this.extraFields, ['id']));
+        params.set('fields', Array.from(fields).join(','));
+        params.set('sort', this.sort.field);
+        params.set('order', this.sort.order);
+        params.set('limit', this.pageSize);
+        if (this.next) {
+            params.set('after', this.next);
+        }
+        this.status.textContent = 'Loading...';
+
+        fetch(`${this.url}?${params}`, { credentials: 'same-origin' })
+            .then(response => response.json().then(data => ({ ok: response.ok, data })))
+            .then(({ ok, data }) => {
+                // Ignore pages of a query that was replaced by a new sort
+                if (generation !== this.generation) {
+                    return;
+                }
+                if (!ok) {
+                    throw new Error(data.error || 'Request failed');
+                }
+                this.indexes = Object.fromEntries(data.fields.map((field, index) => [field, index]));
+                this.idIndex = this.indexes.id;
+                this.rows = this.rows.concat(data.rows);
+                this.next = data.next;
+                this.done = !data.next;
+                this.status.textContent = `${this.rows.length}${this.done ? '' : '+'} leads`;
+                this.render();
+            })
+            .catch(error => {
+                this.status.textContent = `Could not load leads: ${error.message}`;
+                this.done = true;
+            })
+            .finally(() => {
+                if (generation === this.generation) {
+                    this.loading = false;
+                    this.onScroll();
+                }
+            });
+    }
+
+    onScroll() {
+        const visibleEnd = Math.ceil((this.viewport.scrollTop + this.height) / this.rowHeight);
+        if (visibleEnd + this.overscan >= this.rows.length) {
+            this.loadMore();
+        }
+        this.render();
+    }
+
+    render() {
+        this.spacer.style.height = `${this.rows.length * this.rowHeight}px`;
+        const first = Math.max(0, Math.floor(this.viewport.scrollTop / this.rowHeight) - this.overscan);
+        const last = Math.min(this.rows.length, first + Math.ceil(this.height / this.rowHeight) + 2 * this.overscan);
+
+        this.body.style.transform = `translateY(${first * this.rowHeight}px)`;
+        this.tbody.innerHTML = this.rows.slice(first, last).map(row => {
+            const id = row[this.idIndex];
+            const cells = this.columns.map(column => {
+                const value = row[this.indexes[column.field]];
+                const html = column.render ? column.render(value, row, this.indexes) : escapeHtml(value);
+                return `<td>${html}</td>`;
+            }).join('');
+            const checked = this.selected.has(id) ? 'checked' : '';
+            return `<tr style="height: ${this.rowHeight}px;"><td style="width: 40px;"><input type="checkbox" class="lead-grid-checkbox" data-id="${id}" ${checked}></td>${cells}</tr>`;
+        }).join('');
+    }
+
+    selectedIds() {
+        return Array.from(this.selected);
+    }
+}
+
+// Format an ISO date or timestamp as MM/DD/YYYY, like the server-rendered tables
+function formatDate(value) {
+    if (!value) {
+        return '';
+    }
+    const [year, month, day] = value.slice(0, 10).split('-');
+    return `${month}/${day}/${year}`;
+}
+
+function escapeHtml(value) {
+    if (value === null || value === undefined) {
+        return '';
+    }
+    return String(value).replace(/[&<>"']/g, char => ({
+        '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+    }[char]));
+}
+
+window.LeadGrid = LeadGrid;
+window.escapeHtml = escapeHtml;
+window.formatDate = formatDate;
@@ -1,237 +1,366 @@
-import pandas as pd
+import base64
+import logging
+import os
 from datetime import datetime
 from io import StringIO
 import csv
+from itertools import islice
 from flask import g
+from sqlalchemy import and_, case, func, select, tuple_
+import reference_data
 from app import db
-from models import Lead, LeadCustomField, WorkspaceHeader, User, Workspace
+from config import LEAD_STATUSES
+from models import Lead, LeadDailyStat
+from exporter import LeadExportPlan
+from lead_stats import UNASSIGNED, day_bounds, stats_generations
+from result_cache import cached
+
+logger = logging.getLogger(__name__)
+
+# Leads fetched per query/cursor batch when exporting
+EXPORT_BATCH_SIZE = 1000
+
+# CSV rows buffered before a chunk is sent to the client
+EXPORT_CHUNK_ROWS = 500
+
+# Lead list page sizes
+DEFAULT_PAGE_SIZE = int(os.environ.get('LEADS_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = 1000
 
 def get_workspace_headers(workspace_id):
-    """Get all headers for a workspace"""
-    headers = WorkspaceHeader.query.filter_by(workspace_id=workspace_id).order_by(WorkspaceHeader.order).all()
-    return headers
+    """Get all headers for a workspace, in order, from the reference data cache"""
+    return reference_data.workspace_headers(workspace_id)
 
-def process_csv_upload(file_data, workspace_id, header_mapping):
+def process_csv_upload(file_data, workspace_id, header_mapping, batch_size=None,
+                       chunk_size=None, result=None, skip_rows=0, on_batch=None,
+                       dedupe_policy='none', dedupe_on='email_or_phone'):
     """Process CSV upload with custom header mapping
     
+    Rows are validated before they reach the database and written in
+    committed batches by BulkLeadImporter, so a bad row only costs itself.
+    
     Args:
-        file_data: The CSV file data
+        file_data: The CSV file path, file object or bytes
         workspace_id: The workspace ID to associate leads with
         header_mapping: Dictionary mapping CSV headers to database fields
+        batch_size: Number of rows written per INSERT/commit (default importer.DEFAULT_BATCH_SIZE)
+        chunk_size: Number of rows read from the file at a time (default csv_stream.DEFAULT_CHUNK_SIZE)
+        result: Optional ImportResult to accumulate into (used when resuming)
+        skip_rows: Number of leading data rows already imported
+        on_batch: Optional callable(result, last_row) run before each batch commits
+        dedupe_policy: What to do with rows matching an existing lead ('none', 'skip', 'update', 'flag')
+        dedupe_on: Key used to match existing leads ('email', 'phone', 'email_or_phone')
     
     Returns:
         tuple: (success_count, error_count, errors)
     """
-    success_count = 0
-    error_count = 0
-    errors = []
+    # The import engine needs pandas; only import workers and scripts pay for loading it
+    from importer import BulkLeadImporter, ImportAborted, ImportResult, DEFAULT_BATCH_SIZE
+    from csv_stream import iter_csv_chunks, DEFAULT_CHUNK_SIZE
+    
+    result = result or ImportResult()
     
     try:
-        # Read CSV data - handle file paths, file objects, and bytes
-        if isinstance(file_data, str):
-            # It's a file path
-            df = pd.read_csv(file_data)
-        elif hasattr(file_data, 'read'):
-            # It's a file-like object
-            df = pd.read_csv(file_data)
-        else:
-            # It's already read bytes
-            csv_data = file_data.decode('utf-8') if isinstance(file_data, bytes) else file_data
-            df = pd.read_csv(StringIO(csv_data))
-        
         # Get workspace headers
         workspace_headers = {h.header_name: h for h in get_workspace_headers(workspace_id)}
         
-        # Process each row as a separate transaction
-        for index, row in df.iterrows():
-            # Start a new transaction for each lead
-            db.session.begin_nested()
-            
-            try:
-                # Create new lead with default fields
-                lead = Lead(
-                    workspace_id=workspace_id,
-                    created_at=datetime.utcnow()
-                )
-                
-                # Map CSV columns to lead fields based on header_mapping
-                for csv_header, db_field in header_mapping.items():
-                    if csv_header in row and db_field in ['first_name', 'last_name', 'email', 'phone', 'city', 'state', 'status', 'bank']:
-                        # Handle NaN values
-                        if pd.isna(row[csv_header]):
-                            setattr(lead, db_field, None)
-                        else:
-                            setattr(lead, db_field, row[csv_header])
-                    elif csv_header in row and db_field == 'date':
-                        try:
-                            # Try to parse the date
-                            date_str = str(row[csv_header])
-                            if pd.isna(row[csv_header]) or date_str.lower() in ['nat', 'nan', '', 'none', 'null']:
-                                lead.date = None
-                            else:
-                                date_val = pd.to_datetime(row[csv_header]).date()
-                                lead.date = date_val
-                        except:
-                            # If date parsing fails, set to None
-                            lead.date = None
-                
-                # Add to session
-                db.session.add(lead)
-                db.session.flush()  # Get the lead ID without committing transaction
-                
-                # Process custom fields
-                for csv_header, header_name in header_mapping.items():
-                    if csv_header in row and header_name in workspace_headers and header_name not in ['first_name', 'last_name', 'email', 'phone', 'city', 'state', 'status', 'bank', 'date']:
-                        # Create custom field
-                        custom_field = LeadCustomField(
-                            lead_id=lead.id,
-                            header_id=workspace_headers[header_name].id,
-                            value=str(row[csv_header]) if not pd.isna(row[csv_header]) else None
-                        )
-                        db.session.add(custom_field)
-                
-                success_count += 1
-                
-            except Exception as e:
-                error_count += 1
-                import traceback
-                error_detail = traceback.format_exc()
-                print(f"Error on row {index+1}: {str(e)}\n{error_detail}")
-                errors.append(f"Error processing row {index+1}: {str(e)}")
-                # Rollback this record but continue with others
-                db.session.rollback()
+        importer = BulkLeadImporter(workspace_id, header_mapping, workspace_headers,
+                                    batch_size=batch_size or DEFAULT_BATCH_SIZE, on_batch=on_batch,
+                                    dedupe_policy=dedupe_policy, dedupe_on=dedupe_on)
+        
+        # Stream the file in fixed-size chunks so memory stays flat as files grow
+        row_offset = 0
+        for chunk in iter_csv_chunks(file_data, chunk_size=chunk_size or DEFAULT_CHUNK_SIZE):
+            if row_offset + len(chunk) <= skip_rows:
+                row_offset += len(chunk)
+                continue
+            if row_offset < skip_rows:
+                chunk = chunk.iloc[skip_rows - row_offset:]
+                row_offset = skip_rows
+            importer.import_dataframe(chunk, result, row_offset)
+            row_offset += len(chunk)
+        result.finish()
         
-        if success_count > 0:
-            try:
-                # Commit all successful leads
-                db.session.commit()
-            except Exception as e:
-                # If commit fails, rollback and report error
-                db.session.rollback()
-                import traceback
-                error_detail = traceback.format_exc()
-                print(f"Error committing batch: {str(e)}\n{error_detail}")
-                return 0, error_count + success_count, [f"Database error: {str(e)}"] + errors
+        logger.info("Imported %s leads (%s errors, %s duplicates skipped, %s updated, %s flagged) in %.2fs, %.0f rows/sec",
+                    result.success_count, result.error_count, result.skipped_count, result.updated_count,
+                    result.flagged_count, result.elapsed, result.rows_per_second)
         
-        return success_count, error_count, errors
+        return result.as_tuple()
         
+    except ImportAborted:
+        db.session.rollback()
+        raise
     except Exception as e:
-        # Rollback on any error
+        # Rollback the current batch; batches already committed stay imported
         db.session.rollback()
-        import traceback
-        error_msg = f"Error processing CSV: {str(e)}\n{traceback.format_exc()}"
-        print(error_msg)  # Log to console for debugging
-        return 0, 1, [f"Error processing CSV: {str(e)}"]
+        logger.exception("Error processing CSV")
+        result.fail(f"Error processing CSV: {str(e)}")
+        return result.as_tuple()
 
-def export_leads_to_csv(leads, workspace_id):
-    """Export leads to CSV based on workspace headers
+class KeysetPage:
+    """One page of a keyset-paginated lead list"""
+    
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor  # Pass as 'after' to get older leads
+        self.prev_cursor = prev_cursor  # Pass as 'before' to get newer leads
+
+def encode_cursor(lead):
+    """Opaque cursor for a lead's position in (created_at, id) order"""
+    raw = f"{lead.created_at.isoformat()}|{lead.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Turn a cursor back into (created_at, id), or None if it is not valid"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, lead_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(lead_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def page_size(value):
+    """Clamp a requested page size to 1..MAX_PAGE_SIZE, defaulting to DEFAULT_PAGE_SIZE"""
+    if not value or value < 1:
+        return DEFAULT_PAGE_SIZE
+    return min(value, MAX_PAGE_SIZE)
+
+def keyset_paginate(query, after=None, before=None, per_page=DEFAULT_PAGE_SIZE):
+    """Fetch one page of leads, newest first, by seeking on (created_at, id)
+    
+    The query seeks to the cursor through the (created_at, id) index instead of
+    using OFFSET, so every page costs the same as the first.
     
     Args:
-        leads: List of Lead objects to export
-        workspace_id: Workspace ID to get headers from
+        query: Filtered Lead query
+        after: Cursor of the last lead of the previous page (older leads follow)
+        before: Cursor of the first lead of the next page (newer leads precede)
+        per_page: Number of leads per page
     
     Returns:
-        StringIO object with CSV data
+        KeysetPage
+    """
+    key = tuple_(Lead.created_at, Lead.id)
+    after, before = decode_cursor(after), decode_cursor(before)
+    
+    if before:
+        # Walk backwards from the cursor, then restore newest-first order
+        rows = (
+            query.filter(key > before)
+            .order_by(Lead.created_at.asc(), Lead.id.asc())
+            .limit(per_page + 1)
+            .all()
+        )
+        if len(rows) <= per_page:
+            # Back at the newest leads: show a full first page
+            return keyset_paginate(query, per_page=per_page)
+        items = rows[:per_page][::-1]
+        has_newer = has_older = True
+    else:
+        if after:
+            query = query.filter(key < after)
+        rows = query.order_by(Lead.created_at.desc(), Lead.id.desc()).limit(per_page + 1).all()
+        has_older = len(rows) > per_page
+        items = rows[:per_page]
+        has_newer = after is not None
+    
+    return KeysetPage(
+        items,
+        per_page,
+        next_cursor=encode_cursor(items[-1]) if items and has_older else None,
+        prev_cursor=encode_cursor(items[0]) if items and has_newer else None
+    )
+
+def iter_leads_by_ids(lead_ids, *criteria):
+    """Yield the leads with the given ids in id order without loading them all at once
+    
+    Args:
+        lead_ids: Lead ids (ints or numeric strings)
+        criteria: Extra filters, e.g. Lead.assigned_to == user_id
+    
+    Yields:
+        Lead objects
     """
-    headers = get_workspace_headers(workspace_id)
-    header_names = [h.header_name for h in headers]
+    ids = sorted({int(lead_id) for lead_id in lead_ids})
+    for start in range(0, len(ids), EXPORT_BATCH_SIZE):
+        query = (
+            select(Lead)
+            .filter(Lead.id.in_(ids[start:start + EXPORT_BATCH_SIZE]), *criteria)
+            .order_by(Lead.id)
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        yield from db.session.scalars(query)
+
+def lead_workspace_ids(lead_ids, *criteria):
+    """Get the distinct workspace ids of the given leads without loading the leads"""
+    ids = sorted({int(lead_id) for lead_id in lead_ids})
+    workspace_ids = set()
+    for start in range(0, len(ids), EXPORT_BATCH_SIZE):
+        rows = (
+            db.session.query(Lead.workspace_id)
+            .filter(Lead.id.in_(ids[start:start + EXPORT_BATCH_SIZE]), *criteria)
+            .distinct()
+        )
+        workspace_ids.update(workspace_id for (workspace_id,) in rows)
+    return workspace_ids
+
+def stream_leads_csv(leads, workspace_id):
+    """Export leads to CSV based on workspace headers, a chunk at a time
+    
+    Args:
+        leads: Iterable of Lead objects, ideally a streaming query
+        workspace_id: Workspace ID to get headers from
     
-    # Create CSV output
+    Yields:
+        str chunks of CSV data
+    """
+    plan = LeadExportPlan([header.header_name for header in get_workspace_headers(workspace_id)])
+    
+    # Rows are buffered only until the next chunk is sent
     output = StringIO()
     writer = csv.writer(output)
     
     # Write header row
-    writer.writerow(header_names)
-    
-    # Write data rows
-    for lead in leads:
-        row = []
-        for header in headers:
-            if header.header_name == 'first_name':
-                row.append(lead.first_name or '')
-            elif header.header_name == 'last_name':
-                row.append(lead.last_name or '')
-            elif header.header_name == 'email':
-                row.append(lead.email or '')
-            elif header.header_name == 'phone':
-                row.append(lead.phone or '')
-            elif header.header_name == 'city':
-                row.append(lead.city or '')
-            elif header.header_name == 'state':
-                row.append(lead.state or '')
-            elif header.header_name == 'status':
-                row.append(lead.status or '')
-            elif header.header_name == 'bank':
-                row.append(lead.bank or '')
-            elif header.header_name == 'date':
-                row.append(lead.date.strftime('%m/%d/%Y') if lead.date else '')
-            elif header.header_name == 'assigned_to':
-                user = User.query.get(lead.assigned_to) if lead.assigned_to else None
-                row.append(user.username if user else '')
-            elif header.header_name == 'workspace':
-                workspace = Workspace.query.get(lead.workspace_id)
-                row.append(workspace.name if workspace else '')
-            else:
-                # Look for custom field
-                custom_field = next((cf for cf in lead.custom_fields if cf.header.header_name == header.header_name), None)
-                row.append(custom_field.value if custom_field else '')
-        
-        writer.writerow(row)
+    writer.writerow(plan.header_names)
+    yield output.getvalue()
+    output.seek(0)
+    output.truncate()
     
+    # Write data rows, loading what each chunk needs in bulk
+    leads = iter(leads)
+    while True:
+        batch = list(islice(leads, EXPORT_CHUNK_ROWS))
+        if not batch:
+            break
+        writer.writerows(plan.rows(batch))
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+
+def export_leads_to_csv(leads, workspace_id):
+    """Export leads to CSV based on workspace headers
+    
+    Args:
+        leads: List of Lead objects to export
+        workspace_id: Workspace ID to get headers from
+    
+    Returns:
+        StringIO object with CSV data
+    """
+    output = StringIO()
+    for chunk in stream_leads_csv(leads, workspace_id):
+        output.write(chunk)
     output.seek(0)
     return output
 
-def get_lead_stats(start_date=None, end_date=None, workspace_id=None):
-    """Get lead statistics
+def _empty_stats():
+    return {
+        'total': 0,
+        'assigned': 0,
+        'unassigned': 0,
+        'status_breakdown': {status: 0 for status in LEAD_STATUSES},
+        'workspace_breakdown': {},
+        'user_breakdown': {}
+    }
+
+def _window_condition(start_date, end_date):
+    first_day, last_day = day_bounds(start_date, end_date)
+    conditions = []
+    if first_day:
+        conditions.append(LeadDailyStat.day >= first_day)
+    if last_day:
+        conditions.append(LeadDailyStat.day <= last_day)
+    return and_(*conditions) if conditions else None
+
+def get_lead_stats_windows(windows, workspace_id=None):
+    """Get lead statistics for several date windows at once
+    
+    Results are served from the result cache until a lead write in the
+    workspace (or any workspace, when unfiltered) invalidates them.
     
     Args:
-        start_date: Optional start date filter
-        end_date: Optional end date filter
+        windows: List of (start_date, end_date) pairs, either of which may be None
         workspace_id: Optional workspace filter
     
     Returns:
-        Dictionary with lead statistics
+        List of statistics dictionaries (see get_lead_stats), one per window
     """
-    query = Lead.query
+    return cached(
+        'lead_stats',
+        stats_generations(workspace_id),
+        [windows, workspace_id],
+        lambda: _compute_lead_stats_windows(windows, workspace_id)
+    )
+
+def _compute_lead_stats_windows(windows, workspace_id=None):
+    """Compute lead statistics for several date windows in one query
     
-    # Apply filters
-    if start_date:
-        query = query.filter(Lead.created_at >= start_date)
-    if end_date:
-        query = query.filter(Lead.created_at <= end_date)
+    Counts come from the lead_daily_stats rollup (see lead_stats.py) in a
+    single GROUP BY with one conditional sum per window, plus one query each
+    for user and workspace names, so the cost depends on the number of days
+    and dimensions rather than on the number of leads. Windows are resolved
+    to whole days.
+    """
+    conditions = [_window_condition(start_date, end_date) for start_date, end_date in windows]
+    counts = [
+        func.sum(case((condition, LeadDailyStat.lead_count), else_=0)) if condition is not None
+        else func.sum(LeadDailyStat.lead_count)
+        for condition in conditions
+    ]
+    
+    query = (
+        db.session.query(LeadDailyStat.workspace_id, LeadDailyStat.assigned_to, LeadDailyStat.status, *counts)
+        .group_by(LeadDailyStat.workspace_id, LeadDailyStat.assigned_to, LeadDailyStat.status)
+    )
     if workspace_id:
-        query = query.filter(Lead.workspace_id == workspace_id)
+        query = query.filter(LeadDailyStat.workspace_id == workspace_id)
     
-    # Total leads
-    total_leads = query.count()
+    # Only read the days covered by the windows when every window is bounded
+    bounds = [day_bounds(start_date, end_date) for start_date, end_date in windows]
+    if all(first_day for first_day, _ in bounds):
+        query = query.filter(LeadDailyStat.day >= min(first_day for first_day, _ in bounds))
+    if all(last_day for _, last_day in bounds):
+        query = query.filter(LeadDailyStat.day <= max(last_day for _, last_day in bounds))
     
-    # Assigned/unassigned counts
-    assigned_count = query.filter(Lead.assigned_to.isnot(None)).count()
-    unassigned_count = total_leads - assigned_count
+    results = [_empty_stats() for _ in windows]
+    by_workspace = [{} for _ in windows]
+    by_user = [{} for _ in windows]
+    for lead_workspace_id, assigned_to, status, *window_counts in query:
+        for stats, workspace_counts, user_counts, count in zip(results, by_workspace, by_user, window_counts):
+            if not count:
+                continue
+            stats['total'] += count
+            if assigned_to != UNASSIGNED:
+                stats['assigned'] += count
+                user_counts[assigned_to] = user_counts.get(assigned_to, 0) + count
+            if status in stats['status_breakdown']:
+                stats['status_breakdown'][status] += count
+            workspace_counts[lead_workspace_id] = workspace_counts.get(lead_workspace_id, 0) + count
     
-    # Status breakdown
-    status_breakdown = {}
-    for status in ['New', 'Contacted', 'Qualified', 'Proposal', 'Negotiation', 'Won', 'Lost']:
-        status_breakdown[status] = query.filter(Lead.status == status).count()
+    # Breakdowns list every workspace and user, including those without leads
+    workspaces = [] if workspace_id else reference_data.workspace_names().items()
+    users = reference_data.user_names().items()
+    for stats, workspace_counts, user_counts in zip(results, by_workspace, by_user):
+        stats['unassigned'] = stats['total'] - stats['assigned']
+        for id_, name in workspaces:
+            stats['workspace_breakdown'][name] = workspace_counts.get(id_, 0)
+        for id_, username in users:
+            stats['user_breakdown'][username] = user_counts.get(id_, 0)
     
-    # Workspace breakdown (if not filtered by workspace)
-    workspace_breakdown = {}
-    if not workspace_id:
-        workspaces = Workspace.query.all()
-        for workspace in workspaces:
-            workspace_breakdown[workspace.name] = query.filter(Lead.workspace_id == workspace.id).count()
+    return results
+
+def get_lead_stats(start_date=None, end_date=None, workspace_id=None):
+    """Get lead statistics
     
-    # Leads by user
-    user_breakdown = {}
-    users = User.query.all()
-    for user in users:
-        user_breakdown[user.username] = query.filter(Lead.assigned_to == user.id).count()
+    Args:
+        start_date: Optional start date filter
+        end_date: Optional end date filter
+        workspace_id: Optional workspace filter
     
-    return {
-        'total': total_leads,
-        'assigned': assigned_count,
-        'unassigned': unassigned_count,
-        'status_breakdown': status_breakdown,
-        'workspace_breakdown': workspace_breakdown,
-        'user_breakdown': user_breakdown
-    }
+    Returns:
+        Dictionary with lead statistics
+    """
+    return get_lead_stats_windows([(start_date, end_date)], workspace_id)[0]
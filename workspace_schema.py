@@ -0,0 +1,210 @@
+"""
+Workspace header changes.
+
+Editing a workspace diffs the submitted header list against the headers it
+has and applies only what changed: new headers are added, renamed and moved
+headers are updated in place, and removed headers are marked dropped. Header
+ids never change, so the custom field values that point at them stay valid
+and a save costs one statement per changed header however many leads the
+workspace has.
+
+A dropped header disappears from the application at once (every header
+lookup skips it), but its values are only removed afterwards, one committed
+chunk at a time, by the import workers when they have no import to run.
+The same can be done by hand:
+
+    python workspace_schema.py
+"""
+import logging
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import delete, select, update
+
+import custom_fields
+from app import db
+from config import DEFAULT_LEAD_FIELDS
+from lead_search import index_leads
+from models import Lead, LeadCustomField, WorkspaceHeader
+
+logger = logging.getLogger(__name__)
+
+# Values or leads cleaned per purge transaction
+PURGE_CHUNK_SIZE = 1000
+
+HeaderChanges = namedtuple('HeaderChanges', ['added', 'renamed', 'reordered', 'dropped'])
+
+
+def diff_headers(existing, submitted):
+    """Work out how a workspace's headers change
+
+    A submitted header keeps the id it was submitted with; one without an id
+    (a new row, or a form that does not send ids) takes over an unclaimed
+    existing header with the same name, so unchanged headers keep their
+    values either way.
+
+    Args:
+        existing: The workspace's current headers (anything with id, header_name and order)
+        submitted: List of (header id or None, header name) in the new display order
+
+    Returns:
+        HeaderChanges: added is a list of (name, order); renamed and reordered
+        are lists of (header, new value); dropped is a list of headers
+    """
+    by_id = {header.id: header for header in existing}
+    claimed = {}
+    unmatched = []
+    for order, (header_id, name) in enumerate(submitted):
+        header = by_id.get(header_id)
+        if header is not None and header.id not in claimed:
+            claimed[header.id] = (header, name, order)
+        else:
+            unmatched.append((name, order))
+
+    by_name = {}
+    for header in existing:
+        if header.id not in claimed:
+            by_name.setdefault(header.header_name, []).append(header)
+
+    added = []
+    for name, order in unmatched:
+        if by_name.get(name):
+            header = by_name[name].pop(0)
+            claimed[header.id] = (header, name, order)
+        else:
+            added.append((name, order))
+
+    renamed = [(header, name) for header, name, order in claimed.values() if header.header_name != name]
+    reordered = [(header, order) for header, name, order in claimed.values() if header.order != order]
+    dropped = [header for header in existing if header.id not in claimed]
+    return HeaderChanges(added, renamed, reordered, dropped)
+
+
+def apply_header_changes(workspace_id, submitted):
+    """Bring a workspace's headers in line with a submitted list, in the caller's transaction
+
+    Args:
+        workspace_id: Workspace id
+        submitted: List of (header id or None, header name) in display order; empty names are skipped
+
+    Returns:
+        HeaderChanges that were applied
+    """
+    submitted = [(header_id, name) for header_id, name in submitted if name]
+    existing = WorkspaceHeader.query.filter_by(workspace_id=workspace_id, dropped_at=None).all()
+    changes = diff_headers(existing, submitted)
+
+    for name, order in changes.added:
+        db.session.add(WorkspaceHeader(workspace_id=workspace_id, header_name=name,
+                                       is_default=name in DEFAULT_LEAD_FIELDS, order=order))
+    for header, name in changes.renamed:
+        header.header_name = name
+        header.is_default = name in DEFAULT_LEAD_FIELDS
+    for header, order in changes.reordered:
+        header.order = order
+    now = datetime.utcnow()
+    for header in changes.dropped:
+        header.dropped_at = now
+        header.purged_through = 0
+    db.session.flush()
+
+    logger.info("Workspace %s headers: %s added, %s renamed, %s reordered, %s dropped", workspace_id,
+                len(changes.added), len(changes.renamed), len(changes.reordered), len(changes.dropped))
+    return changes
+
+
+def _strip_custom_data(header):
+    """Remove a dropped header's key from the next chunk of its workspace's leads
+
+    Returns:
+        List of lead ids changed, or None once every lead has been cleaned
+    """
+    rows = db.session.execute(
+        select(Lead.id, Lead.custom_data)
+        .where(Lead.workspace_id == header.workspace_id, Lead.id > header.purged_through)
+        .order_by(Lead.id).limit(PURGE_CHUNK_SIZE)
+    ).all()
+    if not rows:
+        return None
+
+    key = str(header.id)
+    values = [{'id': lead_id, 'custom_data': {k: v for k, v in data.items() if k != key} or None}
+              for lead_id, data in rows if data and key in data]
+    if values:
+        db.session.execute(update(Lead), values)
+
+    # Another worker may be purging the same header; only one of them may move the cursor.
+    # Core statements on the table, as dropped headers are no longer in the reference data cache
+    table = WorkspaceHeader.__table__
+    moved = db.session.execute(
+        table.update()
+        .where(table.c.id == header.id, table.c.purged_through == header.purged_through)
+        .values(purged_through=rows[-1][0])
+    )
+    if moved.rowcount != 1:
+        db.session.rollback()
+        return []
+    return [value['id'] for value in values]
+
+
+def purge_next_chunk():
+    """Clean one chunk of the values of a dropped header, and commit
+
+    Values are deleted from lead_custom_fields first, then removed from
+    leads.custom_data, and the affected leads are re-indexed for search. Once
+    nothing is left the header row itself is deleted.
+
+    Returns:
+        True if there was anything to purge
+    """
+    header = db.session.scalars(
+        select(WorkspaceHeader).where(WorkspaceHeader.dropped_at.isnot(None))
+        .order_by(WorkspaceHeader.dropped_at, WorkspaceHeader.id).limit(1)
+    ).first()
+    if header is None:
+        return False
+
+    rows = db.session.execute(
+        select(LeadCustomField.id, LeadCustomField.lead_id)
+        .where(LeadCustomField.header_id == header.id).limit(PURGE_CHUNK_SIZE)
+    ).all()
+    if rows:
+        db.session.execute(
+            delete(LeadCustomField).where(LeadCustomField.id.in_([row[0] for row in rows]))
+            .execution_options(synchronize_session=False)
+        )
+        index_leads(row[1] for row in rows)
+        db.session.commit()
+        return True
+
+    if custom_fields.writes_json():
+        lead_ids = _strip_custom_data(header)
+        if lead_ids is not None:
+            index_leads(lead_ids)
+            db.session.commit()
+            return True
+
+    logger.info("Purged dropped header %s (%s) of workspace %s", header.id, header.header_name, header.workspace_id)
+    table = WorkspaceHeader.__table__
+    db.session.execute(table.delete().where(table.c.id == header.id))
+    db.session.commit()
+    return True
+
+
+def purge_dropped_headers():
+    """Purge every dropped header to completion, one committed chunk at a time
+
+    Returns:
+        Number of chunks processed
+    """
+    chunks = 0
+    while purge_next_chunk():
+        chunks += 1
+    return chunks
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    with create_app().app_context():
+        print(f"Purged dropped headers in {purge_dropped_headers()} chunks")